@@ -0,0 +1,54 @@
+"""
+调度开销基准测试: 使用 MemoryScheduler 和不发起网络请求的 fetch,
+统计引擎每秒能分发多少个请求
+
+python benchmarks/bench_dispatch.py -n 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smallder import Spider, Request, Response  # noqa: E402
+
+
+def fetch(request):
+    return Response(content=b"", status_code=200, request=request)
+
+
+class DispatchSpider(Spider):
+    name = "bench_dispatch"
+    fastapi = False
+    total = 0
+    done = 0
+    finished_at = 0
+
+    def start_requests(self):
+        for i in range(self.total):
+            yield Request(url=f"https://bench.example.com/{i}", fetch=fetch)
+
+    def parse(self, response):
+        DispatchSpider.done += 1
+        DispatchSpider.finished_at = time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count() * 2)
+    args = parser.parse_args()
+
+    DispatchSpider.log.remove()
+    DispatchSpider.total = args.number
+    DispatchSpider.thread_count = args.threads
+    started_at = time.perf_counter()
+    DispatchSpider.start()
+    elapsed = DispatchSpider.finished_at - started_at
+    print(f"requests: {DispatchSpider.done}  threads: {args.threads}  "
+          f"elapsed: {elapsed:.2f}s  dispatch: {DispatchSpider.done / elapsed:.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+去重过滤器基准测试: 对比 MemoryFilter 和 MemoryBloomFilter 的内存占用和查询速度,
+传入 --redis 时同时对比 RedisFilter 和 RedisBloomFilter
+
+python benchmarks/bench_dupfilter.py -n 1000000
+python benchmarks/bench_dupfilter.py -n 100000 --redis redis://localhost:6379/15
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smallder import Request  # noqa: E402
+from smallder.core.connection import from_redis_setting  # noqa: E402
+from smallder.core.dupfilter import MemoryFilter, MemoryBloomFilter, RedisFilter, RedisBloomFilter  # noqa: E402
+
+
+def make_requests(number):
+    # 查询速度包含计算请求指纹的时间
+    return [Request(url=f"https://www.example.com/item/{i}?page={i % 100}") for i in range(number)]
+
+
+def bench(name, create_filter, requests, measure_memory=True):
+    memory = ""
+    if measure_memory:
+        # tracemalloc 会拖慢内存分配,内存和速度分开统计
+        tracemalloc.start()
+        dup_filter = create_filter()
+        for request in requests:
+            dup_filter.request_seen(request)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del dup_filter
+        memory = f"memory: {current / 1024 / 1024:8.2f} MB ({current / len(requests):6.1f} B/request)"
+    dup_filter = create_filter()
+    started_at = time.perf_counter()
+    for request in requests:
+        dup_filter.request_seen(request)
+    elapsed = time.perf_counter() - started_at
+    seen = sum(dup_filter.request_seen(request) for request in requests[:10000])
+    print(f"{name:<20} {len(requests) / elapsed:10.0f} lookups/s  {memory}  recheck seen: {seen}/10000")
+
+
+def memory_filter():
+    MemoryFilter.fingerprints = set()
+    return MemoryFilter()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=1000000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--redis", default="", help="redis://host:port/db, 会写入测试key")
+    args = parser.parse_args()
+
+    requests = make_requests(args.number)
+    bench("MemoryFilter", memory_filter, requests)
+    bench("MemoryBloomFilter", lambda: MemoryBloomFilter(capacity=args.number, error_rate=args.error_rate), requests)
+
+    if args.redis:
+        server = from_redis_setting(args.redis)
+        server.delete("bench:dupfilter", "bench:bloomfilter:0")
+        bench("RedisFilter", lambda: RedisFilter(server, "bench:dupfilter"), requests, measure_memory=False)
+        bench("RedisBloomFilter", lambda: RedisBloomFilter(server, "bench:bloomfilter", capacity=args.number,
+                                                           error_rate=args.error_rate), requests, measure_memory=False)
+        print(f"redis memory  RedisFilter: {server.memory_usage('bench:dupfilter') / 1024 / 1024:.2f} MB  "
+              f"RedisBloomFilter: {server.memory_usage('bench:bloomfilter:0') / 1024 / 1024:.2f} MB")
+        server.delete("bench:dupfilter", "bench:bloomfilter:0")
+
+
+if __name__ == "__main__":
+    main()
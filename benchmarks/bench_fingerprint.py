@@ -0,0 +1,100 @@
+"""
+请求指纹基准测试: 在模拟的真实url集合上对比旧版 sha1+json 指纹和当前指纹的速度,
+并检查两者对请求是否重复的判断完全一致
+
+python benchmarks/bench_fingerprint.py -n 200000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from w3lib.url import canonicalize_url  # noqa: E402
+
+from smallder import Request  # noqa: E402
+from smallder.utils.request import fingerprint, to_unicode  # noqa: E402
+
+
+def legacy_fingerprint(request, keep_fragments=True):
+    """旧版实现: 拼接dict后 json.dumps, 再计算 sha1"""
+
+    def process_data(data):
+        if isinstance(data, dict):
+            return json.dumps(data, sort_keys=True)
+        return data or ""
+
+    fingerprint_data = {
+        "method": to_unicode(request.method),
+        "url": canonicalize_url(request.url, keep_fragments=keep_fragments),
+        "body": process_data(request.data).encode("utf-8").hex(),
+        "json": process_data(request.json).encode("utf-8").hex(),
+        "params": process_data(request.params).encode("utf-8").hex(),
+    }
+    fingerprint_json = json.dumps(fingerprint_data, sort_keys=True)
+    return hashlib.sha1(fingerprint_json.encode()).digest().hex()
+
+
+def make_corpus(number, seed=0):
+    """
+    模拟一次广度爬取: 少量站点, 列表页带分页和乱序参数, 详情页带追踪参数, 少量POST接口和重复链接
+    """
+    rnd = random.Random(seed)
+    hosts = [f"https://www.site{i}.com" for i in range(20)] + [f"https://shop{i}.example.cn" for i in range(10)]
+    categories = ["news", "sports", "tech", "商品", "category/shoes", "category/bags", "list"]
+    requests = []
+    for _ in range(number):
+        host = rnd.choice(hosts)
+        kind = rnd.random()
+        if kind < 0.35:
+            params = [f"page={rnd.randint(1, 500)}", f"sort={rnd.choice(['new', 'hot'])}", "size=20"]
+            rnd.shuffle(params)
+            url = f"{host}/{rnd.choice(categories)}?{'&'.join(params)}"
+            requests.append(Request(url=url))
+        elif kind < 0.75:
+            url = f"{host}/item/{rnd.randint(1, 10 ** 6)}.html?utm_source={rnd.choice(['a', 'b'])}&spm=a{rnd.randint(1, 99)}"
+            requests.append(Request(url=url))
+        elif kind < 0.85:
+            url = f"{host}/search?q={rnd.choice(['手机', 'a+b', 'shoes%20red', 'x y'])}&p={rnd.randint(1, 50)}"
+            requests.append(Request(url=url))
+        elif kind < 0.95:
+            requests.append(Request(url=f"{host}/api/list", method="post",
+                                    data={"page": rnd.randint(1, 1000), "size": 20}))
+        else:
+            requests.append(rnd.choice(requests).copy() if requests else Request(url=host))
+    return requests
+
+
+def bench(name, func, requests):
+    started_at = time.perf_counter()
+    fps = [func(request) for request in requests]
+    elapsed = time.perf_counter() - started_at
+    print(f"{name:<20} {elapsed / len(requests) * 1e6:8.2f} us/request  {len(requests) / elapsed:10.0f} requests/s")
+    return fps, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    requests = make_corpus(args.number)
+    legacy, legacy_elapsed = bench("legacy sha1+json", legacy_fingerprint, requests)
+    current, current_elapsed = bench("fingerprint", fingerprint, requests)
+    print(f"speedup: {legacy_elapsed / current_elapsed:.2f}x")
+
+    # 两种实现对 "是否重复" 的判断必须一致: 旧指纹相同 <=> 新指纹相同
+    mapping = {}
+    consistent = all(mapping.setdefault(old, new) == new for old, new in zip(legacy, current))
+    consistent = consistent and len(set(legacy)) == len(set(current))
+    print(f"unique requests: {len(set(current))}  same dedup decisions as legacy: {consistent}")
+    # 重新计算一次,确认结果稳定
+    print(f"stable across runs: {current == [fingerprint(request) for request in requests]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+请求内存基准测试: 在 MemoryScheduler 使用的优先级队列中放入大量请求, 用 tracemalloc 统计每个请求占用的内存,
+同时统计创建请求和 copy/replace 的耗时
+
+python benchmarks/bench_memory.py -n 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smallder import Spider, Request  # noqa: E402
+from smallder.core.queues import PriorityQueue  # noqa: E402
+
+# 爬虫中常见的写法: 所有请求使用同一个 headers
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+}
+
+
+class MemorySpider(Spider):
+    name = "bench_memory"
+
+    def parse_detail(self, response):
+        pass
+
+
+def fill(spider, number, with_meta):
+    queue = PriorityQueue()
+    callback = spider.parse_detail
+    for i in range(number):
+        meta = {"page": i // 20} if with_meta else None
+        queue.put(Request(url=f"https://bench.example.com/item/{i}", headers=HEADERS, callback=callback, meta=meta))
+    return queue
+
+
+def measure(name, spider, number, with_meta):
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    queue = fill(spider, number, with_meta)
+    elapsed = time.perf_counter() - started_at
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<22} total: {current / 1024 ** 2:8.1f} MiB  per request: {current / number:6.0f} B  "
+          f"fill: {elapsed / number * 1e6:5.2f} us")
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=1000000)
+    args = parser.parse_args()
+
+    spider = MemorySpider()
+    measure("requests", spider, args.number, with_meta=False)
+    queue = measure("requests + meta", spider, args.number, with_meta=True)
+
+    request = queue.get()
+    started_at = time.perf_counter()
+    for _ in range(100000):
+        request.copy()
+    copied_at = time.perf_counter()
+    for _ in range(100000):
+        request.replace(priority=1)
+    replaced_at = time.perf_counter()
+    print(f"copy: {(copied_at - started_at) * 10:.2f} us  replace: {(replaced_at - copied_at) * 10:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
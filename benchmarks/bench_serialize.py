@@ -0,0 +1,89 @@
+"""
+请求序列化基准测试: 对比调度器写入redis时使用的完整json和紧凑格式的大小和速度
+
+python benchmarks/bench_serialize.py -n 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smallder import Spider, Request  # noqa: E402
+from smallder.core.serializer import RequestSerializer  # noqa: E402
+from smallder.utils.request import request_from_dict  # noqa: E402
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+}
+
+
+class SerializeSpider(Spider):
+    name = "bench_serialize"
+
+    def parse_detail(self, response):
+        pass
+
+
+class FakeRedis:
+    """只实现 header profile 需要的命令, 不统计网络开销"""
+
+    def __init__(self):
+        self.data = {}
+
+    def hsetnx(self, key, field, value):
+        self.data.setdefault(field, value)
+
+    def hget(self, key, field):
+        return self.data.get(field)
+
+
+def make_requests(spider, number):
+    return [
+        Request(url=f"https://bench.example.com/item/{i}", headers=dict(HEADERS), callback=spider.parse_detail,
+                meta={"page": i // 20})
+        for i in range(number)
+    ]
+
+
+def run(name, requests, dumps, loads):
+    started_at = time.perf_counter()
+    datas = [dumps(request) for request in requests]
+    dumped_at = time.perf_counter()
+    for data in datas:
+        loads(data)
+    loaded_at = time.perf_counter()
+    size = sum(len(data) for data in datas) / len(datas)
+    print(f"{name:<24} size: {size:6.0f} B  dumps: {(dumped_at - started_at) / len(datas) * 1e6:6.1f} us  "
+          f"loads: {(loaded_at - dumped_at) / len(datas) * 1e6:6.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    spider = SerializeSpider()
+    requests = make_requests(spider, args.number)
+    run("json (to_dict)", requests,
+        lambda request: json.dumps(request.to_dict(spider)).encode(),
+        lambda data: request_from_dict(json.loads(data.decode()), spider))
+    for serializer_format in ("json", "msgpack"):
+        spider.custom_settings = {"request_serializer": serializer_format}
+        try:
+            serializer = RequestSerializer(spider)
+        except ImportError as e:
+            print(f"{serializer_format:<24} skipped: {e}")
+            continue
+        run(serializer_format, requests, serializer.dumps, serializer.loads)
+        serializer = RequestSerializer(spider, server=FakeRedis(), headers_key="headers")
+        run(f"{serializer_format} + header profile", requests, serializer.dumps, serializer.loads)
+
+
+if __name__ == "__main__":
+    main()
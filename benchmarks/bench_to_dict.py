@@ -0,0 +1,85 @@
+"""
+回调名称查找基准测试: 序列化大量请求, 对比每次反射爬虫 (_scan_method) 和按爬虫类缓存的方法表,
+加上 --profile 时用 cProfile 输出 to_dict 的热点
+
+python benchmarks/bench_to_dict.py -n 1000000 --profile
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smallder import Spider, Request  # noqa: E402
+from smallder.core import request as request_module  # noqa: E402
+from smallder.core import serializer as serializer_module  # noqa: E402
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+}
+
+
+class ToDictSpider(Spider):
+    name = "bench_to_dict"
+
+    def parse_detail(self, response):
+        pass
+
+    def parse_error(self, failure):
+        pass
+
+
+def make_requests(spider, number):
+    return [
+        Request(url=f"https://bench.example.com/item/{i}", headers=dict(HEADERS), callback=spider.parse_detail,
+                errback=spider.parse_error, meta={"page": i // 20})
+        for i in range(number)
+    ]
+
+
+def serialize(requests, number, dumps):
+    """循环使用同一批请求, 避免一次创建 number 个请求占用过多内存"""
+    started_at = time.perf_counter()
+    for i in range(number):
+        dumps(requests[i % len(requests)])
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=1000000)
+    parser.add_argument("--profile", action="store_true", help="用 cProfile 统计 to_dict 的耗时分布")
+    args = parser.parse_args()
+
+    spider = ToDictSpider()
+    requests = make_requests(spider, 1000)
+    serializer = serializer_module.RequestSerializer(spider)
+    cases = [
+        ("to_dict", lambda request: request.to_dict(spider)),
+        ("serializer.dumps", serializer.dumps),
+    ]
+    find_method = request_module._find_method
+    scan_number = min(args.number, 50000)  # 反射版本太慢, 只跑一部分后折算
+    for name, dumps in cases:
+        request_module._find_method = serializer_module._find_method = request_module._scan_method
+        scan = serialize(requests, scan_number, dumps) / scan_number
+        request_module._find_method = serializer_module._find_method = find_method
+        cached = serialize(requests, args.number, dumps) / args.number
+        print(f"{name:<18} scan: {scan * 1e6:6.1f} us  registry: {cached * 1e6:6.1f} us  "
+              f"{args.number} requests: {scan * args.number:6.1f} s -> {cached * args.number:6.1f} s")
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        serialize(requests, args.number, cases[0][1])
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(12)
+
+
+if __name__ == "__main__":
+    main()
@@ -51,6 +51,14 @@ setup(
     long_description_content_type="text/markdown",
     license="MIT",
     install_requires=requires,
+    extras_require={
+        "async": ["aiohttp>=3.8.0"],
+        "parquet": ["pyarrow>=8.0.0"],
+        "zstd": ["zstandard>=0.15.0"],
+        "css": ["cssselect>=1.1.0"],
+        "msgpack": ["msgpack>=1.0.0"],
+        "compression": ["brotli>=1.0.9", "backports.zstd>=0.5.0; python_version < '3.14'"],
+    },
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
@@ -5,6 +5,7 @@ import sys
 from smallder.core.item import Item
 from smallder.core.request import Request
 from smallder.core.response import Response
+from smallder.core.selector import Selector, SelectorList
 from smallder.core.spider import Spider
 from smallder.core.downloader import Downloader
 from smallder.core.error import DiscardException,RetryException
@@ -16,7 +17,9 @@ __all__ = [
     "Request",
     "Response",
     "Item",
-    "Downloader"
+    "Downloader",
+    "Selector",
+    "SelectorList",
 ]
 
 __version__ = "0.0.1"
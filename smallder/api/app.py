@@ -1,21 +1,26 @@
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.routing import Route
-from smallder.core.statscollectors import MemoryStatsCollector
+from smallder.api.metrics import render_metrics
+from smallder.core.statscollectors import get_stats_collector
 import uvicorn
 import threading
 
 
 class FastAPIWrapper:
-    def __init__(self, host="0.0.0.0", port=8000, spider=None):
+    def __init__(self, host="0.0.0.0", port=8000, spider=None, engine=None):
         # self.app = FastAPI()
         self.app = Starlette(debug=True, routes=[
             Route('/status', self.get_status, methods=["GET"]),
             Route('/running', self.running, methods=["GET"]),
+            Route('/metrics', self.metrics, methods=["GET"]),
+            Route('/cluster', self.get_cluster_status, methods=["GET"]),
         ])
         self.host = host
         self.port = port
-        self._status = MemoryStatsCollector(spider)
+        self.spider = spider
+        self.engine = engine
+        self._status = get_stats_collector(spider)
 
     async def get_status(self, request):
         # 调用启动爬虫的逻辑
@@ -26,6 +31,28 @@ class FastAPIWrapper:
             }
         )
 
+    async def get_cluster_status(self, request):
+        # 所有节点汇总后的统计, 需要使用 RedisStatsCollector
+        get_cluster_stats = getattr(self._status, "get_cluster_stats", None)
+        if get_cluster_stats is None:
+            return JSONResponse(
+                content={"message": "stats_collector_class does not support cluster stats", "data": None},
+                status_code=404,
+            )
+        return JSONResponse(
+            content={
+                "message": "success",
+                "data": get_cluster_stats()
+            }
+        )
+
+    async def metrics(self, request):
+        # Prometheus 抓取接口
+        return PlainTextResponse(
+            render_metrics(self._status, self.spider, self.engine),
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
     async def running(self, request):
         return JSONResponse(
             content={
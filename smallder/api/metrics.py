@@ -0,0 +1,111 @@
+import re
+
+latency_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 直方图的 le 边界(秒)
+
+# 统计项 -> (指标名, 类型, 说明)
+counter_metrics = {
+    "request": ("smallder_requests_total", "counter", "Finished request tasks"),
+    "response": ("smallder_responses_total", "counter", "Finished response tasks"),
+    "pipeline/items": ("smallder_items_total", "counter", "Items written by the pipeline"),
+    "retry/count": ("smallder_retries_total", "counter", "Retried requests"),
+    "retry/max_reached": ("smallder_retries_exhausted_total", "counter", "Requests that reached max_retry"),
+    "dupfilter/checked": ("smallder_dupfilter_checked_total", "counter", "Requests checked by the dupfilter"),
+    "dupfilter/filtered": ("smallder_dupfilter_filtered_total", "counter", "Requests dropped as duplicates"),
+    "bandwidth/raw_bytes": ("smallder_received_raw_bytes_total", "counter", "Body bytes received before decompression"),
+    "bandwidth/bytes": ("smallder_received_bytes_total", "counter", "Body bytes received after decompression"),
+}
+histogram_metrics = {
+    "response/latency": ("smallder_download_latency_seconds", "Download latency from Response.elapsed"),
+    "pipeline/flush_latency": ("smallder_pipeline_flush_seconds", "Time to write one batch of items"),
+}
+_status_re = re.compile(r"^response/status/(\d+)$")
+_name_re = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def labels(**kwargs):
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in kwargs.items()) + "}"
+
+
+class MetricsWriter:
+    """
+    按 Prometheus text format 0.0.4 输出指标, 同一个指标的所有样本写在一起
+    """
+
+    def __init__(self, spider_name):
+        self.spider_name = spider_name
+        self.families = {}
+
+    def add(self, name, kind, help_text, value, **extra):
+        family = self.families.setdefault(name, (kind, help_text, []))
+        family[2].append(("", labels(spider=self.spider_name, **extra), value))
+
+    def add_histogram(self, name, help_text, histogram):
+        family = self.families.setdefault(name, ("histogram", help_text, []))
+        samples = family[2]
+        spider_labels = labels(spider=self.spider_name)
+        for le in latency_buckets:
+            samples.append(("_bucket", labels(spider=self.spider_name, le=float(le)), histogram.count_le(le)))
+        samples.append(("_bucket", labels(spider=self.spider_name, le="+Inf"), histogram.count))
+        samples.append(("_sum", spider_labels, histogram.sum))
+        samples.append(("_count", spider_labels, histogram.count))
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, label_str, value in samples:
+                lines.append(f"{name}{suffix}{label_str} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+def render_metrics(stats_collector, spider, engine=None):
+    """
+    把统计数据转换为 Prometheus 指标, engine 不为None时还会输出任务池、调度器和 pipline 队列的大小
+    """
+    writer = MetricsWriter(getattr(spider, "name", "") or "")
+    stats = stats_collector.get_stats()
+    histograms = stats_collector.get_histograms()
+    for key, value in stats.items():
+        if key in histograms or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key in counter_metrics:
+            writer.add(*counter_metrics[key], value)
+            continue
+        match = _status_re.match(key)
+        if match:
+            writer.add("smallder_response_status_total", "counter", "Downloaded responses by status code",
+                       value, status=match.group(1))
+            continue
+        # 其他统计项(自定义计数、item 类型、mysql/redis 统计等)
+        writer.add("smallder_stat", "gauge", "Other values from the stats collector", value, key=key)
+    checked = stats.get("dupfilter/checked")
+    if checked:
+        writer.add("smallder_dupfilter_hit_ratio", "gauge", "Share of checked requests that were duplicates",
+                   stats.get("dupfilter/filtered", 0) / checked)
+    for domain, (requests, raw_bytes, size) in stats_collector.get_domains().items():
+        writer.add("smallder_domain_requests_total", "counter", "Downloaded responses per domain",
+                   requests, domain=domain)
+        writer.add("smallder_domain_received_raw_bytes_total", "counter",
+                   "Body bytes received per domain before decompression", raw_bytes, domain=domain)
+        writer.add("smallder_domain_received_bytes_total", "counter",
+                   "Body bytes received per domain after decompression", size, domain=domain)
+    for key, histogram in histograms.items():
+        name, help_text = histogram_metrics.get(key) or (
+            "smallder_" + _name_re.sub("_", key), f"Histogram of {key}"
+        )
+        writer.add_histogram(name, help_text, histogram)
+    if engine is not None:
+        writer.add("smallder_inflight_tasks", "gauge", "Tasks submitted and not yet finished",
+                   len(spider.futures))
+        writer.add("smallder_scheduler_queue_size", "gauge", "Tasks waiting in the scheduler",
+                   engine.scheduler.size() or 0)
+        writer.add("smallder_pipeline_queue_size", "gauge", "Items waiting to be written",
+                   engine.pipeline.size())
+        writer.add("smallder_throttle_deferred", "gauge", "Requests held back by the domain throttle",
+                   engine.throttle.deferred)
+    return writer.render()
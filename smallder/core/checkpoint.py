@@ -0,0 +1,263 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from smallder.core.scheduler import MemoryScheduler
+from smallder.core.serializer import RequestSerializer
+
+FINGERPRINT_SIZE = 16  # smallder.utils.request.fingerprint 返回16字节的摘要
+
+
+class Checkpoint:
+    """
+    把内存爬虫的待抓取请求、去重指纹和统计数据定期保存到 jobdir, 异常退出后 Spider.start(resume=True) 从快照继续
+    jobdir/frontier.sqlite3  加入调度器之后还没有完成的请求, 包括队列中的、正在下载的、被限流暂存的和响应还没有处理完的
+                             (回调产生的 item 还没有写入也算没有处理完),
+                             每次只写入新增和变化的请求, 删除已经完成的请求
+    jobdir/fingerprints.log  去重指纹, 只追加写入, 已经提交的长度和请求在同一个事务中保存, 恢复时截掉没有提交的部分
+    jobdir/stats.json        统计数据
+    "jobdir": "",  # 设置后开启 checkpoint
+    "checkpoint_interval": 60,  # 每隔多少秒保存一次快照
+    """
+
+    def __init__(self, spider, scheduler, stats_collector):
+        if not isinstance(scheduler, MemoryScheduler):
+            raise ValueError("jobdir requires MemoryScheduler, redis schedulers already keep their queue in redis")
+        settings = spider.custom_settings
+        if settings.get("memory_queue_dir"):
+            raise ValueError("jobdir can not be used together with memory_queue_dir")
+        self.spider = spider
+        self.scheduler = scheduler
+        self.dup_filter = scheduler.dup_filter
+        self.stats_collector = stats_collector
+        self.jobdir = settings["jobdir"]
+        self.interval = settings.get("checkpoint_interval", 60)
+        self.serializer = RequestSerializer(spider)
+        self.live = {}  # id(request) -> request, 加入调度器之后还没有完成的请求
+        self.pending_items = {}  # id(request) -> 回调产生的还没有写入的 item 数量
+        self.finished = set()  # 回调已经执行完, 等待 item 写入的请求
+        self.seen_ids = set()  # 已经通过去重的请求, 恢复时不再去重
+        self.saved = {}  # id(request) -> (request, state, rowid), 已经写入快照的请求
+        self.fingerprints_size = 0  # fingerprints.log 中已经提交的字节数
+        self.db = None
+        self._lock = threading.Lock()
+        self._items_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.frontier_path = os.path.join(self.jobdir, "frontier.sqlite3")
+        self.fingerprints_path = os.path.join(self.jobdir, "fingerprints.log")
+        self.stats_path = os.path.join(self.jobdir, "stats.json")
+        if hasattr(self.dup_filter, "add_fingerprints"):
+            self.dup_filter.journal = []
+        else:
+            self.spider.log.warning(f"{type(self.dup_filter).__name__} 不支持保存指纹, 恢复时只依赖过滤器自身的持久化")
+        scheduler.checkpoint = self
+
+    def open(self, resume=False):
+        """
+        resume 为 False 时清空 jobdir 中上次的快照, 为 True 时从快照恢复
+        """
+        os.makedirs(self.jobdir, exist_ok=True)
+        if not resume:
+            for path in (self.frontier_path, self.frontier_path + "-wal", self.frontier_path + "-shm",
+                         self.fingerprints_path, self.stats_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.db = sqlite3.connect(self.frontier_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS frontier (id INTEGER PRIMARY KEY, seen INTEGER, data BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        if resume:
+            self.restore()
+
+    def restore(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprints_size'").fetchone()
+        fingerprints = 0
+        if os.path.exists(self.fingerprints_path):
+            size = os.path.getsize(self.fingerprints_path)
+            self.fingerprints_size = min(row[0] if row else 0, size - size % FINGERPRINT_SIZE)
+            with open(self.fingerprints_path, "r+b") as f:
+                # 上次提交之后追加的指纹没有对应的请求快照, 截掉后和请求保持一致
+                f.truncate(self.fingerprints_size)
+                if getattr(self.dup_filter, "journal", None) is not None:
+                    for chunk in iter(lambda: f.read(FINGERPRINT_SIZE * 65536), b""):
+                        self.dup_filter.add_fingerprints(
+                            chunk[i:i + FINGERPRINT_SIZE] for i in range(0, len(chunk), FINGERPRINT_SIZE)
+                        )
+                        fingerprints += len(chunk) // FINGERPRINT_SIZE
+        requests = 0
+        for rowid, seen, data in self.db.execute("SELECT id, seen, data FROM frontier ORDER BY id").fetchall():
+            try:
+                request = self.serializer.loads(data)
+            except Exception as e:
+                self.spider.log.error(f"快照中的请求无法还原: {e}")
+                continue
+            if seen:
+                # 指纹已经保存, 恢复后不再去重
+                request.dont_filter = True
+            self.scheduler.add_job(request)
+            self.saved[id(request)] = (request, self._state(request, self.seen_ids), rowid)
+            requests += 1
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, encoding="utf-8") as f:
+                self.stats_collector.load_state(json.load(f))
+        self.spider.log.info(f"从 {self.jobdir} 恢复了 {requests} 个请求, {fingerprints} 条指纹")
+
+    def add(self, request):
+        self.live[id(request)] = request
+
+    def seen(self, request):
+        self.seen_ids.add(id(request))
+
+    def done(self, request):
+        """
+        请求的回调执行完, 产生的 item 全部写入之后才从快照中移除
+        """
+        key = id(request)
+        with self._items_lock:
+            if self.pending_items.get(key):
+                self.finished.add(key)
+                return
+        self.live.pop(key, None)
+        self.seen_ids.discard(key)
+
+    def item_added(self, request):
+        key = id(request)
+        with self._items_lock:
+            self.pending_items[key] = self.pending_items.get(key, 0) + 1
+
+    def item_written(self, request):
+        """
+        pipline 写入了请求产生的一条 item, 最后一条写入并且回调已经执行完时移除请求
+        """
+        key = id(request)
+        with self._items_lock:
+            count = self.pending_items.get(key, 0) - 1
+            if count > 0:
+                self.pending_items[key] = count
+                return
+            self.pending_items.pop(key, None)
+            if key not in self.finished:
+                return
+            self.finished.discard(key)
+        self.done(request)
+
+    def replace(self, request, new_request):
+        """
+        中间件返回了新的请求, 响应处理完之前保存新的请求
+        """
+        self.add(new_request)
+        self.seen(new_request)
+        self.done(request)
+
+    @staticmethod
+    def _state(request, seen_ids):
+        # 恢复时是否跳过去重和重试次数, 变化后需要重新写入
+        return id(request) in seen_ids or request.dont_filter, request.retry
+
+    def save(self):
+        """
+        先取出新增的指纹再复制请求, 已经写入指纹的请求一定在快照中并且带有 seen 标记
+        """
+        with self._lock:
+            started_at = time.time()
+            # 自定义的过滤器可能不支持保存指纹
+            journal = getattr(self.dup_filter, "journal", None)
+            count = len(journal) if journal is not None else 0
+            fingerprints = journal[:count] if count else []
+            live = self.live.copy()
+            seen_ids = self.seen_ids.copy()
+            saved, inserts, skipped = {}, [], 0
+            for key, request in live.items():
+                state = self._state(request, seen_ids)
+                entry = self.saved.get(key)
+                if entry is not None and entry[0] is request and entry[1] == state:
+                    saved[key] = entry
+                    continue
+                try:
+                    data = self.serializer.dumps(request)
+                except (ValueError, TypeError):
+                    skipped += 1
+                    continue
+                inserts.append((key, request, state, data))
+            deletes = [(entry[2],) for key, entry in self.saved.items() if saved.get(key) is not entry]
+            size = self.fingerprints_size
+            if fingerprints:
+                with open(self.fingerprints_path, "ab") as f:
+                    f.truncate(size)  # 上次保存失败时写入的部分没有提交
+                    f.write(b"".join(fingerprints))
+                    f.flush()
+                    os.fsync(f.fileno())
+                size += count * FINGERPRINT_SIZE
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("DELETE FROM frontier WHERE id = ?", deletes)
+                for key, request, state, data in inserts:
+                    cursor = self.db.execute("INSERT INTO frontier (seen, data) VALUES (?, ?)", (int(state[0]), data))
+                    saved[key] = (request, state, cursor.lastrowid)
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprints_size', ?)", (size,))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            if count:
+                del journal[:count]
+            self.fingerprints_size = size
+            self.saved = saved
+            self._compact()
+            self._save_stats()
+            if skipped:
+                self.spider.log.warning(f"{skipped} 个请求的回调不是爬虫方法或者参数无法序列化, 没有写入快照")
+            self.spider.log.debug(
+                f"checkpoint: 待完成请求 {len(live)}, 写入 {len(inserts)}, 删除 {len(deletes)}, "
+                f"新增指纹 {count}, 耗时 {time.time() - started_at:.2f}s"
+            )
+
+    def _compact(self):
+        """
+        删除的请求超过一半时回收空闲页, 文件大小跟随待完成请求的数量
+        """
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        if free > self.db.execute("PRAGMA page_count").fetchone()[0] // 2:
+            self.db.execute("PRAGMA incremental_vacuum")
+
+    def _save_stats(self):
+        path = self.stats_path + ".tmp"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.stats_collector.dump_state(), f, ensure_ascii=False)
+        os.replace(path, self.stats_path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                self.spider.log.exception(f"保存 checkpoint 失败: {e}")
+
+    def start(self):
+        if self.db is None:
+            # 信号管理器是单例, 上一次运行的 checkpoint 已经关闭
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        爬虫结束时保存最后一次快照, 正常结束时快照中没有待完成的请求
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.db is None:
+            return
+        try:
+            self.save()
+        finally:
+            self.db.close()
+            self.db = None
@@ -1,6 +1,18 @@
+import asyncio
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from urllib3 import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+
 from smallder import Request, Response
+from smallder.core.error import DiscardException
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import requests
 
@@ -8,10 +20,149 @@ import requests
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 
+class BodyReader:
+    """
+    按块读取响应内容, 超过 maxsize 时中止下载,
+    stream=True 的请求写入 SpooledTemporaryFile, 超过 spool_size 后才写入磁盘, 避免大文件占用内存
+    """
+
+    def __init__(self, request: Request, maxsize=0, spool_size=1024 * 1024):
+        self.request = request
+        self.maxsize = maxsize
+        self.size = 0
+        self.chunks = []
+        self.body = tempfile.SpooledTemporaryFile(max_size=spool_size) if request.stream else None
+
+    def check_length(self, length):
+        """
+        Content-Length 超过 maxsize 时不读取响应内容直接丢弃
+        """
+        if self.maxsize and length and str(length).isdigit() and int(length) > self.maxsize:
+            self.close()
+            raise DiscardException(f"{self.request} Content-Length {length} 超过 download_maxsize {self.maxsize}")
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.maxsize and self.size > self.maxsize:
+            # 没有 Content-Length 或者压缩后的长度小于限制
+            self.close()
+            raise DiscardException(f"{self.request} 响应内容超过 download_maxsize {self.maxsize}")
+        if self.body is not None:
+            self.body.write(chunk)
+        else:
+            self.chunks.append(chunk)
+
+    def finish(self):
+        """
+        返回 (content, body), stream=True 时 content 为None
+        """
+        if self.body is None:
+            return b"".join(self.chunks), None
+        self.body.seek(0)
+        return None, self.body
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+
 class Downloader:
+    pool_connections = 100  # 缓存多少个host的连接池
+    pool_maxsize = 10  # 单个host连接池保留的最大连接数
+    pool_block = False  # 连接数达到pool_maxsize时是否阻塞等待空闲连接
+    keep_alive = True  # 复用连接,关闭后每个请求都会重新握手
+    download_maxsize = 0  # 响应内容超过这个字节数时丢弃请求,0为不限制
+    download_spool_size = 1024 * 1024  # stream=True 的响应在内存中最多保留多少字节,超出后写入临时文件
+    chunk_size = 64 * 1024
+    header_templates = {}  # 模板名称 -> headers
+    _session = None
+    _session_lock = threading.Lock()
 
     def __init__(self, spider):
         self.spider = spider
+        self.setup_session(spider)
+
+    @classmethod
+    def setup_session(cls, spider=None):
+        """
+        根据 spider.custom_settings 配置共享的连接池,同一个host的请求会复用已经建立的连接
+        "pool_connections": 100,  # 缓存多少个host的连接池
+        "pool_maxsize": 10,  # 单个host保留的最大连接数,默认为 thread_count
+        "max_connections_per_host": 0,  # 大于0时限制单个host的最大并发连接数,超出的请求阻塞等待
+        "keep_alive": True,  # 是否复用连接
+        "download_maxsize": 0,  # 响应内容超过这个字节数时丢弃请求,0为不限制
+        "download_spool_size": 1024 * 1024,  # stream=True 的响应超过这个字节数后写入临时文件
+        "header_templates": {},  # 模板名称 -> headers, 通过 Request(header_template=...) 使用
+        """
+        settings = getattr(spider, "custom_settings", None) or {}
+        thread_count = getattr(spider, "thread_count", None) or 10
+        max_connections = settings.get("max_connections_per_host", 0)
+        with cls._session_lock:
+            cls.pool_connections = settings.get("pool_connections", 100)
+            cls.pool_maxsize = max_connections or settings.get("pool_maxsize", thread_count)
+            cls.pool_block = bool(max_connections)
+            cls.keep_alive = settings.get("keep_alive", True)
+            cls.download_maxsize = settings.get("download_maxsize", 0)
+            cls.download_spool_size = settings.get("download_spool_size", 1024 * 1024)
+            # 请求中的 headers 按不区分大小写的方式覆盖模板, 不会出现 User-Agent 和 user-agent 同时发送
+            cls.header_templates = {
+                name: CaseInsensitiveDict(headers)
+                for name, headers in (settings.get("header_templates") or {}).items()
+            }
+            if cls._session is not None:
+                cls._session.close()
+            cls._session = cls._create_session()
+
+    @classmethod
+    def _create_session(cls):
+        session = requests.Session()
+        # 连接共享但cookie不共享,和每个请求单独创建session时的行为保持一致
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            pool_connections=cls.pool_connections,
+            pool_maxsize=cls.pool_maxsize,
+            pool_block=cls.pool_block,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # 安装了 brotli / backports.zstd 时 urllib3 会声明并解压 br / zstd
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING.replace(",", ", ")
+        if not cls.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    cls._session = cls._create_session()
+        return cls._session
+
+    @classmethod
+    def close_session(cls):
+        with cls._session_lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def _request_headers(cls, request: Request):
+        """
+        request.headers 合并在 header_template 对应的模板之上, 只读不会复制请求共用的 headers,
+        没有自定义 headers 的请求直接使用启动时准备好的模板
+        """
+        headers = request._headers
+        if request.header_template is None:
+            return headers
+        template = cls.header_templates.get(request.header_template)
+        if template is None:
+            raise ValueError(f"header template {request.header_template!r} not found in header_templates")
+        if not headers:
+            return template
+        merged = template.copy()
+        merged.update(headers)
+        return merged
 
     @classmethod
     def fetch(cls, request: Request):
@@ -19,22 +170,33 @@ class Downloader:
         @type request: Request
         """
 
-        with requests.Session() as session:
-            with session.request(
-                    method=request.method,
-                    url=request.url,
-                    headers=request.headers,
-                    params=request.params,
-                    data=request.data,
-                    cookies=request.cookies,
-                    timeout=request.timeout,
-                    proxies=request.proxies,
-                    verify=request.verify,
-                    allow_redirects=request.allow_redirects,  # 禁止重定向
-            ) as response:
-                return Response(url=request.full_url(), status_code=response.status_code, content=response.content,
-                                request=request,
-                                cookies=response.cookies.get_dict(), elapsed=response.elapsed)
+        session = cls.get_session()
+        with session.request(
+                method=request.method,
+                url=request.url,
+                headers=cls._request_headers(request),
+                params=request.params,
+                data=request.data,
+                cookies=request.cookies,
+                timeout=request.timeout,
+                proxies=request.proxies,
+                verify=request.verify,
+                allow_redirects=request.allow_redirects,  # 禁止重定向
+                stream=True,  # 先读取响应头, 检查 Content-Length 后再读取响应内容
+        ) as response:
+            reader = BodyReader(request, cls.download_maxsize, cls.download_spool_size)
+            reader.check_length(response.headers.get("Content-Length"))
+            if reader.maxsize or reader.body is not None:
+                for chunk in response.iter_content(cls.chunk_size):
+                    reader.feed(chunk)
+                content, body = reader.finish()
+            else:
+                content, body = response.content, None
+                reader.size = len(content)
+            return Response(url=request.full_url(), status_code=response.status_code, content=content,
+                            request=request, headers=response.headers, body=body,
+                            cookies=response.cookies.get_dict(), elapsed=response.elapsed,
+                            raw_size=response.raw.tell(), size=reader.size)
 
     def download(self, request: Request):
         if request.fetch:
@@ -42,3 +204,87 @@ class Downloader:
         else:
             response = self.fetch(request)
         return response
+
+
+class AsyncDownloader:
+    """
+    基于 aiohttp 的异步下载器,只在 Spider.start(mode="async") 时使用
+    """
+
+    def __init__(self, spider):
+        self.spider = spider
+        self.session = None
+        settings = getattr(spider, "custom_settings", None) or {}
+        self.download_maxsize = settings.get("download_maxsize", 0)
+        self.download_spool_size = settings.get("download_spool_size", 1024 * 1024)
+
+    @staticmethod
+    def _import_aiohttp():
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError("async mode requires aiohttp, please run: pip install aiohttp")
+        return aiohttp
+
+    @classmethod
+    def retry_exceptions(cls):
+        aiohttp = cls._import_aiohttp()
+        return aiohttp.ClientError, asyncio.TimeoutError
+
+    async def open(self):
+        aiohttp = self._import_aiohttp()
+        settings = getattr(self.spider, "custom_settings", None) or {}
+        connector = aiohttp.TCPConnector(
+            limit=settings.get("async_concurrency", 1000),
+            limit_per_host=settings.get("max_connections_per_host", 0),
+            force_close=not settings.get("keep_alive", True),
+        )
+        # 和同步下载器一样,cookie不在请求之间共享
+        self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @staticmethod
+    def _proxy(request: Request):
+        if not request.proxies:
+            return None
+        scheme = urlparse(request.url).scheme
+        return request.proxies.get(scheme) or request.proxies.get("http")
+
+    async def fetch(self, request: Request):
+        """
+        @type request: Request
+        """
+        aiohttp = self._import_aiohttp()
+        start = time.time()
+        async with self.session.request(
+                method=request.method,
+                url=request.url,
+                headers=Downloader._request_headers(request),
+                params=request.params,
+                data=request.data,
+                cookies=request.cookies,
+                timeout=aiohttp.ClientTimeout(total=request.timeout),
+                proxy=self._proxy(request),
+                ssl=bool(request.verify),
+                allow_redirects=request.allow_redirects,
+        ) as response:
+            reader = BodyReader(request, self.download_maxsize, self.download_spool_size)
+            reader.check_length(response.headers.get("Content-Length"))
+            if reader.maxsize or reader.body is not None:
+                async for chunk in response.content.iter_chunked(Downloader.chunk_size):
+                    reader.feed(chunk)
+                content, body = reader.finish()
+            else:
+                content, body = await response.read(), None
+                reader.size = len(content)
+            # 旧版本 aiohttp 没有 total_raw_bytes, 只能使用 Content-Length
+            raw_size = getattr(response.content, "total_raw_bytes", None) or response.content_length or reader.size
+            return Response(url=request.full_url(), status_code=response.status, content=content,
+                            request=request, headers=CaseInsensitiveDict(response.headers), body=body,
+                            cookies={key: morsel.value for key, morsel in response.cookies.items()},
+                            elapsed=timedelta(seconds=time.time() - start),
+                            raw_size=raw_size, size=reader.size)
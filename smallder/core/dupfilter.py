@@ -1,5 +1,9 @@
 import importlib
+import math
+import zlib
+
 from smallder import Request
+from smallder.utils.bloomfilter import ScalableBloomFilter, bloom_size, bloom_offsets
 from smallder.utils.request import fingerprint
 
 
@@ -15,33 +19,126 @@ class Filter:
 
 
 class MemoryFilter(Filter):
-    fingerprints = set()
+    journal = None  # 设置 jobdir 时记录新增的指纹, 由 Checkpoint 定期写入磁盘
+
+    def __init__(self):
+        # 每个爬虫单独保存指纹, 同一个进程中多次启动爬虫或者从快照恢复时不会受到上一次的影响
+        self.fingerprints = set()
 
     def request_seen(self, request: Request) -> bool:
-        fp = fingerprint(request).hex()
+        fp = fingerprint(request)
         if fp in self.fingerprints:
             return True
         self.fingerprints.add(fp)
+        if self.journal is not None:
+            self.journal.append(fp)
         return False
 
+    def add_fingerprints(self, fingerprints):
+        self.fingerprints.update(fingerprints)
+
 
 class RedisFilter(Filter):
+    """
+    在redis集合中保存完整指纹, 默认key为 爬虫名:dupfilter:v2
+    v2 保存16字节的 blake2b 指纹, 和旧版本 爬虫名:dupfilter 中的 sha1 指纹不会混在同一个集合中
+    """
+    version = "v2"  # 指纹格式变化时修改, 使用新的key
 
     def __init__(self, server, key):
         self.server = server
         self.key = key
 
     def request_seen(self, request: Request) -> bool:
-        fp = fingerprint(request).hex()
+        fp = fingerprint(request)
         added = self.server.sadd(self.key, fp)
         return added == 0
 
 
+class MemoryBloomFilter(Filter):
+    """
+    基于布隆过滤器的内存去重,容量不足时自动扩容,内存占用远小于保存完整指纹的 MemoryFilter
+    custom_settings["dupfilter_class"] = "smallder.core.dupfilter.MemoryBloomFilter"
+    custom_settings["bloomfilter_capacity"] = 1000000  # 初始容量
+    custom_settings["bloomfilter_error_rate"] = 0.001  # 误判率
+    """
+
+    journal = None  # 设置 jobdir 时记录新增的指纹, 由 Checkpoint 定期写入磁盘
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.bloom = ScalableBloomFilter(capacity=capacity, error_rate=error_rate)
+
+    @classmethod
+    def from_spider(cls, spider):
+        return cls(
+            capacity=spider.custom_settings.get("bloomfilter_capacity", 1000000),
+            error_rate=spider.custom_settings.get("bloomfilter_error_rate", 0.001),
+        )
+
+    def request_seen(self, request: Request) -> bool:
+        fp = fingerprint(request)
+        if self.bloom.add(fp):
+            return True
+        if self.journal is not None:
+            self.journal.append(fp)
+        return False
+
+    def add_fingerprints(self, fingerprints):
+        for fp in fingerprints:
+            self.bloom.add(fp)
+
+
+class RedisBloomFilter(Filter):
+    """
+    基于redis位图的布隆过滤器,多个节点共享,每条指纹只占用十几位
+    位图按 max_block_bits 拆分成多个key,每条指纹只落在其中一个key上,用lua脚本原子地检查并设置
+    custom_settings["dupfilter_class"] = "smallder.core.dupfilter.RedisBloomFilter"
+    custom_settings["bloomfilter_capacity"] = 100000000  # 总容量
+    custom_settings["bloomfilter_error_rate"] = 0.001  # 误判率
+    """
+    max_block_bits = 1 << 32  # redis 单个字符串最多 512MB
+    script = """
+    local exists = 1
+    for i = 1, #ARGV do
+        if redis.call('SETBIT', KEYS[1], ARGV[i], 1) == 0 then
+            exists = 0
+        end
+    end
+    return exists
+    """
+
+    def __init__(self, server, key, capacity=100000000, error_rate=0.001):
+        self.server = server
+        self.key = key
+        num_bits, self.num_hashes = bloom_size(capacity, error_rate)
+        self.blocks = int(math.ceil(num_bits / self.max_block_bits))
+        self.block_bits = int(math.ceil(num_bits / self.blocks))
+        self._seen = server.register_script(self.script)
+
+    @classmethod
+    def from_spider(cls, spider):
+        return cls(
+            spider.server,
+            f"{spider.name}:bloomfilter",
+            capacity=spider.custom_settings.get("bloomfilter_capacity", 100000000),
+            error_rate=spider.custom_settings.get("bloomfilter_error_rate", 0.001),
+        )
+
+    def request_seen(self, request: Request) -> bool:
+        fp = fingerprint(request)
+        block = zlib.crc32(fp) % self.blocks if self.blocks > 1 else 0
+        offsets = bloom_offsets(fp, self.block_bits, self.num_hashes)
+        return self._seen(keys=[f"{self.key}:{block}"], args=offsets) == 1
+
+
 class FilterFactory:
 
     @classmethod
     def create_filter(cls, spider):
         server = spider.server
+        _filter_class = cls.load_filter(spider)
+        if _filter_class is not None and hasattr(_filter_class, "from_spider"):
+            return _filter_class.from_spider(spider)
         if server is None:
             _filter = MemoryFilter()
         else:
@@ -49,7 +146,13 @@ class FilterFactory:
             if _filter_class is not None:
                 instance = _filter_class(server)
                 return instance
-            key = f"{spider.name}:dupfilter"
+            legacy_key = f"{spider.name}:dupfilter"
+            key = f"{legacy_key}:{RedisFilter.version}"
+            if server.exists(legacy_key):
+                spider.log.warning(
+                    f"{legacy_key} 中是旧版本的 sha1 指纹, 已经不再使用, 新的指纹写入 {key}, "
+                    f"之前抓取过的请求会重新抓取, 确认不需要后可以删除 {legacy_key}"
+                )
             _filter = RedisFilter(server, key)
         return _filter
 
@@ -1,30 +1,55 @@
+import asyncio
+import inspect
 import json
-import queue
+import threading
 import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor, Future
 from requests import RequestException
+from smallder import Request
+from smallder.core.checkpoint import Checkpoint
 from smallder.core.error import RetryException, DiscardException
 from smallder.api.app import FastAPIWrapper
-from smallder.core.downloader import Downloader
+from smallder.core.downloader import Downloader, AsyncDownloader
 from smallder.core.failure import Failure
 from smallder.core.middleware import MiddlewareManager
-from smallder.core.scheduler import SchedulerFactory
-from smallder.core.statscollectors import MemoryStatsCollector
+from smallder.core.pipeline import PipelineManager
+from smallder.core.request import method_registry
+from smallder.core.scheduler import SchedulerFactory, MemoryScheduler
+from smallder.core.statscollectors import StatsCollectorFactory
+from smallder.core.throttle import DomainThrottle
 
 
 class Engine:
-    item_que = queue.Queue()
+    retry_exceptions = (RequestException, RetryException)  # 引发重试的异常
+    item_tasks = ("dict", "Item")  # 交给 pipline 的任务, 写入后由 PipelineManager 计数
+    spin_limit = 100  # 调度器不为空时连续多少次取不到任务后开始等待
 
-    def __init__(self, spider, **kwargs):
+    def __init__(self, spider, resume=False, **kwargs):
         self.spider = spider(**kwargs)
         self.spider.setup_server()
-        self.fastapi_manager = FastAPIWrapper(spider=self.spider)
-        self.stats_collector = MemoryStatsCollector(self.spider)
+        method_registry(spider)  # 启动时反射一次爬虫方法, 序列化请求时直接查表
+        self.stats_collector = StatsCollectorFactory.create_stats_collector(self.spider)
+        self.spider.stats = self.stats_collector
+        self.fastapi_manager = FastAPIWrapper(spider=self.spider, engine=self)
         self.download = Downloader(self.spider)
+        self.async_download = AsyncDownloader(self.spider)
         self.middleware_manager = MiddlewareManager(self.spider)
+        self.pipeline = PipelineManager(self.spider)
         self.scheduler = SchedulerFactory.create_scheduler(self.spider)
         self.start_requests = iter(self.spider.start_requests())
+        self.throttle = DomainThrottle(self.spider)
+        self.checkpoint = None
+        if self.spider.custom_settings.get("jobdir"):
+            self.checkpoint = Checkpoint(self.spider, self.scheduler, self.stats_collector)
+            self.checkpoint.open(resume=resume)
+            self.pipeline.checkpoint = self.checkpoint
+        elif resume:
+            raise ValueError("resume=True requires custom_settings['jobdir']")
+        self.parse_limit = self.spider.custom_settings.get("parse_limit", 0)  # 设置到每个响应上
+        self.capacity = threading.Semaphore(self.spider.thread_count * 10)  # 任务池中最多的任务数
+        self.wakeup = threading.Event()  # 有任务完成时通知调度循环
+        self.misses = 0  # 调度器不为空但是连续取不到任务的次数
         self.setup_signals()
 
     def setup_signals(self):
@@ -34,99 +59,128 @@ class Engine:
         self.spider.connect_start_signal(self.stats_collector.on_spider_start)
         if self.spider.fastapi:
             self.spider.connect_start_signal(self.fastapi_manager.run)
+        if self.checkpoint is not None:
+            self.spider.connect_start_signal(self.checkpoint.start)
 
         # 注册爬虫状态信号
         self.spider.signal_manager.connect("SPIDER_STATS", self.stats_collector.handler)
 
-        # 注册爬虫结束信号
+        # 注册爬虫结束信号, 先等待 pipline 处理完剩余的 item
+        self.spider.connect_stop_signal(self.pipeline.close)
+        if self.checkpoint is not None:
+            # item 写入之后再保存最后一次快照
+            self.spider.connect_stop_signal(self.checkpoint.close)
+        self.spider.connect_stop_signal(self.scheduler.close)
         self.spider.connect_stop_signal(self.stats_collector.on_spider_stopped)
         self.spider.connect_stop_signal(self.spider.on_stop)
+        self.spider.connect_stop_signal(self.download.close_session)
 
     def future_done(self, future):
         try:
             self.spider.futures.remove(future)
-            self.spider.signal_manager.send(signal_name="SPIDER_STATS", task_type=future.name)
+            if future.name not in self.item_tasks:
+                self.stats_collector.inc_value(future.name.lower())
         except ValueError as e:
             self.spider.log.warning(e)  # Future 已经被移除
 
+    def task_done(self, future):
+        self.capacity.release()
+        self.wakeup.set()
+
     def process_request(self, request: any = None):
         try:
-            middleware_manager_request = self.middleware_manager.process_request(request)
-            download_middleware_request = self.spider.download_middleware(middleware_manager_request)
-            if download_middleware_request is not None:
-                middleware_manager_request = download_middleware_request
-            response = self.download.download(middleware_manager_request)
+            response = None
+            try:
+                middleware_manager_request = self.middleware_manager.process_request(request)
+                download_middleware_request = self.spider.download_middleware(middleware_manager_request)
+                if download_middleware_request is not None:
+                    middleware_manager_request = download_middleware_request
+                response = self.download.download(middleware_manager_request)
+            finally:
+                # 重试会把同一个请求重新放入调度器, 必须在这之前释放限流名额
+                if self.throttle.enabled:
+                    self.throttle.release(request, response)
+            if self.parse_limit:
+                response.parse_limit = self.parse_limit
             self.spider.log.info(response)
+            self.stats_collector.record_response(response)
             self.scheduler.add_job(response)
+            if self.checkpoint is not None and response.request is not request:
+                self.checkpoint.replace(request, response.request)
         except BaseException as e:
-            self.spider.log.exception(e)
-            if isinstance(e, DiscardException):
-                self.spider.log.warning(f"{request} 请求被丢弃!")
-                # 这里还是要处理重试的问题
-            elif isinstance(e, (RequestException, RetryException)):
-                self.handler_request_retry(request)
-            else:
-                self.process_callback_error(e=e, request=request)
+            self.handle_request_error(e, request)
+
+    def handle_request_error(self, e, request):
+        self.spider.log.exception(e)
+        if isinstance(e, DiscardException):
+            self.spider.log.warning(f"{request} 请求被丢弃!")
+            self.request_done(request)
+            # 这里还是要处理重试的问题
+        elif isinstance(e, self.retry_exceptions):
+            self.handler_request_retry(request)
+        else:
+            self.request_done(request)
+            self.process_callback_error(e=e, request=request)
+
+    def request_done(self, request):
+        """
+        请求和它的响应都已经处理完, 开启 jobdir 时从快照中移除
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.done(request)
 
     def process_response(self, response: any = None):
         try:
             response = self.middleware_manager.process_response(response)
             callback = response.request.callback or getattr(self.spider, "parse", None)
-            _iters = callback(response)
-            if _iters is None:
-                return
-            for _iter in _iters:
-                self.scheduler.add_job(_iter, block=False)
+            self.iter_callback(callback, response)
+            self.request_done(response.request)
         except BaseException as e:
-            self.spider.log.exception(e)
-            if isinstance(e, DiscardException):
-                self.spider.log.warning(f"{response} 被丢弃!")
-            elif isinstance(e, RetryException):
-                self.handler_request_retry(response.request)
-            else:
-                self.process_callback_error(e=e, request=response.request, response=response)
+            self.handle_response_error(e, response)
 
-    def process_item(self, item: any = None):
-        if self.spider.pipline_mode == "single" and item is not None:
-            self.store_single(item)
+    def iter_callback(self, callback, response):
+        _iters = callback(response)
+        if _iters is None:
+            return
+        for _iter in _iters:
+            self.add_job(_iter, response.request)
+
+    def add_job(self, job, request=None):
+        """
+        item 直接交给 pipline 处理, 其他任务放入调度器, request 为产生任务的请求
+        """
+        if isinstance(job, dict):
+            self.pipeline.put(job, request)
         else:
-            self.store_batch(item)
+            self.scheduler.add_job(job, block=False)
 
-    def store_single(self, item):
-        try:
-            self.spider.pipline(item)
-        except Exception as e:
-            self.spider.log.exception(f"{item} 入库出现错误 \n {e}")
-
-    def store_batch(self, item):
-        # 如果队列中的项目数量超过批处理大小或者item为None，处理队列中的所有项目
-        if self.item_que.qsize() >= self.spider.pipline_batch or item is None:
-            items = self.collect_items_from_queue()
-            if items:
-                try:
-                    self.spider.pipline(items)
-                    self.spider.log.success(
-                        f"pipline 处理 {len(items)} 条数据 : {json.dumps(items, ensure_ascii=False)[0:100]}"
-                    )
-                except Exception as e:
-                    self.spider.log.exception(f"{items} 入库出现错误 \n {e}")
-        # 如果item不为None，将其加入队列
-        if item is not None:
-            self.item_que.put(item)
+    async def async_add_job(self, job, request=None):
+        if isinstance(job, dict):
+            await self.pipeline.async_put(job, request)
+        else:
+            await self.call_scheduler(self.scheduler.add_job, job, False)
 
-    def collect_items_from_queue(self):
-        items = []
-        while not self.item_que.empty():
-            items.append(self.item_que.get())
-        return items
+    def handle_response_error(self, e, response):
+        self.spider.log.exception(e)
+        if isinstance(e, DiscardException):
+            self.spider.log.warning(f"{response} 被丢弃!")
+            self.request_done(response.request)
+        elif isinstance(e, RetryException):
+            self.handler_request_retry(response.request)
+        else:
+            self.request_done(response.request)
+            self.process_callback_error(e=e, request=response.request, response=response)
 
     def handler_request_retry(self, request):
         # 如果是request引发的问题就需要处理
+        self.stats_collector.inc_value("retry/count")
         if request.retry + 1 < self.spider.max_retry:
             request.retry += 1
             request.dont_filter = True
             self.scheduler.add_job(request)
         else:
+            self.stats_collector.inc_value("retry/max_reached")
+            self.request_done(request)
             fail_request = request.replace(retry=0, dont_filter=False)
             self.scheduler.add_failed_job(job=fail_request)
         self.spider.log.info(
@@ -140,51 +194,92 @@ class Engine:
     def engine(self):
         _time = time.time()
         rounds = 0
+        self.pipeline.open()
         with ThreadPoolExecutor(max_workers=self.spider.thread_count) as executor:
             end = 60 if self.spider.server else 10
             while rounds < end:
                 try:
                     if time.time() - _time > 30:
-                        self.spider.signal_manager.send(signal_name="SPIDER_STATS")
-                    if len(self.spider.futures) > self.spider.thread_count * 10:
-                        time.sleep(0.1)
-                        continue
-                    if not len(self.spider.futures) and self.scheduler.empty() and self.start_requests is None:
-                        if not self.item_que.empty():
-                            self.process_item()
-                        time.sleep(0.1)
-                        rounds += 1
+                        self.stats_collector.log_stats()
+                        _time = time.time()
                     if self.start_requests is not None:
                         try:
                             task = next(self.start_requests)
                             self.scheduler.add_job(task)
                         except StopIteration:
                             self.start_requests = None
-                    task = self.scheduler.next_job()
+                    self.wakeup.clear()
+                    task = self.next_task()
                     if task is None:
-                        time.sleep(0.01)
+                        self.wait_for_job()
+                        if self.idle():
+                            rounds += 1
                         continue
+                    self.misses = 0
                     task_name = task.__class__.__name__
                     process_func = self.process_func(task_name)
+                    # 任务池已满时阻塞,直到有任务完成释放名额
+                    self.capacity.acquire()
                     future = executor.submit(process_func, task)
                     future.name = task_name
                     self.spider.futures.append(future)
                     future.add_done_callback(self.future_done)
+                    future.add_done_callback(self.task_done)
                     rounds = 0
                 except Exception as e:
                     self.spider.log.exception(f"调度引擎出现错误 \n {e}")
 
         self.spider.log.info(f"任务池数量:{len(self.spider.futures)},调度器中任务是否为空:{self.scheduler.empty()} ")
 
+    def next_task(self):
+        """
+        从调度器中取任务,开启限流时优先返回已经就绪的暂存请求,被限流的请求暂存后返回None
+        """
+        if not self.throttle.enabled:
+            return self.scheduler.next_job()
+        task = self.throttle.pop_ready()
+        if task is not None:
+            return task
+        if self.throttle.full():
+            return None
+        task = self.scheduler.next_job()
+        if isinstance(task, Request) and not self.throttle.acquire(task):
+            self.throttle.defer(task)
+            return None
+        return task
+
+    def idle(self):
+        return (not len(self.spider.futures) and self.scheduler.empty() and self.start_requests is None
+                and not self.throttle.deferred)
+
+    def wait_time(self):
+        """
+        next_task 没有返回任务时需要等待的秒数, 等待期间有任务完成会提前唤醒
+        """
+        if self.start_requests is not None:
+            return 0
+        if not self.scheduler.empty() and not self.throttle.full():
+            # 任务被去重过滤或者被限流,直接取下一个;
+            # 连续取不到任务时(例如redis不可用,缓存的任务写入失败)短暂等待,避免调度循环空转
+            self.misses += 1
+            return 0 if self.misses < self.spin_limit else 0.01
+        timeout = 1 if len(self.spider.futures) else 0.1
+        return min(timeout, self.throttle.wait_time())
+
+    def wait_for_job(self):
+        """
+        调度器中没有可执行的任务时,等待正在执行的任务完成(任务完成时才会产生新的任务)或者暂存的请求就绪,
+        空闲时每次等待0.1秒用于判断爬虫是否结束
+        """
+        timeout = self.wait_time()
+        if timeout > 0:
+            self.wakeup.wait(timeout=timeout)
+
     def debug(self):
         rounds = 0
+        self.pipeline.open()
         while rounds < 6:
             try:
-                if self.scheduler.empty() and self.start_requests is None:
-                    if not self.item_que.empty():
-                        self.process_item()
-                    time.sleep(0.2)
-                    rounds += 1
                 if self.start_requests is not None:
                     try:
                         task = next(self.start_requests)
@@ -192,9 +287,13 @@ class Engine:
                     except StopIteration:
                         self.start_requests = None
 
-                task = self.scheduler.next_job()
+                task = self.next_task()
                 if task is None:
-                    time.sleep(0.1)
+                    if self.throttle.deferred:
+                        time.sleep(min(0.2, self.throttle.wait_time()))
+                    elif self.scheduler.empty() and self.start_requests is None:
+                        time.sleep(0.2)
+                        rounds += 1
                     continue
                 task_name = task.__class__.__name__
                 process_func = self.process_func(task_name)
@@ -204,12 +303,176 @@ class Engine:
                 self.spider.log.exception(f"调度引擎出现错误 \n {e}")
         return self.spider
 
+    def async_engine(self):
+        asyncio.run(self._async_engine())
+
+    async def _async_engine(self):
+        """
+        基于事件循环的调度引擎,async def 的回调和pipline直接在事件循环中执行,
+        普通函数放到线程池中执行,不会阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.spider.thread_count)
+        self.retry_exceptions = self.retry_exceptions + self.async_download.retry_exceptions()
+        await self.async_download.open()
+        wakeup = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.spider.custom_settings.get("async_concurrency", 1000))
+        if self.pipeline.is_async:
+            pipeline_task = loop.create_task(self.pipeline.async_run())
+        else:
+            pipeline_task = None
+            self.pipeline.open()
+
+        def task_done(_task):
+            semaphore.release()
+            wakeup.set()
+
+        _time = time.time()
+        rounds = 0
+        end = 60 if self.spider.server else 10
+        try:
+            while rounds < end:
+                try:
+                    if time.time() - _time > 30:
+                        self.stats_collector.log_stats()
+                        _time = time.time()
+                    if self.idle():
+                        await asyncio.sleep(0.1)
+                        rounds += 1
+                    if self.start_requests is not None:
+                        try:
+                            task = next(self.start_requests)
+                            await self.call_scheduler(self.scheduler.add_job, task)
+                        except StopIteration:
+                            self.start_requests = None
+                    wakeup.clear()
+                    task = await self.call_scheduler(self.next_task)
+                    if task is None:
+                        # 每次都要让出事件循环, 否则 pipline 等其他协程无法执行
+                        timeout = 0 if self.idle() else self.wait_time()
+                        if timeout > 0 and len(self.spider.futures):
+                            # 等待任意任务完成后再取任务
+                            try:
+                                await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+                            except asyncio.TimeoutError:
+                                pass
+                        else:
+                            await asyncio.sleep(timeout)
+                        continue
+                    self.misses = 0
+                    task_name = task.__class__.__name__
+                    process_func = self.async_process_func(task_name)
+                    await semaphore.acquire()
+                    future = loop.create_task(process_func(task))
+                    future.name = task_name
+                    self.spider.futures.append(future)
+                    future.add_done_callback(task_done)
+                    future.add_done_callback(self.future_done)
+                    rounds = 0
+                except Exception as e:
+                    self.spider.log.exception(f"调度引擎出现错误 \n {e}")
+            if self.spider.futures:
+                await asyncio.gather(*list(self.spider.futures), return_exceptions=True)
+        finally:
+            if pipeline_task is not None:
+                self.pipeline.stopped.set()
+                await pipeline_task
+            await self.async_download.close()
+            self.executor.shutdown(wait=True)
+
+        self.spider.log.info(f"任务池数量:{len(self.spider.futures)},调度器中任务是否为空:{self.scheduler.empty()} ")
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def call_scheduler(self, func, *args):
+        """
+        redis 等调度器的调用会阻塞事件循环, 放到线程池中执行, 内存调度器直接调用
+        """
+        if isinstance(self.scheduler, MemoryScheduler):
+            return func(*args)
+        return await self.run_in_executor(func, *args)
+
+    async def maybe_await(self, func, *args):
+        """
+        协程函数直接await,普通函数放到线程池中执行
+        """
+        if inspect.iscoroutinefunction(func):
+            return await func(*args)
+        return await self.run_in_executor(func, *args)
+
+    async def async_process_request(self, request: any = None):
+        try:
+            response = None
+            try:
+                middleware_manager_request = request
+                if self.middleware_manager.loaded_middlewares:
+                    middleware_manager_request = await self.run_in_executor(
+                        self.middleware_manager.process_request, request
+                    )
+                download_middleware_request = await self.maybe_await(
+                    self.spider.download_middleware, middleware_manager_request
+                )
+                if download_middleware_request is not None:
+                    middleware_manager_request = download_middleware_request
+                if middleware_manager_request.fetch:
+                    response = await self.maybe_await(middleware_manager_request.fetch, middleware_manager_request)
+                else:
+                    response = await self.async_download.fetch(middleware_manager_request)
+            finally:
+                if self.throttle.enabled:
+                    self.throttle.release(request, response)
+            if self.parse_limit:
+                response.parse_limit = self.parse_limit
+            self.spider.log.info(response)
+            self.stats_collector.record_response(response)
+            await self.call_scheduler(self.scheduler.add_job, response)
+            if self.checkpoint is not None and response.request is not request:
+                self.checkpoint.replace(request, response.request)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            # 错误回调和重试入队都是同步调用,放到线程池中执行
+            await self.run_in_executor(self.handle_request_error, e, request)
+
+    async def async_process_response(self, response: any = None):
+        try:
+            if self.middleware_manager.loaded_middlewares:
+                response = await self.run_in_executor(self.middleware_manager.process_response, response)
+            callback = response.request.callback or getattr(self.spider, "parse", None)
+            if inspect.isasyncgenfunction(callback):
+                async for _iter in callback(response):
+                    await self.async_add_job(_iter, response.request)
+            elif inspect.iscoroutinefunction(callback):
+                _iters = await callback(response)
+                for _iter in _iters or ():
+                    await self.async_add_job(_iter, response.request)
+            else:
+                await self.run_in_executor(self.iter_callback, callback, response)
+            self.request_done(response.request)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await self.run_in_executor(self.handle_response_error, e, response)
+
+    def async_process_func(self, task_name):
+        func_dict = {
+            "Request": self.async_process_request,
+            "Response": self.async_process_response,
+            "dict": self.pipeline.async_put,
+            "Item": self.pipeline.async_put,
+        }
+        func = func_dict.get(task_name)
+        if func is None:
+            raise ValueError(f"{task_name} does not exist")
+        return func
+
     def process_func(self, task_name):
         func_dict = {
             "Request": self.process_request,
             "Response": self.process_response,
-            "dict": self.process_item,
-            "Item": self.process_item,
+            "dict": self.pipeline.put,
+            "Item": self.pipeline.put,
         }
         func = func_dict.get(task_name)
         if func is None:
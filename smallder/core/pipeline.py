@@ -0,0 +1,229 @@
+import asyncio
+import importlib
+import inspect
+import json
+import queue
+import threading
+import time
+from collections import Counter
+
+from smallder.core.statscollectors import get_stats_collector
+
+
+class PipelineManager:
+    """
+    独立的 item 处理阶段, 回调产生的 item 直接放入有界队列, 由单独的线程(async pipline 为事件循环中的任务)写入 pipline
+    pipline_mode=list 时, 攒够 pipline_batch 条或者距离上次写入超过 pipline_flush_interval 秒就写入一次
+    队列满时放入 item 的一方会等待, 入库速度跟不上时会降低抓取速度, 避免内存无限增长
+    "pipline_queue_size": 0,  # 队列最多缓存多少条 item, 默认为 pipline_batch * 10
+    "pipline_workers": None,  # 处理 item 的线程数, single 模式默认为 thread_count(和之前一样并发单条入库), list 模式默认为1
+    "pipeline_settings": {
+        "smallder.pipelines.MySQLBulkPipeline": 100,  # 数字越低越先执行, 在 spider.pipline 之前处理同一批 item
+    },
+    """
+
+    def __init__(self, spider):
+        self.spider = spider
+        self.stats = get_stats_collector(spider)
+        settings = spider.custom_settings
+        self.mode = spider.pipline_mode
+        self.batch_size = spider.pipline_batch
+        self.flush_interval = spider.pipline_flush_interval
+        self.queue = queue.Queue(maxsize=settings.get("pipline_queue_size") or self.batch_size * 10)
+        self.worker_count = settings.get("pipline_workers") or (spider.thread_count if self.mode == "single" else 1)
+        self.is_async = inspect.iscoroutinefunction(spider.pipline)
+        self.workers = []
+        self.stopped = threading.Event()
+        self.pipelines = self.load_pipelines()
+        self.checkpoint = None  # 设置 jobdir 时由引擎设置, item 写入后通知 checkpoint
+        self.sources = {}  # id(item) -> 产生 item 的请求
+        self.sources_lock = threading.Lock()
+
+    def load_pipelines(self):
+        """
+        加载 pipeline_settings 中的 pipeline, pipeline 需要实现 process_items(items) 方法, 可选实现 close()
+        """
+        pipelines = []
+        settings = self.spider.custom_settings.get("pipeline_settings", {})
+        for path, _ in sorted(settings.items(), key=lambda x: x[1]):
+            pipeline_class = self.load_pipeline_class(path)
+            if pipeline_class is None:
+                continue
+            try:
+                pipelines.append(pipeline_class(self.spider))
+            except Exception as e:
+                self.spider.log.error(f"Failed to initialize pipeline {path}: {e}")
+        return pipelines
+
+    def load_pipeline_class(self, path):
+        try:
+            module_path, class_name = path.rsplit(".", 1)
+            module = importlib.import_module(module_path)
+            return getattr(module, class_name)
+        except (ImportError, AttributeError, ValueError) as e:
+            self.spider.log.error(f"Failed to load pipeline class {path}: {e}")
+            return None
+
+    def open(self):
+        """
+        启动处理 item 的线程
+        """
+        self.stopped.clear()
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self.run, name=f"pipline-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def close(self):
+        """
+        爬虫结束时调用, 等待队列中的 item 全部写入后返回
+        """
+        self.stopped.set()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        for pipeline in self.pipelines:
+            close = getattr(pipeline, "close", None)
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                self.spider.log.exception(f"{pipeline.__class__.__name__} 关闭出现错误 \n {e}")
+
+    def put(self, item, request=None):
+        self.track(item, request)
+        self.queue.put(item)
+
+    async def async_put(self, item, request=None):
+        """
+        事件循环中放入 item, 队列满时让出事件循环而不是阻塞
+        """
+        self.track(item, request)
+        while True:
+            try:
+                return self.queue.put_nowait(item)
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    def track(self, item, request):
+        """
+        记录 item 来自哪个请求, 开启 jobdir 时 item 写入之前请求会保留在快照中
+        """
+        if self.checkpoint is None or request is None:
+            return
+        self.checkpoint.item_added(request)
+        with self.sources_lock:
+            self.sources.setdefault(id(item), []).append(request)
+
+    def size(self):
+        return self.queue.qsize()
+
+    def next_items(self, deadline):
+        """
+        取出下一批需要写入的 item, 返回空列表表示本轮没有数据
+        """
+        if self.mode == "single":
+            try:
+                return [self.queue.get(timeout=0.1)]
+            except queue.Empty:
+                return []
+        items = []
+        while len(items) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0 and not self.stopped.is_set():
+                    items.append(self.queue.get(timeout=min(timeout, 0.1)))
+                else:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                if timeout <= 0 or self.stopped.is_set():
+                    break
+        return items
+
+    def run(self):
+        while True:
+            items = self.next_items(time.time() + self.flush_interval)
+            if items:
+                self.store(items)
+            elif self.stopped.is_set() and self.queue.empty():
+                break
+
+    async def async_run(self):
+        """
+        async pipline 的处理任务, 在事件循环中运行
+        """
+        deadline = time.time() + self.flush_interval
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+                if self.mode == "single" or len(items) >= self.batch_size:
+                    await self.async_store(items)
+                    items = []
+                    deadline = time.time() + self.flush_interval
+                continue
+            except queue.Empty:
+                pass
+            if items and (time.time() >= deadline or self.stopped.is_set()):
+                await self.async_store(items)
+                items = []
+            if not items:
+                deadline = time.time() + self.flush_interval
+            if self.stopped.is_set() and self.queue.empty() and not items:
+                break
+            await asyncio.sleep(0.01)
+
+    def process_pipelines(self, items):
+        for pipeline in self.pipelines:
+            try:
+                pipeline.process_items(items)
+            except Exception as e:
+                self.spider.log.exception(f"{pipeline.__class__.__name__} 处理 {len(items)} 条数据出现错误 \n {e}")
+
+    def store(self, items):
+        start = time.time()
+        self.process_pipelines(items)
+        try:
+            if self.mode == "single":
+                self.spider.pipline(items[0])
+            else:
+                self.spider.pipline(items)
+                self.log_batch(items)
+        except Exception as e:
+            self.spider.log.exception(f"{items} 入库出现错误 \n {e}")
+        self.items_done(items, time.time() - start)
+
+    async def async_store(self, items):
+        start = time.time()
+        if self.pipelines:
+            await asyncio.get_running_loop().run_in_executor(None, self.process_pipelines, items)
+        try:
+            if self.mode == "single":
+                await self.spider.pipline(items[0])
+            else:
+                await self.spider.pipline(items)
+                self.log_batch(items)
+        except Exception as e:
+            self.spider.log.exception(f"{items} 入库出现错误 \n {e}")
+        self.items_done(items, time.time() - start)
+
+    def log_batch(self, items):
+        self.spider.log.success(
+            f"pipline 处理 {len(items)} 条数据 : {json.dumps(items, ensure_ascii=False)[0:100]}"
+        )
+
+    def items_done(self, items, cost):
+        if self.checkpoint is not None:
+            for item in items:
+                with self.sources_lock:
+                    requests = self.sources.get(id(item))
+                    request = requests.pop(0) if requests else None
+                    if requests == []:
+                        del self.sources[id(item)]
+                if request is not None:
+                    self.checkpoint.item_written(request)
+        self.stats.add_value("pipeline/flush_latency", cost)
+        self.stats.inc_value("pipeline/items", len(items))
+        for name, count in Counter(item.__class__.__name__.lower() for item in items).items():
+            self.stats.inc_value(name, count)
@@ -0,0 +1,184 @@
+import collections
+import heapq
+import itertools
+import queue
+import sqlite3
+import threading
+
+
+class PriorityQueue:
+    """
+    线程安全的优先级队列,接口和 queue.Queue 保持一致
+    priority 越大越先出队,同一优先级下 bfs 按先进先出, dfs 按后进先出
+    每个优先级一个 deque, 任务不需要额外的 (priority, seq) 元组, push/pop 的时间复杂度为 O(1),
+    只有新增或者取空一个优先级时为 O(log p), p 为不同优先级的数量
+    """
+
+    def __init__(self, order="bfs"):
+        if order not in ("bfs", "dfs"):
+            raise ValueError(f"order must be 'bfs' or 'dfs', got {order!r}")
+        self.order = order
+        self._buckets = {}  # priority -> deque
+        self._priorities = []  # 有任务的优先级, 取负数后的最小堆
+        self._size = 0
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def put(self, item, priority=0, block=True, timeout=None):
+        with self._not_empty:
+            bucket = self._buckets.get(priority)
+            if bucket is None:
+                bucket = self._buckets[priority] = collections.deque()
+                heapq.heappush(self._priorities, -priority)
+            bucket.append(item)
+            self._size += 1
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if not block:
+                if not self._size:
+                    raise queue.Empty
+            elif not self._not_empty.wait_for(lambda: self._size, timeout=timeout):
+                raise queue.Empty
+            priority = -self._priorities[0]
+            bucket = self._buckets[priority]
+            item = bucket.popleft() if self.order == "bfs" else bucket.pop()
+            if not bucket:
+                del self._buckets[priority]
+                heapq.heappop(self._priorities)
+            self._size -= 1
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return not self._size
+
+
+class DiskPriorityQueue(PriorityQueue):
+    """
+    带磁盘溢出的优先级队列,内存中最多保留 memory_limit 个任务,超出的任务通过 serialize 序列化后写入 sqlite
+    出队时如果磁盘中有优先级更高的任务,会批量读回内存,出队顺序和纯内存队列一致
+    close 时内存中的任务也会写入磁盘,下次打开同一个文件会继续之前的队列;
+    读回内存的任务会从磁盘中删除, 没有调用 close 就退出时内存中的任务会丢失
+    serialize 返回 None 的任务(无法序列化)始终保留在内存中
+    """
+
+    def __init__(self, path, serialize, deserialize, memory_limit=100000, order="bfs", batch_size=1000):
+        super().__init__(order=order)
+        self._heap = []  # 需要和磁盘中的任务按 (priority, seq) 比较顺序, 内存中的任务也保存在堆中
+        self._sign = 1 if order == "bfs" else -1
+        self.path = path
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.memory_limit = memory_limit
+        self.batch_size = batch_size
+        self._spill = []  # 等待批量写入磁盘的任务
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queue (priority INTEGER, seq INTEGER, data BLOB)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS queue_order ON queue (priority, seq)")
+        size, max_seq = self.db.execute("SELECT COUNT(*), MAX(ABS(seq)) FROM queue").fetchone()
+        self._disk_size = size
+        self._counter = itertools.count((max_seq or 0) + 1)
+        self._disk_top = self._query_top()
+
+    def _key(self, priority):
+        return -priority, self._sign * next(self._counter)
+
+    def _query_top(self):
+        row = self.db.execute("SELECT priority, seq FROM queue ORDER BY priority, seq LIMIT 1").fetchone()
+        return tuple(row) if row else None
+
+    def _executemany(self, sql, rows):
+        """
+        isolation_level=None 时每条语句单独提交, 一批语句放在同一个事务中只提交一次
+        """
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(sql, rows)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _flush_spill(self):
+        if not self._spill:
+            return
+        self._executemany("INSERT INTO queue (priority, seq, data) VALUES (?, ?, ?)", self._spill)
+        self._spill = []
+
+    def _load(self):
+        """
+        把磁盘中优先级最高的一批任务读回内存
+        """
+        self._flush_spill()
+        rows = self.db.execute(
+            "SELECT rowid, priority, seq, data FROM queue ORDER BY priority, seq LIMIT ?", (self.batch_size,)
+        ).fetchall()
+        self._executemany("DELETE FROM queue WHERE rowid = ?", [(row[0],) for row in rows])
+        self._disk_size -= len(rows)
+        self._disk_top = self._query_top()
+        for _, priority, seq, data in rows:
+            item = self.deserialize(data)
+            if item is not None:
+                heapq.heappush(self._heap, (priority, seq, item))
+
+    def put(self, item, priority=0, block=True, timeout=None):
+        data = None
+        if len(self._heap) >= self.memory_limit:
+            data = self.serialize(item)
+        with self._not_empty:
+            key = self._key(priority)
+            if data is None:
+                heapq.heappush(self._heap, (*key, item))
+            else:
+                self._spill.append((*key, data))
+                self._disk_size += 1
+                if self._disk_top is None or key < self._disk_top:
+                    self._disk_top = key
+                if len(self._spill) >= self.batch_size:
+                    self._flush_spill()
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if not block:
+                if not self._heap and not self._disk_size:
+                    raise queue.Empty
+            elif not self._not_empty.wait_for(lambda: self._heap or self._disk_size, timeout=timeout):
+                raise queue.Empty
+            if self._disk_size and (not self._heap or self._disk_top < self._heap[0][:2]):
+                self._load()
+                if not self._heap:
+                    raise queue.Empty
+            return heapq.heappop(self._heap)[-1]
+
+    def qsize(self):
+        return len(self._heap) + self._disk_size
+
+    def empty(self):
+        return not self._heap and not self._disk_size
+
+    def close(self):
+        """
+        把内存中可以序列化的任务写入磁盘后关闭数据库
+        """
+        with self._not_empty:
+            remain = []
+            for priority, seq, item in self._heap:
+                data = self.serialize(item)
+                if data is None:
+                    remain.append((priority, seq, item))
+                else:
+                    self._spill.append((priority, seq, data))
+                    self._disk_size += 1
+            heapq.heapify(remain)
+            self._heap = remain
+            self._flush_spill()
+            self.db.close()
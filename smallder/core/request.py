@@ -26,10 +26,18 @@ class Request:
         "allow_redirects",
         "retry",
         "errback",
-        "fetch"
+        "fetch",
+        "stream",
+        "header_template",
         # "flags",
         # "cb_kwargs",
     )
+    # 调度器中可能同时保存上百万个请求, 使用 __slots__ 减少每个请求占用的内存
+    __slots__ = (
+        "method", "url", "params", "_headers", "_headers_shared", "data", "json", "cookies", "timeout",
+        "callback", "errback", "proxies", "dont_filter", "verify", "priority", "allow_redirects", "retry",
+        "fetch", "stream", "header_template", "_meta", "_referer",
+    )
 
     def __init__(
             self,
@@ -51,7 +59,9 @@ class Request:
             allow_redirects=True,
             priority=0,
             fetch=None,
-            retry: int = 0  # 控制单个请求的重试次数
+            retry: int = 0,  # 控制单个请求的重试次数
+            stream=False,  # 响应内容写入临时文件, 访问 response.content 时才读入内存
+            header_template=None,  # custom_settings["header_templates"] 中的模板名称, headers 合并在模板之上
     ):
         self.method = "POST" if method.upper() == "POST" or data and data != "{}" else "GET"
         self.url = url
@@ -70,6 +80,8 @@ class Request:
         self.allow_redirects = allow_redirects
         self.retry = retry
         self.fetch = fetch
+        self.stream = stream
+        self.header_template = header_template
         self._meta = dict(meta) if meta else None
         self._referer = referer if referer else None
 
@@ -87,6 +99,10 @@ class Request:
 
     @property
     def headers(self):
+        if self._headers_shared:
+            # 多个请求共用同一个 headers, 第一次访问时复制一份, 修改不会影响其他请求
+            self._headers = dict(self._headers)
+            self._headers_shared = False
         return self._headers
 
     @headers.setter
@@ -94,10 +110,11 @@ class Request:
         if value is None:
             # 允许headers被显式设置为None
             self._headers = None
+            self._headers_shared = False
         elif isinstance(value, dict):
-            # 如果value是字典，则添加"Connection": "close"
-            value["Connection"] = "close"
+            # 不修改传入的dict, 多个请求可以共用同一个 headers
             self._headers = value
+            self._headers_shared = True
         else:
             # 如果value既不是None也不是dict，抛出错误或采取其他处理
             raise ValueError("headers must be a dictionary or None")
@@ -152,16 +169,57 @@ class Request:
 
     def replace(self, *args, **kwargs) -> "Request":
         """Create a new Request with the same attributes except for those given new values"""
-        for x in self.attributes:
-            kwargs.setdefault(x, getattr(self, x))
         cls = kwargs.pop("cls", self.__class__)
-        return cls(*args, **kwargs)
+        if args or cls is not Request or type(self) is not Request or not _replace_fields.issuperset(kwargs):
+            for x in self.attributes:
+                if x == "headers":
+                    kwargs.setdefault(x, self._share_headers())
+                else:
+                    kwargs.setdefault(x, getattr(self, x))
+            return cls(*args, **kwargs)
+        # 直接复制属性, 不再经过 __init__, headers 在修改时才复制; 新增 __slots__ 时需要同时修改这里
+        request = Request.__new__(Request)
+        request.method = self.method
+        request.url = self.url
+        request.params = self.params
+        request.data = self.data
+        request.json = self.json
+        request.cookies = self.cookies
+        request.timeout = self.timeout
+        request.callback = self.callback
+        request.errback = self.errback
+        request.proxies = self.proxies
+        request.dont_filter = self.dont_filter
+        request.verify = self.verify
+        request.priority = self.priority
+        request.allow_redirects = self.allow_redirects
+        request.retry = self.retry
+        request.fetch = self.fetch
+        request.stream = self.stream
+        request.header_template = self.header_template
+        request._referer = self._referer
+        request._headers = self._share_headers()
+        request._headers_shared = request._headers is not None
+        request._meta = dict(self._meta) if self._meta else None
+        for name, value in kwargs.items():
+            if name == "meta":
+                request._meta = dict(value) if value else None
+            elif name == "referer":
+                request._referer = value if value else None
+            else:
+                setattr(request, name, value)
+        return request
+
+    def _share_headers(self):
+        if self._headers is not None:
+            self._headers_shared = True
+        return self._headers
 
     def to_dict(self, spider):
         d = {
             "method": self.method,
             "url": self.url,  # urls are safe (safe_string_url)
-            "headers": self.headers,
+            "headers": self._headers,
             "callback": _find_method(spider, self.callback)
             if callable(self.callback)
             else self.callback,
@@ -176,9 +234,48 @@ class Request:
         return d
 
 
+# replace 时可以直接赋值的参数, method 和 data 需要经过 __init__ 重新计算请求方法
+_replace_fields = frozenset(Request.attributes) - {"method", "data"}
+
+_registries = {}  # 爬虫类 -> MethodRegistry
+
+
+class MethodRegistry:
+    """
+    爬虫类的方法表, 每个类只反射一次, 供 to_dict 查找回调名称和 request_from_dict 还原回调
+    """
+
+    def __init__(self, cls):
+        self.names = {}  # 函数 -> 方法名, 同一个函数有多个名称时取字母序第一个, 和 inspect.getmembers 一致
+        self.functions = {}  # 方法名 -> 普通函数, 不包含 staticmethod/classmethod
+        for name, member in inspect.getmembers(cls, predicate=inspect.isfunction):
+            if isinstance(inspect.getattr_static(cls, name), staticmethod):
+                continue
+            self.names.setdefault(member, name)
+            self.functions[name] = member
+        for name, member in inspect.getmembers(cls, predicate=inspect.ismethod):
+            self.names.setdefault(member.__func__, name)  # classmethod
+
+
+def method_registry(cls) -> MethodRegistry:
+    registry = _registries.get(cls)
+    if registry is None:
+        registry = _registries[cls] = MethodRegistry(cls)
+    return registry
+
+
 def _find_method(obj, func):
     """Helper function for Request.to_dict"""
     # Only instance methods contain ``__func__``
+    if obj and hasattr(func, "__func__"):
+        name = method_registry(type(obj)).names.get(func.__func__)
+        if name is not None:
+            return name
+    return _scan_method(obj, func)
+
+
+def _scan_method(obj, func):
+    """反射查找实例上的方法, 用于运行时绑定到实例或者添加到类上的方法"""
     if obj and hasattr(func, "__func__"):
         members = inspect.getmembers(obj, predicate=inspect.ismethod)
         for name, obj_func in members:
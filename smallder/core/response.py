@@ -1,30 +1,74 @@
+import codecs
 import copy
 import json
+import re
 from json import JSONDecodeError
 from urllib.parse import urljoin, parse_qsl, urlparse
 from lxml import etree
 
 import chardet
+from smallder.core.selector import Selector
 from smallder.utils.utils import guess_json_utf
 
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+_charset_re = re.compile(r"charset\s*=\s*[\"']?\s*([\w.:-]+)", re.I)
+_meta_charset_re = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)", re.I)
+_xml_encoding_re = re.compile(rb"^\s*<\?xml[^>]+encoding\s*=\s*[\"']([\w.:-]+)", re.I)
+# 网页中声明的 gb2312/gbk 实际经常包含超出范围的字符, 和浏览器一样使用超集解码
+_encoding_aliases = {"gb2312": "gb18030", "gbk": "gb18030"}
+
+
+def _normalize_encoding(encoding):
+    """
+    返回python可以识别的编码名称,无法识别时返回None
+    """
+    if not encoding:
+        return None
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode("ascii", errors="ignore")
+    encoding = encoding.strip().lower()
+    encoding = _encoding_aliases.get(encoding, encoding)
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
 
 class Response:
     attributes = [
         "url",
         "status_code",
-        # "headers",
+        "headers",
         "content",
         # "flags",
         "request",
         "encoding",
         "cookies",
-        "elapsed"
+        "elapsed",
+        "body",
+        "raw_size",
+        "size",
+        "parse_limit",
         # "ip_address",
         # "protocol",
     ]
+    __slots__ = (
+        "url", "status_code", "request", "cookies", "elapsed", "headers", "body", "raw_size", "size",
+        "_content", "_encoding", "_cached_text", "_cached_encoding", "_cached_root", "_cached_selector",
+        "_cached_json", "parse_limit",
+    )
+
+    meta_sniff_size = 4096  # 在前多少字节中查找 <meta charset>
+    chardet_sample_size = 64 * 1024  # chardet 最多检测多少字节
 
-    def __init__(self, url=None, status_code=200, content=None, request=None, encoding="utf-8", cookies=None,
-                 elapsed=0):
+    def __init__(self, url=None, status_code=200, content=None, request=None, encoding=None, cookies=None,
+                 elapsed=0, headers=None, body=None, raw_size=None, size=None, parse_limit=0):
         if request is None:
             raise ValueError("Request cannot be None")
         self.url = url or request.full_url()
@@ -34,6 +78,46 @@ class Response:
         self.encoding = encoding
         self.cookies = cookies or {}
         self.elapsed = elapsed
+        self.headers = headers or {}
+        self.body = body  # Request(stream=True) 时响应内容所在的临时文件, 访问 content 时才读入内存
+        self.raw_size = raw_size  # 实际传输的(压缩后的)响应内容字节数, 下载器之外创建的响应为None
+        self.size = size  # 解压后的响应内容字节数
+        self.parse_limit = parse_limit  # 大于0时 root/xpath/css 只解析 content 的前 parse_limit 字节, text 不受影响
+
+    def _clear_cache(self):
+        self._cached_text = None
+        self._cached_encoding = None
+        self._cached_root = None
+        self._cached_selector = None
+        self._cached_json = None
+
+    @property
+    def content(self):
+        if self._content is None and self.body is not None:
+            self.body.seek(0)
+            self._content = self.body.read()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._clear_cache()
+
+    @property
+    def encoding(self):
+        """
+        响应的编码, 没有指定时依次从 BOM、Content-Type、meta 标签中获取, 都没有时检测编码
+        """
+        if self._encoding:
+            return self._encoding
+        if self._cached_encoding is None:
+            self._decode()
+        return self._cached_encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        self._encoding = value
+        self._clear_cache()
 
     def __repr__(self):
         parts = ["<Response"]
@@ -71,27 +155,99 @@ class Response:
             )
 
     @property
-    def text(self, encoding="utf-8"):
-        try:
-            return self.content.decode(encoding)
-        except UnicodeDecodeError:
+    def text(self):
+        """
+        解码后的文本, 只在第一次访问时解码
+        """
+        if self._cached_text is None:
+            self._decode()
+        return self._cached_text
+
+    def _decode(self):
+        content = self.content or b""
+        encoding = self._declared_encoding(content)
+        if encoding is None:
             try:
-                encoding = self._auto_char_code() or "utf-8"
-                return self.content.decode(encoding, errors="ignore")
+                text = content.decode("utf-8")
+                encoding = "utf-8"
             except UnicodeDecodeError:
-                raise UnicodeDecodeError(f"{encoding} codec can't decode")
-            except TypeError:
-                raise UnicodeDecodeError("codec can't decode")
+                encoding = _normalize_encoding(self._auto_char_code()) or "utf-8"
+                text = content.decode(encoding, errors="ignore")
+        else:
+            text = content.decode(encoding, errors="ignore")
+        self._cached_encoding = encoding
+        self._cached_text = text
+
+    def _declared_encoding(self, content):
+        encoding = _normalize_encoding(self._encoding)
+        if encoding:
+            return encoding
+        for bom, encoding in _BOMS:
+            if content.startswith(bom):
+                return encoding
+        match = _charset_re.search(self._content_type())
+        if match:
+            encoding = _normalize_encoding(match.group(1))
+            if encoding:
+                return encoding
+        head = content[:self.meta_sniff_size]
+        match = _xml_encoding_re.search(head) or _meta_charset_re.search(head)
+        if match:
+            return _normalize_encoding(match.group(1))
+        return None
+
+    def _content_type(self):
+        for key, value in self.headers.items():
+            if key.lower() == "content-type":
+                return value
+        return ""
 
     @property
     def ok(self):
         return self.status_code == 200
 
     def _auto_char_code(self):
-        char_code = chardet.detect(self.content)
+        char_code = chardet.detect(self._head(self.chardet_sample_size))
         encoding = char_code.get('encoding', 'utf-8')
         return encoding
 
+    def _head(self, size):
+        """
+        content 的前 size 字节, 流式响应只从临时文件中读取需要的部分
+        """
+        if self._content is None and self.body is not None:
+            self.body.seek(0)
+            return self.body.read(size)
+        return (self._content or b"")[:size]
+
+    def iter_content(self, chunk_size=64 * 1024):
+        """
+        按块返回响应内容, 流式响应不会把整个文件读入内存
+        """
+        if self._content is None and self.body is not None:
+            self.body.seek(0)
+            for chunk in iter(lambda: self.body.read(chunk_size), b""):
+                yield chunk
+            return
+        content = self._content or b""
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def save(self, path, chunk_size=64 * 1024):
+        """
+        把响应内容写入文件
+        """
+        with open(path, "wb") as f:
+            for chunk in self.iter_content(chunk_size):
+                f.write(chunk)
+
+    def close(self):
+        """
+        关闭流式响应的临时文件
+        """
+        if self.body is not None:
+            self.body.close()
+
     def params(self):
 
         if self.request.params:
@@ -107,7 +263,17 @@ class Response:
         return urljoin(self.url, url)
 
     def json(self, **kwargs):
-        if not self.encoding and self.content and len(self.content) > 3:
+        """
+        解析json, 没有参数时解析结果会被缓存, 多次调用返回同一个对象
+        """
+        if kwargs:
+            return self._load_json(**kwargs)
+        if self._cached_json is None:
+            self._cached_json = self._load_json()
+        return self._cached_json
+
+    def _load_json(self, **kwargs):
+        if not self._encoding and self._cached_text is None and self.content and len(self.content) > 3:
             # No encoding set. JSON RFC 4627 section 3 states we should expect
             # UTF-8, -16 or -32. Detect which one to use; If the detection or
             # decoding fails, fall back to `self.text` (using charset_normalizer to make
@@ -116,6 +282,9 @@ class Response:
             if encoding is not None:
                 try:
                     return json.loads(self.content.decode(encoding), **kwargs)
+                except UnicodeDecodeError:
+                    # 不是 utf 编码, 使用 self.text 检测编码后解析
+                    pass
                 except JSONDecodeError as e:
                     raise JSONDecodeError(e.msg, e.doc, e.pos)
 
@@ -127,10 +296,59 @@ class Response:
     def replace(self, *args, **kwargs):
         """Create a new Response with the same attributes except for those given new values"""
         for x in self.attributes:
-            kwargs.setdefault(x, getattr(self, x))
+            # 只复制指定的编码和已经读取的内容, 避免为了复制属性解码或者读取整个响应
+            if x == "encoding":
+                kwargs.setdefault(x, self._encoding)
+            elif x == "content":
+                kwargs.setdefault(x, self._content)
+            else:
+                kwargs.setdefault(x, getattr(self, x))
         cls = kwargs.pop("cls", self.__class__)
         return cls(*args, **kwargs)
 
     @property
     def root(self):
-        return etree.HTML(self.text)
+        """
+        lxml 解析后的文档, 只在第一次访问时解析
+        """
+        if self._cached_root is None:
+            self._cached_root = etree.HTML(self._parse_text())
+        return self._cached_root
+
+    def _parse_text(self):
+        """
+        需要解析的文本, 超过 parse_limit 时只解码前 parse_limit 字节, 不会解码整个响应
+        """
+        limit = self.parse_limit
+        if not limit:
+            return self.text
+        head = self._head(limit + 1)
+        if len(head) <= limit:
+            return self.text
+        head = head[:limit]
+        encoding = self._cached_encoding or self._declared_encoding(head)
+        if encoding is None:
+            try:
+                # 截断的位置可能在多字节字符中间, 使用增量解码忽略最后不完整的字符
+                return codecs.getincrementaldecoder("utf-8")().decode(head)
+            except UnicodeDecodeError:
+                encoding = _normalize_encoding(self._auto_char_code()) or "utf-8"
+        return head.decode(encoding, errors="ignore")
+
+    @property
+    def selector(self):
+        if self._cached_selector is None:
+            self._cached_selector = Selector(root=self.root)
+        return self._cached_selector
+
+    def xpath(self, query, **variables):
+        """
+        response.xpath("//a/@href").getall(), 编译后的xpath会被缓存
+        """
+        return self.selector.xpath(query, **variables)
+
+    def css(self, query):
+        """
+        response.css("a::attr(href)").getall(), 需要安装 cssselect
+        """
+        return self.selector.css(query)
@@ -1,11 +1,18 @@
 import _queue
 import importlib
 import json
+import os
 import queue
+import sys
+import threading
+import time
 import traceback
 from collections.abc import Iterable
 from smallder import Request
 from smallder.core.dupfilter import Filter, FilterFactory
+from smallder.core.queues import PriorityQueue, DiskPriorityQueue
+from smallder.core.serializer import RequestSerializer
+from smallder.core.statscollectors import get_stats_collector
 from smallder.utils.request import request_from_dict
 
 
@@ -16,6 +23,8 @@ class Scheduler:
         self.spider = spider
         self.batch_size = self.spider.batch_size or self.spider.thread_count * 10
         self.dup_filter = dup_filter
+        self.stats = get_stats_collector(spider)
+        self.checkpoint = None  # 设置 jobdir 时由引擎设置, 记录还没有完成的请求
 
     def next_job(self, block=False):
         pass
@@ -32,6 +41,12 @@ class Scheduler:
     def add_failed_job(self, job, block=False):
         pass
 
+    def close(self):
+        """
+        爬虫结束时调用,用于保存调度器中缓存的任务
+        """
+        pass
+
     def filter_request(self, job):
         """
         过滤任务，如果是request并且需要去重就进行过滤
@@ -39,7 +54,10 @@ class Scheduler:
         :return:
         """
         if isinstance(job, Request) and not job.dont_filter:
-            return not self.dup_filter.request_seen(job)
+            self.stats.inc_value("dupfilter/checked")
+            if self.dup_filter.request_seen(job):
+                self.stats.inc_value("dupfilter/filtered")
+                return False
         return True
 
     def __repr__(self):
@@ -47,19 +65,85 @@ class Scheduler:
 
 
 class MemoryScheduler(Scheduler):
+    """
+    内存优先级调度器, Request.priority 越大越先执行
+    custom_settings["scheduler_order"] 控制同一优先级的出队顺序: bfs 先进先出(默认), dfs 后进先出
+    custom_settings["memory_queue_dir"] 设置后,内存中超过 memory_queue_limit 的请求会写入该目录下的 sqlite 文件,
+    爬虫正常结束时内存中剩余的请求也会保存下来, memory_queue_resume 为 True 时下次启动同名爬虫继续执行,
+    否则启动时清空上次的文件; 异常退出时内存中的请求(最多 memory_queue_limit 个)会丢失, 需要断点续爬时使用 jobdir
+    """
+
+    def __init__(self, spider, dup_filter: Filter):
+        super().__init__(spider, dup_filter)
+        settings = self.spider.custom_settings
+        order = settings.get("scheduler_order", "bfs")
+        queue_dir = settings.get("memory_queue_dir")
+        if queue_dir:
+            # 磁盘队列可能在没有redis的情况下恢复, headers 直接写入请求
+            self.serializer = RequestSerializer(spider)
+            os.makedirs(queue_dir, exist_ok=True)
+            path = os.path.join(queue_dir, f"{self.spider.name}.sqlite3")
+            if not settings.get("memory_queue_resume", False):
+                for name in (path, path + "-wal", path + "-shm"):
+                    if os.path.exists(name):
+                        os.remove(name)
+            self.queue = DiskPriorityQueue(
+                path,
+                serialize=self.encode_request,
+                deserialize=self.decode_request,
+                memory_limit=settings.get("memory_queue_limit", 100000),
+                order=order,
+            )
+            if self.queue.qsize():
+                self.spider.log.info(
+                    f"从 {path} 恢复了 {self.queue.qsize()} 个请求, start_requests 仍然会执行, 产生的请求需要自己去重"
+                )
+        else:
+            self.queue = PriorityQueue(order=order)
+
+    def encode_request(self, job):
+        """
+        只有 Request 可以写入磁盘,回调不是爬虫方法或者参数无法序列化时返回None,任务保留在内存中
+        """
+        if not isinstance(job, Request):
+            return None
+        try:
+            return self.serializer.dumps(job)
+        except (ValueError, TypeError):
+            return None
+
+    def decode_request(self, data):
+        try:
+            return self.serializer.loads(data)
+        except Exception as e:
+            self.spider.log.error(f"磁盘队列中的请求无法还原: {e}")
+            return None
+
+    def job_priority(self, job):
+        if isinstance(job, Request):
+            return job.priority
+        # Response 和 Item 已经完成下载,优先于新的请求处理,避免在队列中堆积
+        return sys.maxsize
 
     def next_job(self, block=False):
         try:
             job = self.queue.get(block=block)
+            if self.checkpoint is not None and isinstance(job, Request):
+                # 先标记再去重, 快照中已经写入指纹的请求一定带有标记
+                self.checkpoint.seen(job)
             if self.filter_request(job):
                 return job
+            if self.checkpoint is not None:
+                self.checkpoint.done(job)
         except _queue.Empty:
             pass
         except Exception:
             traceback.print_exc()
 
     def add_job(self, job, block=False):
-        self.queue.put(job, block=block)
+        if self.checkpoint is not None and isinstance(job, Request):
+            self.checkpoint.add(job)
+        self.queue.put(job, priority=self.job_priority(job), block=block)
 
     def size(self):
         return self.queue.qsize()
@@ -67,6 +151,10 @@ class MemoryScheduler(Scheduler):
     def empty(self):
         return self.queue.empty()
 
+    def close(self):
+        if isinstance(self.queue, DiskPriorityQueue):
+            self.queue.close()
+
 
 class RedisScheduler(Scheduler):
 
@@ -77,6 +165,13 @@ class RedisScheduler(Scheduler):
         self.request_key = self.spider.redis_task_key if self.spider.redis_task_key else f"{self.spider.name}:request"
         self.fail_request_key = f"{self.spider.redis_task_key}:fail_request" \
             if self.spider.redis_task_key else f"{self.spider.name}:fail_request"
+        # 新任务先缓存在本地,达到数量或者时间间隔后一次性写入redis
+        self.push_batch = self.spider.custom_settings.get("redis_push_batch", 100)
+        self.push_interval = self.spider.custom_settings.get("redis_push_interval", 1)
+        self.push_buffer = []
+        self.push_lock = threading.Lock()
+        self.last_flush = time.time()
+        self.serializer = RequestSerializer(spider, server=self.server, headers_key=f"{self.request_key}:headers")
 
     def _request_from_dict(self, d):
         return request_from_dict(d, self.spider)
@@ -84,13 +179,15 @@ class RedisScheduler(Scheduler):
     def pop_redis_to_queue(self, redis_key):
         datas = self.pop_list_queue(redis_key, self.batch_size)
         for byte_data in datas:
-            data = self._request_from_dict(json.loads(byte_data.decode()))
-            self.queue.put(data)
+            self.queue.put(self.serializer.loads(byte_data))
 
     def next_job(self, block=False):
         try:
             if self.queue.empty():
+                self.flush()
                 self.pop_redis_to_queue(self.request_key)
+            elif time.time() - self.last_flush >= self.push_interval:
+                self.flush()
             job = self.queue.get(block=block)
             if self.filter_request(job):
                 return job
@@ -102,13 +199,53 @@ class RedisScheduler(Scheduler):
     def add_job(self, job, block=False):
         if isinstance(job, Request):
             try:
-                _str = json.dumps(job.to_dict(self.spider))
-                self.server.rpush(self.request_key, _str.encode())
+                self.buffer_push(self.encode_request(job))
             except Exception as e:
                 self.spider.log.exception(e)
         else:
             self.queue.put(job)
 
+    def encode_request(self, job):
+        return self.serializer.dumps(job)
+
+    def buffer_push(self, data):
+        with self.push_lock:
+            self.push_buffer.append(data)
+            full = len(self.push_buffer) >= self.push_batch
+        if full or time.time() - self.last_flush >= self.push_interval:
+            self.flush()
+
+    def push_requests(self, datas):
+        self.server.rpush(self.request_key, *datas)
+
+    def flush(self):
+        """
+        把本地缓存的任务通过一次 RPUSH 写入redis
+        """
+        with self.push_lock:
+            datas, self.push_buffer = self.push_buffer, []
+            self.last_flush = time.time()
+        if not datas:
+            return
+        start = time.time()
+        try:
+            self.push_requests(datas)
+        except Exception as e:
+            self.spider.log.exception(e)
+            with self.push_lock:
+                # 写入失败的任务放回缓存,下次再写入
+                self.push_buffer[:0] = datas
+            return
+        cost = int((time.time() - start) * 1000)
+        self.stats.inc_value("redis_push/flush_count")
+        self.stats.inc_value("redis_push/flush_items", len(datas))
+        self.stats.max_value("redis_push/flush_max_size", len(datas))
+        self.stats.inc_value("redis_push/flush_time_ms", cost)
+        self.stats.max_value("redis_push/flush_max_time_ms", cost)
+
+    def close(self):
+        self.flush()
+
     def add_failed_job(self, job, block=False):
         if isinstance(job, Request) and self.spider.save_failed_request:
             try:
@@ -129,10 +266,65 @@ class RedisScheduler(Scheduler):
             size = self.server.llen(self.request_key) + self.queue.qsize()
         else:
             size = self.queue.qsize()
-        return size
+        return size + len(self.push_buffer)
+
+    def empty(self):
+        return self.queue.empty() and not self.push_buffer and not bool(self.server.llen(self.request_key))
+
+
+class RedisPriorityScheduler(RedisScheduler):
+    """
+    基于有序集合的redis优先级调度器, Request.priority 越大越先执行,同一优先级先进先出
+    出队使用lua脚本原子地批量弹出,多个节点共享同一个队列时不会重复消费或丢失任务
+    custom_settings["scheduler_class"] = "smallder.core.scheduler.RedisPriorityScheduler"
+    """
+    # member 为16位序号+序列化后的请求,score相同时按序号排序,保证同一优先级先进先出
+    push_script = """
+    local last = redis.call('INCRBY', KEYS[2], #ARGV / 2)
+    local seq = last - #ARGV / 2
+    for i = 1, #ARGV, 2 do
+        seq = seq + 1
+        redis.call('ZADD', KEYS[1], ARGV[i], string.format('%016d', seq) .. ARGV[i + 1])
+    end
+    return last
+    """
+    pop_script = """
+    local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #items > 0 then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items - 1)
+    end
+    return items
+    """
+    seq_length = 16
+
+    def __init__(self, spider, dup_filter: Filter):
+        super().__init__(spider, dup_filter)
+        self.request_key = f"{self.request_key}:priority"
+        self.seq_key = f"{self.request_key}:seq"
+        self._push = self.server.register_script(self.push_script)
+        self._pop = self.server.register_script(self.pop_script)
+
+    def pop_redis_to_queue(self, redis_key):
+        datas = self._pop(keys=[redis_key], args=[self.batch_size])
+        for byte_data in datas:
+            self.queue.put(self.serializer.loads(byte_data[self.seq_length:]))
+
+    def encode_request(self, job):
+        return -job.priority, super().encode_request(job)
+
+    def push_requests(self, datas):
+        args = [value for data in datas for value in data]
+        self._push(keys=[self.request_key, self.seq_key], args=args)
+
+    def size(self):
+        if self.queue.empty():
+            size = self.server.zcard(self.request_key) + self.queue.qsize()
+        else:
+            size = self.queue.qsize()
+        return size + len(self.push_buffer)
 
     def empty(self):
-        return self.queue.empty() and not bool(self.server.llen(self.request_key))
+        return self.queue.empty() and not self.push_buffer and not bool(self.server.zcard(self.request_key))
 
 
 class RedisStartScheduler(RedisScheduler):
@@ -141,6 +333,7 @@ class RedisStartScheduler(RedisScheduler):
         try:
             found = 0
             if self.queue.empty():
+                self.flush()
                 # redis 任务key不为空
                 if not self.server.llen(self.request_key):
                     datas = self.pop_list_queue(self.spider.redis_task_key, self.batch_size)
@@ -173,10 +366,12 @@ class RedisStartScheduler(RedisScheduler):
                 self.spider.redis_task_key)
         else:
             size = self.queue.qsize()
-        return size
+        return size + len(self.push_buffer)
 
     def empty(self):
         if self.queue.empty():
+            if self.push_buffer:
+                return False
             return not self.server.exists(self.request_key) and not self.server.exists(self.spider.redis_task_key)
 
         else:
@@ -0,0 +1,136 @@
+import threading
+from functools import lru_cache
+
+from lxml import etree
+
+_namespaces = {
+    "re": "http://exslt.org/regular-expressions",
+    "set": "http://exslt.org/sets",
+}
+_local = threading.local()
+xpath_cache_size = 1024  # 每个线程最多缓存多少个编译后的xpath
+
+
+def compile_xpath(query):
+    """
+    返回编译后的xpath, 按表达式缓存, 编译结果不能跨线程共享, 每个线程单独缓存
+    """
+    cache = getattr(_local, "xpath_cache", None)
+    if cache is None:
+        cache = _local.xpath_cache = {}
+    compiled = cache.get(query)
+    if compiled is None:
+        if len(cache) >= xpath_cache_size:
+            cache.clear()
+        compiled = cache[query] = etree.XPath(query, namespaces=_namespaces, smart_strings=False)
+    return compiled
+
+
+@lru_cache(maxsize=1024)
+def css_to_xpath(query):
+    """
+    把css选择器转换为xpath, 支持 ::text 和 ::attr(name) 伪元素, 需要安装 cssselect
+    """
+    return _css_translator().css_to_xpath(query)
+
+
+@lru_cache(maxsize=None)
+def _css_translator():
+    try:
+        from cssselect import GenericTranslator
+        from cssselect.xpath import ExpressionError, XPathExpr
+    except ImportError:
+        raise ImportError("css selector requires cssselect, please run: pip install cssselect")
+
+    class CSSTranslator(GenericTranslator):
+        def xpath_pseudo_element(self, xpath, pseudo_element):
+            if isinstance(pseudo_element, str):
+                if pseudo_element == "text":
+                    return xpath.join("/", XPathExpr(element="text()"))
+                raise ExpressionError(f"The pseudo-element ::{pseudo_element} is unknown")
+            if pseudo_element.name == "attr":
+                arguments = [token.value for token in pseudo_element.arguments if token.type != "S"]
+                if len(arguments) != 1:
+                    raise ExpressionError("::attr() requires exactly one argument")
+                return xpath.join("/", XPathExpr(element="@" + arguments[0]))
+            raise ExpressionError(f"The pseudo-element ::{pseudo_element.name}() is unknown")
+
+    return CSSTranslator()
+
+
+class Selector:
+    """
+    对 lxml 节点或者 xpath 返回的字符串的封装, 接口和 scrapy/parsel 的 Selector 保持一致
+    """
+    __slots__ = ("root",)
+
+    def __init__(self, text=None, root=None):
+        if root is None:
+            root = etree.HTML(text) if text else None
+        self.root = root
+
+    def xpath(self, query, **variables):
+        if not isinstance(self.root, etree._Element):
+            return SelectorList()
+        result = compile_xpath(query)(self.root, **variables)
+        if not isinstance(result, list):
+            result = [result]
+        return SelectorList(Selector(root=item) for item in result)
+
+    def css(self, query):
+        return self.xpath(css_to_xpath(query))
+
+    def get(self):
+        """
+        节点返回html, 文本和属性返回字符串
+        """
+        root = self.root
+        if isinstance(root, etree._Element):
+            return etree.tostring(root, method="html", encoding="unicode", with_tail=False)
+        if root is None:
+            return None
+        if isinstance(root, bool):
+            return "1" if root else "0"
+        return str(root)
+
+    def getall(self):
+        return [self.get()]
+
+    @property
+    def attrib(self):
+        if isinstance(self.root, etree._Element):
+            return dict(self.root.attrib)
+        return {}
+
+    def __bool__(self):
+        return bool(self.get())
+
+    def __repr__(self):
+        data = self.get() or ""
+        return f"<Selector data={data[:40]!r}>"
+
+
+class SelectorList(list):
+    """
+    Selector 的列表, xpath/css 会在每个元素上执行后合并结果
+    """
+
+    def xpath(self, query, **variables):
+        return SelectorList(item for selector in self for item in selector.xpath(query, **variables))
+
+    def css(self, query):
+        return self.xpath(css_to_xpath(query))
+
+    def get(self, default=None):
+        for selector in self:
+            return selector.get()
+        return default
+
+    def getall(self):
+        return [selector.get() for selector in self]
+
+    @property
+    def attrib(self):
+        for selector in self:
+            return selector.attrib
+        return {}
@@ -0,0 +1,171 @@
+import hashlib
+import inspect
+import json
+
+from smallder import Request
+from smallder.core.request import _find_method
+from smallder.utils.request import request_from_dict, _get_method
+
+MSGPACK = b"\x01"
+JSON = b"\x02"
+
+# 字段的短名称, 和默认值相同的字段不会写入
+aliases = {
+    "url": "u",
+    "method": "m",
+    "headers": "h",
+    "params": "p",
+    "data": "d",
+    "json": "j",
+    "cookies": "c",
+    "meta": "mt",
+    "timeout": "t",
+    "proxies": "px",
+    "priority": "pr",
+    "dont_filter": "df",
+    "referer": "r",
+    "verify": "v",
+    "allow_redirects": "ar",
+    "retry": "rt",
+    "callback": "cb",
+    "errback": "eb",
+    "fetch": "f",
+    "stream": "s",
+    "header_template": "ht",
+}
+fields = {alias: name for name, alias in aliases.items()}
+HEADER_PROFILE = "hp"
+_methods = ("callback", "errback", "fetch")
+
+
+def _request_defaults():
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(Request.__init__).parameters.items()
+        if parameter.default is not inspect.Parameter.empty
+    }
+    defaults["method"] = "GET"
+    return defaults
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("msgpack request serializer requires msgpack, please run: pip install msgpack")
+    return msgpack
+
+
+class RequestSerializer:
+    """
+    把请求序列化为紧凑的二进制, 第一个字节为格式: \\x01 msgpack, \\x02 json, 以 { 开头的为旧版本的完整json
+    只写入和默认值不同的字段, 字段名使用短名称;
+    传入 server 时相同的 headers 只在 redis 的 headers_key 中保存一份, 请求中只保存 headers 的id
+    "request_serializer": "msgpack",  # msgpack/json, 默认安装了 msgpack 时使用 msgpack
+    "header_profiles_limit": 1000,  # 每个进程最多缓存多少种 headers, 超出后 headers 直接写入请求
+    """
+
+    def __init__(self, spider, server=None, headers_key=None):
+        settings = getattr(spider, "custom_settings", None) or {}
+        self.spider = spider
+        self.server = server
+        self.headers_key = headers_key
+        self.defaults = _request_defaults()
+        self.format = settings.get("request_serializer")
+        if self.format is None:
+            try:
+                _import_msgpack()
+                self.format = "msgpack"
+            except ImportError:
+                self.format = "json"
+        if self.format not in ("msgpack", "json"):
+            raise ValueError(f"request_serializer must be msgpack or json, got {self.format!r}")
+        self.msgpack = _import_msgpack() if self.format == "msgpack" else None
+        self.profiles_limit = settings.get("header_profiles_limit", 1000)
+        self.profile_ids = {}  # headers 的键值对 -> id
+        self.profiles = {}  # id -> headers
+
+    def dumps(self, request: Request) -> bytes:
+        d = self.to_compact(request)
+        if self.msgpack is not None:
+            return MSGPACK + self.msgpack.packb(d, use_bin_type=True)
+        return JSON + json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Request:
+        if isinstance(data, str):
+            data = data.encode()
+        marker = data[:1]
+        if marker == MSGPACK:
+            d = (self.msgpack or _import_msgpack()).unpackb(data[1:], raw=False, strict_map_key=False)
+        elif marker == JSON:
+            d = json.loads(data[1:].decode())
+        else:
+            # 升级前写入的完整json
+            return request_from_dict(json.loads(data.decode()), self.spider)
+        return self.from_compact(d)
+
+    def to_compact(self, request: Request) -> dict:
+        d = {}
+        for name, alias in aliases.items():
+            if name == "meta":
+                value = request._meta or None
+            elif name == "referer":
+                value = request._referer
+            elif name == "headers":
+                value = request._headers
+            else:
+                value = getattr(request, name)
+            if name in _methods:
+                if value is None:
+                    continue
+                value = _find_method(self.spider, value) if callable(value) else value
+            elif value == self.defaults.get(name):
+                continue
+            if name == "headers" and self.server is not None:
+                profile_id = self.intern_headers(value)
+                if profile_id is not None:
+                    d[HEADER_PROFILE] = profile_id
+                    continue
+            d[alias] = value
+        return d
+
+    def from_compact(self, d: dict) -> Request:
+        kwargs = {}
+        for alias, value in d.items():
+            if alias == HEADER_PROFILE:
+                kwargs["headers"] = self.load_headers(value)  # 同一种 headers 的请求共用一个dict, 修改时才复制
+                continue
+            name = fields[alias]
+            if name in _methods and self.spider is not None:
+                value = _get_method(self.spider, value)
+            kwargs[name] = value
+        return Request(**kwargs)
+
+    def intern_headers(self, headers):
+        """
+        返回 headers 的id, 第一次遇到时写入redis, 超过 header_profiles_limit 或者值无法哈希时返回None
+        """
+        try:
+            key = tuple(sorted(headers.items()))  # 与写入redis的json一样不区分key的顺序
+            profile_id = self.profile_ids.get(key)
+        except TypeError:
+            return None
+        if profile_id is not None:
+            return profile_id
+        if len(self.profile_ids) >= self.profiles_limit:
+            return None
+        data = json.dumps(headers, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        profile_id = hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+        self.server.hsetnx(self.headers_key, profile_id, data)
+        self.profile_ids[key] = profile_id
+        self.profiles[profile_id] = json.loads(data)
+        return profile_id
+
+    def load_headers(self, profile_id):
+        headers = self.profiles.get(profile_id)
+        if headers is None:
+            data = self.server.hget(self.headers_key, profile_id)
+            if data is None:
+                raise ValueError(f"header profile {profile_id} not found in {self.headers_key}")
+            headers = self.profiles[profile_id] = json.loads(data)
+        return headers
@@ -1,61 +1,318 @@
+import importlib
+import math
+import os
+import socket
+import threading
 import time
 from typing import Any, Dict
+from urllib.parse import urlparse
 
 from smallder.utils.utils import singleton
 
 StatsT = Dict[str, Any]
 
 
+class Histogram:
+    """
+    按对数分桶的直方图, 只保存每个桶的数量, 分位数的相对误差不超过 growth - 1
+    """
+    growth = 1.05
+    min_value = 0.001  # 小于这个值的都放在第一个桶
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value > self.min_value:
+            index = math.ceil(math.log(value / self.min_value, self.growth))
+        else:
+            index = 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.buckets.copy().items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        返回分位数所在桶的上限
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.min_value * self.growth ** index, self.max)
+        return self.max
+
+    def count_le(self, value):
+        """
+        小于等于 value 的观测值数量, 按桶的上限判断
+        """
+        if value < self.min_value:
+            return 0
+        limit = math.floor(math.log(value / self.min_value, self.growth) + 1e-9)
+        return sum(count for index, count in self.buckets.items() if index <= limit)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(self.max, 4),
+        }
+
+
+class _Shard:
+    """
+    单个线程的统计数据, 只有所属线程会写入, 读取时再汇总所有线程的数据
+    """
+    __slots__ = ("counters", "histograms", "domains")
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.domains = {}  # 域名 -> [请求数, 传输字节数, 解压后字节数]
+
+
 class StatsCollector:
+    """
+    计数按线程分片保存, inc_value 不需要加锁, get_value/get_stats 时才汇总
+    set_value/max_value/min_value 保存在共享的字典中, 计数以外的值使用这些方法设置
+    """
+    log_interval = 60  # 每隔多少秒输出一次每分钟的增量
+
     def __init__(self, spider):
         self._stats: StatsT = {}
-        self._cache_stats = {}
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
         self._start_time = time.time()
         self.start_period = time.time()
+        self._last_counters = {}
         self.spider = spider
 
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
     def handler(self, task_type=None):
-        if task_type is not None and isinstance(task_type,str):
-            cls_name = task_type.lower()
-            self.inc_value(cls_name)
-
-        # 输出日志
-        if time.time() - self.start_period > 60:
-            log_str = [f"任务池数量 : {len(self.spider.futures)}"]
-            for key, value in self._cache_stats.items():
-                log_str.append(f"{key} : {value}/min")
-            self.spider.log.info("  ".join(log_str))
-            self._cache_stats.clear()
-            self.start_period = time.time()
+        """
+        SPIDER_STATS 信号的处理函数, 引擎内部直接调用 inc_value 和 log_stats
+        """
+        if task_type is not None and isinstance(task_type, str):
+            self.inc_value(task_type.lower())
+        self.log_stats()
+
+    def log_stats(self):
+        """
+        距离上次输出超过 log_interval 秒时输出每分钟的增量
+        """
+        now = time.time()
+        if now - self.start_period <= self.log_interval:
+            return
+        counters = self._counters()
+        minutes = (now - self.start_period) / 60
+        log_str = [f"任务池数量 : {len(self.spider.futures)}"]
+        for key, value in counters.items():
+            delta = value - self._last_counters.get(key, 0)
+            if delta:
+                log_str.append(f"{key} : {round(delta / minutes)}/min")
+        self.spider.log.info("  ".join(log_str))
+        self._last_counters = counters
+        self.start_period = now
+
+    def _counters(self):
+        with self._lock:
+            shards = list(self._shards)
+        counters = {}
+        for shard in shards:
+            # dict.copy 在持有 GIL 时完成, 不会和写入线程冲突
+            for key, value in shard.counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+        return counters
 
     def get_value(
             self, key: str, default: Any = None) -> Any:
-        return self._stats.get(key, default)
+        value = self._stats.get(key)
+        for shard in list(self._shards):
+            count = shard.counters.get(key)
+            if count is not None:
+                value = count if value is None else value + count
+        return default if value is None else value
 
     def get_stats(self) -> StatsT:
-        return self._stats
+        """
+        返回汇总后的统计数据, 返回的是快照, 修改不会影响收集器
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        for key, value in self._counters().items():
+            stats[key] = stats[key] + value if isinstance(stats.get(key), (int, float)) else value
+        for key, histogram in self.get_histograms().items():
+            stats[key] = histogram.summary()
+        domains = self.get_domains()
+        if domains:
+            elapsed = max(time.time() - self._start_time, 1e-6)
+            stats["domains"] = {
+                domain: {
+                    "requests": requests,
+                    "raw_bytes": raw_bytes,
+                    "bytes": size,
+                    "requests/s": round(requests / elapsed, 2),
+                }
+                for domain, (requests, raw_bytes, size) in sorted(domains.items(), key=lambda x: -x[1][0])
+            }
+        return stats
+
+    def get_histograms(self) -> Dict[str, Histogram]:
+        """
+        汇总所有线程的直方图
+        """
+        histograms = {}
+        for shard in list(self._shards):
+            for key, histogram in shard.histograms.copy().items():
+                histograms.setdefault(key, Histogram()).merge(histogram)
+        return histograms
+
+    def get_domains(self) -> Dict[str, list]:
+        """
+        汇总所有线程按域名统计的 [请求数, 传输字节数, 解压后字节数]
+        """
+        domains = {}
+        for shard in list(self._shards):
+            for domain, values in shard.domains.copy().items():
+                total = domains.setdefault(domain, [0, 0, 0])
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+        return domains
 
     def set_value(self, key: str, value: Any) -> None:
-        self._stats[key] = value
+        with self._lock:
+            self._stats[key] = value
 
     def set_stats(self, stats: StatsT) -> None:
-        self._stats = stats
+        self.clear_stats()
+        with self._lock:
+            self._stats = dict(stats)
 
     def inc_value(
             self, key: str, count: int = 1, start: int = 0
     ) -> None:
-        d = self._stats
-        d[key] = d.setdefault(key, start) + count
-        self._cache_stats[key] = self._cache_stats.setdefault(key, start) + count
+        if start:
+            with self._lock:
+                self._stats.setdefault(key, start)
+        counters = self._shard().counters
+        counters[key] = counters.get(key, 0) + count
 
     def max_value(self, key: str, value: Any) -> None:
-        self._stats[key] = max(self._stats.setdefault(key, value), value)
+        with self._lock:
+            self._stats[key] = max(self._stats.setdefault(key, value), value)
 
     def min_value(self, key: str, value: Any) -> None:
-        self._stats[key] = min(self._stats.setdefault(key, value), value)
+        with self._lock:
+            self._stats[key] = min(self._stats.setdefault(key, value), value)
+
+    def add_value(self, key: str, value: float) -> None:
+        """
+        记录一个观测值到直方图, get_stats 中返回 count/avg/p50/p95/p99/max
+        """
+        histograms = self._shard().histograms
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.add(value)
+
+    def record_response(self, response) -> None:
+        """
+        记录下载器返回的响应: 状态码、响应耗时, 以及按域名统计的请求数和流量
+        raw_size 为实际传输的(压缩后的)字节数, size 为解压后的字节数, 自定义 fetch 返回的响应没有这两个值
+        """
+        counters = self._shard().counters
+        key = f"response/status/{response.status_code}"
+        counters[key] = counters.get(key, 0) + 1
+        elapsed = response.elapsed
+        elapsed = elapsed.total_seconds() if hasattr(elapsed, "total_seconds") else elapsed
+        if elapsed:
+            self.add_value("response/latency", elapsed)
+        raw_size = getattr(response, "raw_size", None)
+        if raw_size is None:
+            return
+        size = response.size or 0
+        counters["bandwidth/raw_bytes"] = counters.get("bandwidth/raw_bytes", 0) + raw_size
+        counters["bandwidth/bytes"] = counters.get("bandwidth/bytes", 0) + size
+        domain = urlparse(response.url).hostname or ""
+        domains = self._shard().domains
+        values = domains.get(domain)
+        if values is None:
+            values = domains[domain] = [0, 0, 0]
+        values[0] += 1
+        values[1] += raw_size
+        values[2] += size
+
+    def dump_state(self) -> StatsT:
+        """
+        可以写入json的统计数据, load_state 恢复后计数、按域名的统计和直方图都会继续累加
+        """
+        with self._lock:
+            values = {key: value for key, value in self._stats.items()
+                      if isinstance(value, (str, int, float, bool)) or value is None}
+        return {
+            "values": values,
+            "counters": self._counters(),
+            "domains": self.get_domains(),
+            "histograms": {
+                key: {"buckets": histogram.buckets, "count": histogram.count, "sum": histogram.sum,
+                      "max": histogram.max}
+                for key, histogram in self.get_histograms().items()
+            },
+        }
+
+    def load_state(self, state: StatsT) -> None:
+        """
+        把 dump_state 保存的统计数据累加到当前线程的分片中
+        """
+        with self._lock:
+            self._stats.update(state.get("values") or {})
+        shard = self._shard()
+        for key, value in (state.get("counters") or {}).items():
+            shard.counters[key] = shard.counters.get(key, 0) + value
+        for domain, values in (state.get("domains") or {}).items():
+            total = shard.domains.setdefault(domain, [0, 0, 0])
+            for i, value in enumerate(values):
+                total[i] += value
+        for key, data in (state.get("histograms") or {}).items():
+            histogram = Histogram()
+            # json 中桶的下标为字符串
+            histogram.buckets = {int(index): count for index, count in data["buckets"].items()}
+            histogram.count, histogram.sum, histogram.max = data["count"], data["sum"], data["max"]
+            shard.histograms.setdefault(key, Histogram()).merge(histogram)
 
     def clear_stats(self) -> None:
-        self._stats.clear()
+        with self._lock:
+            self._stats.clear()
+            for shard in self._shards:
+                shard.counters.clear()
+                shard.histograms.clear()
+                shard.domains.clear()
 
     def _persist_stats(self, stats: StatsT, spider) -> None:
         pass
@@ -66,6 +323,10 @@ class StatsCollector:
     def on_spider_stopped(self, sender, **kwargs):
         # 处理爬虫停止信号
         self.set_value("time", time.time() - self._start_time)
+        raw_bytes = self.get_value("bandwidth/raw_bytes")
+        if raw_bytes:
+            # 解压后的字节数 / 实际传输的字节数
+            self.set_value("bandwidth/compression_ratio", round(self.get_value("bandwidth/bytes", 0) / raw_bytes, 2))
 
 
 @singleton
@@ -78,25 +339,173 @@ class MemoryStatsCollector(StatsCollector):
     def _persist_stats(self, stats: StatsT, spider) -> None:
         self.spider_stats[spider.name] = stats
 
-# class StatsCollectorFactory:
-#     @classmethod
-#     def create_stats_collector(cls, spider):
-#
-#         stats_collect = cls.load_filter(spider)
-#         if stats_collect is None:
-#             return StatsCollector(spider)
-#         else:
-#             return stats_collect(spider)
-#
-#     @classmethod
-#     def load_filter(cls, spider):
-#         mw_path = spider.custom_settings.get("stats_collector_class", "")
-#         if not mw_path:
-#             return
-#         try:
-#             module_path, class_name = mw_path.rsplit('.', 1)
-#             module = importlib.import_module(module_path)
-#             return getattr(module, class_name)
-#         except (ImportError, AttributeError) as e:
-#             spider.log.error(f"Failed to load stats_collector_class class {mw_path}: {e}")
-#             return None
+class RedisStatsCollector(StatsCollector):
+    """
+    多个节点共享同一个 redis 时汇总所有节点的统计数据
+    计数先在本地累加, 后台线程每隔 stats_flush_interval 秒把增量用一个 pipeline 批量 HINCRBY 到 redis,
+    不会每次计数都访问 redis, get_cluster_stats 返回所有节点汇总后的数据
+    custom_settings["stats_collector_class"] = "smallder.core.statscollectors.RedisStatsCollector"
+    custom_settings["stats_redis_key"] = ""  # 默认为 爬虫名:stats
+    custom_settings["stats_flush_interval"] = 5
+    custom_settings["stats_redis_expire"] = 0  # 大于0时每次写入后设置过期时间(秒)
+    """
+
+    def __init__(self, spider):
+        super().__init__(spider)
+        self.server = spider.server
+        if self.server is None:
+            raise ValueError("RedisStatsCollector requires custom_settings['redis']")
+        settings = spider.custom_settings
+        self.redis_key = settings.get("stats_redis_key") or f"{spider.name}:stats"
+        self.nodes_key = f"{self.redis_key}:nodes"
+        self.flush_interval = settings.get("stats_flush_interval", 5)
+        self.expire = settings.get("stats_redis_expire", 0)
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+        self._flushed = {}  # 已经写入 redis 的值, 下次只写入增量
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flush_thread = None
+
+    def _snapshot(self):
+        """
+        需要汇总的所有计数, 按域名的统计和直方图的桶也展开为计数
+        """
+        values = self._counters()
+        for domain, (requests, raw_bytes, size) in self.get_domains().items():
+            values[f"domains/{domain}/requests"] = requests
+            values[f"domains/{domain}/raw_bytes"] = raw_bytes
+            values[f"domains/{domain}/bytes"] = size
+        for key, histogram in self.get_histograms().items():
+            for index, count in histogram.buckets.items():
+                values[f"histogram/{key}/{index}"] = count
+            values[f"histogram/{key}/sum"] = histogram.sum
+        return values
+
+    def flush(self):
+        """
+        把上次写入之后的增量写入 redis, 写入失败时保留增量下次重试
+        """
+        with self._flush_lock:
+            values = self._snapshot()
+            deltas = {}
+            for key, value in values.items():
+                delta = value - self._flushed.get(key, 0)
+                if delta:
+                    deltas[key] = delta
+            pipe = self.server.pipeline(transaction=True)
+            for key, delta in deltas.items():
+                if isinstance(delta, float):
+                    pipe.hincrbyfloat(self.redis_key, key, delta)
+                else:
+                    pipe.hincrby(self.redis_key, key, delta)
+            pipe.hset(self.nodes_key, self.node, time.time())
+            if self.expire:
+                pipe.expire(self.redis_key, self.expire)
+                pipe.expire(self.nodes_key, self.expire)
+            pipe.execute()
+            self._flushed = values
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.spider.log.warning(f"统计数据写入 redis 失败: {e}")
+
+    def get_cluster_stats(self) -> StatsT:
+        """
+        所有节点汇总后的统计数据, 格式和 get_stats 相同, nodes 为最近 3 个写入周期内有写入的节点数
+        """
+        stats = {}
+        histograms = {}
+        domains = {}
+        for field, value in self.server.hgetall(self.redis_key).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            value = float(value)
+            if value.is_integer():
+                value = int(value)
+            if field.startswith("histogram/"):
+                key, _, name = field[len("histogram/"):].rpartition("/")
+                histogram = histograms.setdefault(key, Histogram())
+                if name == "sum":
+                    histogram.sum = value
+                else:
+                    histogram.buckets[int(name)] = value
+                    histogram.count += value
+            elif field.startswith("domains/"):
+                domain, _, name = field[len("domains/"):].rpartition("/")
+                domains.setdefault(domain, {})[name] = value
+            else:
+                stats[field] = value
+        for key, histogram in histograms.items():
+            if histogram.buckets:
+                histogram.max = Histogram.min_value * Histogram.growth ** max(histogram.buckets)
+            stats[key] = histogram.summary()
+        if domains:
+            stats["domains"] = domains
+        now = time.time()
+        stats["nodes"] = sum(
+            1 for value in self.server.hvals(self.nodes_key) if now - float(value) < self.flush_interval * 3
+        )
+        return stats
+
+    def load_state(self, state: StatsT) -> None:
+        super().load_state(state)
+        # 恢复的数据上次运行时已经写入过 redis
+        with self._flush_lock:
+            self._flushed = self._snapshot()
+
+    def on_spider_start(self, sender, **kwargs) -> None:
+        super().on_spider_start(sender, **kwargs)
+        self._stopped.clear()
+        self._flush_thread = threading.Thread(target=self._run, name="stats-flush", daemon=True)
+        self._flush_thread.start()
+
+    def on_spider_stopped(self, sender, **kwargs):
+        super().on_spider_stopped(sender, **kwargs)
+        self._stopped.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            self.spider.log.warning(f"统计数据写入 redis 失败: {e}")
+
+
+class StatsCollectorFactory:
+    """
+    根据 stats_collector_class 创建统计收集器, 默认为 MemoryStatsCollector
+    custom_settings["stats_collector_class"] = "smallder.core.statscollectors.RedisStatsCollector"
+    """
+
+    @classmethod
+    def create_stats_collector(cls, spider):
+        stats_collect = cls.load_stats_collector(spider)
+        if stats_collect is None:
+            return MemoryStatsCollector(spider)
+        else:
+            return stats_collect(spider)
+
+    @classmethod
+    def load_stats_collector(cls, spider):
+        mw_path = spider.custom_settings.get("stats_collector_class", "")
+        if not mw_path:
+            return
+        try:
+            module_path, class_name = mw_path.rsplit('.', 1)
+            module = importlib.import_module(module_path)
+            return getattr(module, class_name)
+        except (ImportError, AttributeError) as e:
+            spider.log.error(f"Failed to load stats_collector_class class {mw_path}: {e}")
+            return None
+
+
+def get_stats_collector(spider):
+    """
+    返回爬虫使用的统计收集器, 没有经过引擎创建的爬虫(例如单独使用 pipeline 时)使用 MemoryStatsCollector
+    """
+    stats = getattr(spider, "stats", None)
+    if stats is None:
+        stats = MemoryStatsCollector(spider)
+    return stats
@@ -0,0 +1,202 @@
+import socket
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from smallder import Request
+
+
+@lru_cache(maxsize=10000)
+def resolve_host(host):
+    """
+    解析域名对应的ip,解析失败时返回域名本身,结果会被缓存,调用时不要持有 DomainThrottle.lock
+    """
+    try:
+        return socket.gethostbyname(host)
+    except (OSError, UnicodeError):
+        return host
+
+
+class Slot:
+    """
+    同一个域名/ip/代理共享的下载槽,记录正在下载的请求数、下载间隔和等待中的请求
+    """
+
+    def __init__(self, concurrency, delay):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.active = 0
+        self.last_start = 0.0
+        self.pending = deque()
+
+    def ready_in(self, now):
+        """
+        距离可以发起下一个请求还需要等待的秒数,并发已满时返回 inf
+        """
+        if self.concurrency and self.active >= self.concurrency:
+            return float("inf")
+        return max(0.0, self.last_start + self.delay - now)
+
+
+class DomainThrottle:
+    """
+    按域名(或ip、代理)限制并发数和下载间隔,被限制的请求暂存在对应的 Slot 中,到时间后由引擎取出执行
+    "domain_concurrency": 0,  # 单个域名同时下载的最大请求数,0为不限制
+    "download_delay": 0,  # 同一个域名两次请求之间的最小间隔(秒)
+    "throttle_key": "domain",  # 限流的维度 domain/ip/proxy
+    "throttle_max_deferred": 10000,  # 最多暂存多少个被限流的请求,达到后暂停从调度器取任务
+    "autothrottle": False,  # 根据响应耗时自动调整每个域名的下载间隔
+    "autothrottle_start_delay": 1,  # 自动限流的初始下载间隔
+    "autothrottle_max_delay": 60,  # 自动限流的最大下载间隔
+    "autothrottle_target_concurrency": 1.0,  # 每个域名期望的平均并发请求数
+    """
+    key_types = ("domain", "ip", "proxy")
+    gc_interval = 60  # 空闲超过这个时间的 Slot 会被清理
+
+    def __init__(self, spider):
+        settings = getattr(spider, "custom_settings", None) or {}
+        self.concurrency = settings.get("domain_concurrency", 0)
+        self.delay = settings.get("download_delay", 0)
+        self.key_type = settings.get("throttle_key", "domain")
+        if self.key_type not in self.key_types:
+            raise ValueError(f"throttle_key must be one of {self.key_types}, got {self.key_type!r}")
+        self.max_deferred = settings.get("throttle_max_deferred", 10000)
+        self.autothrottle = settings.get("autothrottle", False)
+        self.start_delay = max(settings.get("autothrottle_start_delay", 1), self.delay)
+        self.max_delay = settings.get("autothrottle_max_delay", 60)
+        self.target_concurrency = settings.get("autothrottle_target_concurrency", 1.0)
+        self.enabled = bool(self.concurrency or self.delay or self.autothrottle)
+        self.slots = {}
+        self.waiting = set()  # 有请求在等待的 Slot
+        self.active_keys = {}  # 正在下载的请求对应的 Slot,中间件可能会修改请求的url或代理
+        self.deferred = 0
+        self.next_check = 0.0  # 下一次有等待中的请求可以执行的时间
+        self.last_gc = time.time()
+        self.lock = threading.Lock()
+
+    def slot_key(self, request: Request):
+        host = urlparse(request.url).hostname or ""
+        if self.key_type == "ip":
+            return resolve_host(host)
+        if self.key_type == "proxy" and request.proxies:
+            scheme = urlparse(request.url).scheme
+            return request.proxies.get(scheme) or request.proxies.get("http") or host
+        return host
+
+    def _get_slot(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = Slot(self.concurrency, self.start_delay if self.autothrottle else self.delay)
+            self.slots[key] = slot
+        return slot
+
+    def _start(self, request, key, slot, now):
+        slot.active += 1
+        slot.last_start = now
+        self.active_keys[id(request)] = key
+
+    def acquire(self, request: Request):
+        """
+        请求可以立即下载时占用一个名额并返回True,否则返回False
+        """
+        # ip 模式下解析域名可能很慢, 在加锁之前计算, 不会阻塞其他线程释放名额
+        key = self.slot_key(request)
+        now = time.time()
+        with self.lock:
+            if now - self.last_gc > self.gc_interval:
+                self._gc(now)
+            slot = self._get_slot(key)
+            # 已经有请求在等待时新请求排在后面,保证同一个域名先进先出
+            if slot.pending or slot.ready_in(now) > 0:
+                return False
+            self._start(request, key, slot, now)
+            return True
+
+    def defer(self, request: Request):
+        """
+        暂存被限流的请求
+        """
+        key = self.slot_key(request)
+        now = time.time()
+        with self.lock:
+            slot = self._get_slot(key)
+            slot.pending.append(request)
+            self.waiting.add(key)
+            self.deferred += 1
+            self.next_check = min(self.next_check, now + slot.ready_in(now))
+
+    def pop_ready(self):
+        """
+        返回一个已经可以下载的暂存请求,没有时返回None
+        """
+        now = time.time()
+        if not self.deferred or now < self.next_check:
+            return None
+        with self.lock:
+            next_check = float("inf")
+            for key in list(self.waiting):
+                slot = self.slots[key]
+                ready_in = slot.ready_in(now)
+                if ready_in > 0:
+                    next_check = min(next_check, now + ready_in)
+                    continue
+                request = slot.pending.popleft()
+                if not slot.pending:
+                    self.waiting.discard(key)
+                self.deferred -= 1
+                self._start(request, key, slot, now)
+                # 其他 Slot 可能也已经就绪,下次调用时重新检查
+                self.next_check = now
+                return request
+            self.next_check = next_check
+            return None
+
+    def release(self, request: Request, response=None):
+        """
+        请求下载结束后释放名额,开启自动限流时根据响应耗时调整下载间隔
+        """
+        with self.lock:
+            key = self.active_keys.pop(id(request), None)
+            slot = self.slots.get(key)
+            if slot is None:
+                return
+            slot.active -= 1
+            if self.autothrottle and response is not None:
+                self._adjust_delay(slot, response)
+            if slot.pending:
+                self.next_check = min(self.next_check, time.time() + slot.ready_in(time.time()))
+
+    def _adjust_delay(self, slot, response):
+        """
+        和 scrapy 的 AutoThrottle 算法一致: 目标间隔为 响应耗时 / 期望并发数,
+        新的间隔取当前间隔和目标间隔的平均值,并且不小于目标间隔,非200的响应不会减小间隔
+        """
+        elapsed = getattr(response, "elapsed", None)
+        if elapsed is None:
+            return
+        latency = elapsed.total_seconds() if hasattr(elapsed, "total_seconds") else float(elapsed)
+        target_delay = latency / self.target_concurrency
+        new_delay = max(target_delay, (slot.delay + target_delay) / 2.0)
+        new_delay = min(max(self.delay, new_delay), self.max_delay)
+        if response.status_code != 200 and new_delay <= slot.delay:
+            return
+        slot.delay = new_delay
+
+    def _gc(self, now):
+        for key, slot in list(self.slots.items()):
+            if not slot.active and not slot.pending and now - slot.last_start > self.gc_interval:
+                del self.slots[key]
+        self.last_gc = now
+
+    def full(self):
+        return self.deferred >= self.max_deferred
+
+    def wait_time(self):
+        """
+        距离下一个暂存请求可以执行还需要等待的秒数
+        """
+        if not self.deferred:
+            return float("inf")
+        return max(0.0, self.next_check - time.time())
@@ -0,0 +1,9 @@
+from smallder.pipelines.exporters import JsonLinesExporter, CsvExporter, ParquetExporter
+from smallder.pipelines.mysql import MySQLBulkPipeline
+
+__all__ = [
+    "MySQLBulkPipeline",
+    "JsonLinesExporter",
+    "CsvExporter",
+    "ParquetExporter",
+]
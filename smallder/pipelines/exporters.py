@@ -0,0 +1,268 @@
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+import time
+
+from smallder.core.statscollectors import get_stats_collector
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires zstandard, please run: pip install zstandard")
+    return zstandard
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("ParquetExporter requires pyarrow, please run: pip install pyarrow")
+    return pyarrow
+
+
+class FileExporter:
+    """
+    文件导出 pipeline 的基类, 在 pipeline 线程中按批写入文件, 不会阻塞下载
+    文件先以 .part 后缀写入, 写完(轮转或爬虫结束)后去掉后缀, 文件名为 爬虫名-时间-序号.扩展名
+    "export_dir": "output",  # 导出目录
+    "export_rotate_size": 0,  # 文件达到多少字节后新建文件, 0为不轮转
+    "export_rotate_interval": 0,  # 文件打开多少秒后新建文件, 0为不轮转
+    "export_buffer_size": 1024 * 1024,  # 写入缓冲区大小
+    "export_compression": None,  # jsonl/csv 的压缩方式 gzip/zstd
+    "export_fields": None,  # csv/parquet 的字段, 默认使用第一条 item 的字段
+    """
+    extension = ""
+    compressions = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, spider):
+        settings = spider.custom_settings
+        self.spider = spider
+        self.directory = settings.get("export_dir", "output")
+        self.rotate_size = settings.get("export_rotate_size", 0)
+        self.rotate_interval = settings.get("export_rotate_interval", 0)
+        self.buffer_size = settings.get("export_buffer_size", 1024 * 1024)
+        self.compression = settings.get("export_compression")
+        if self.compression not in self.compressions:
+            raise ValueError(f"export_compression must be one of {list(self.compressions)}, got {self.compression!r}")
+        self.fields = settings.get("export_fields")
+        self.lock = threading.Lock()
+        self.file_count = 0
+        self.files = []  # 已经写完的文件
+        self.path = None
+        self.raw = None
+        self.opened_at = 0.0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def file_path(self):
+        self.file_count += 1
+        name = f"{self.spider.name}-{time.strftime('%Y%m%d%H%M%S')}-{self.file_count:05d}"
+        return os.path.join(self.directory, name + self.extension + self.compressions[self.compression])
+
+    def open_stream(self):
+        """
+        打开新的文件, 返回写入压缩数据的二进制流
+        """
+        self.path = self.file_path()
+        self.raw = open(self.path + ".part", "wb", buffering=self.buffer_size)
+        self.opened_at = time.time()
+        if self.compression == "gzip":
+            return gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=6)
+        if self.compression == "zstd":
+            return _import_zstandard().ZstdCompressor().stream_writer(self.raw, closefd=False)
+        return self.raw
+
+    def process_items(self, items):
+        if not items:
+            return
+        with self.lock:
+            if self.raw is not None and self.expired():
+                self.finish()
+            if self.raw is None:
+                self.open_file()
+            self.write_items(items)
+            if self.expired() or (self.rotate_size and self.raw.tell() >= self.rotate_size):
+                self.finish()
+
+    def expired(self):
+        return bool(self.rotate_interval and time.time() - self.opened_at >= self.rotate_interval)
+
+    def finish(self):
+        """
+        关闭当前文件并去掉 .part 后缀, close_file 返回 False 时文件中没有数据, 直接删除
+        """
+        written = self.close_file() is not False
+        if not self.raw.closed:
+            self.raw.close()
+        self.raw = None
+        if not written:
+            os.remove(self.path + ".part")
+            self.spider.log.warning(f"导出文件 {self.path} 没有写入数据, 已删除")
+            return
+        os.replace(self.path + ".part", self.path)
+        self.files.append(self.path)
+        self.spider.log.info(f"导出文件 {self.path} 写入完成")
+
+    def close(self):
+        with self.lock:
+            if self.raw is not None:
+                self.finish()
+
+    def open_file(self):
+        raise NotImplementedError
+
+    def write_items(self, items):
+        raise NotImplementedError
+
+    def close_file(self):
+        raise NotImplementedError
+
+
+class JsonLinesExporter(FileExporter):
+    """
+    每行一条json, 一批 item 合并后一次写入
+    """
+    extension = ".jsonl"
+
+    def open_file(self):
+        self.stream = self.open_stream()
+
+    def write_items(self, items):
+        self.stream.write("".join(
+            json.dumps(item, ensure_ascii=False, default=str) + "\n" for item in items
+        ).encode("utf-8"))
+
+    def close_file(self):
+        self.stream.close()
+
+
+class CsvExporter(FileExporter):
+    """
+    每个文件都会写入表头, 不在 export_fields 中的字段会被忽略, dict/list 保存为json字符串
+    """
+    extension = ".csv"
+
+    def open_file(self):
+        self.stream = io.TextIOWrapper(self.open_stream(), encoding="utf-8", newline="")
+        self.writer = None
+
+    def write_items(self, items):
+        if self.writer is None:
+            if self.fields is None:
+                self.fields = list(items[0].keys())
+            self.writer = csv.DictWriter(self.stream, fieldnames=self.fields, extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerows(
+            {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+             for key, value in item.items()}
+            for item in items
+        )
+
+    def close_file(self):
+        self.stream.close()
+
+
+class ParquetExporter(FileExporter):
+    """
+    列式存储, 字段类型由第一批 item 推断(或者使用 export_fields 中的字段), 第一批中全为 null 的字段使用 string 类型,
+    之后的 item 类型不一致时转为字符串写入 string 类型的字段, 仍然无法写入的 row group 保存到 .rejected.jsonl
+    item 先缓存到 export_row_group_size 条后作为一个 row group 写入, 内存中最多保留一个 row group
+    "export_parquet_compression": "snappy",  # parquet 的压缩方式 snappy/gzip/zstd/none
+    "export_row_group_size": 10000,
+    """
+    extension = ".parquet"
+
+    def __init__(self, spider):
+        self.pyarrow = _import_pyarrow()
+        settings = spider.custom_settings
+        self.parquet_compression = settings.get("export_parquet_compression", "snappy")
+        self.row_group_size = settings.get("export_row_group_size", 10000)
+        self.schema = None
+        self.stats = get_stats_collector(spider)
+        super().__init__(spider)
+        # parquet 自带压缩, 不再对整个文件压缩
+        self.compression = None
+
+    def open_file(self):
+        self.stream = self.open_stream()
+        self.writer = None
+        self.rows = []
+
+    def write_items(self, items):
+        self.rows.extend(items)
+        if len(self.rows) >= self.row_group_size:
+            self.write_row_group()
+
+    def infer_schema(self, rows):
+        pa = self.pyarrow
+        fields = self.fields or list(dict.fromkeys(key for row in rows for key in row))
+        schema = []
+        for name in fields:
+            try:
+                column_type = pa.array([row.get(name) for row in rows]).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                column_type = pa.null()
+            if pa.types.is_null(column_type):
+                # 没有值或者类型混杂的字段无法确定类型, 统一保存为字符串
+                column_type = pa.string()
+            schema.append(pa.field(name, column_type))
+        return pa.schema(schema)
+
+    def to_string_rows(self, rows):
+        """
+        把 string 类型字段中的其他类型的值转为字符串
+        """
+        names = [field.name for field in self.schema if self.pyarrow.types.is_string(field.type)]
+        return [
+            {**row, **{
+                name: json.dumps(row[name], ensure_ascii=False, default=str)
+                if isinstance(row[name], (dict, list)) else str(row[name])
+                for name in names if row.get(name) is not None and not isinstance(row[name], str)
+            }}
+            for row in rows
+        ]
+
+    def write_row_group(self):
+        rows, self.rows = self.rows, []
+        if not rows:
+            return
+        if self.schema is None:
+            self.schema = self.infer_schema(rows)
+        # 缺少的字段为 null, 多出的字段被忽略
+        try:
+            try:
+                table = self.pyarrow.Table.from_pylist(rows, schema=self.schema)
+            except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError):
+                table = self.pyarrow.Table.from_pylist(self.to_string_rows(rows), schema=self.schema)
+        except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError) as e:
+            self.reject(rows, e)
+            return
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(
+                self.stream, self.schema, compression=self.parquet_compression
+            )
+        self.writer.write_table(table)
+
+    def reject(self, rows, error):
+        """
+        和 schema 不匹配的 row group 追加写入 导出文件名.rejected.jsonl, 不影响之后的 item
+        """
+        path = self.path + ".rejected.jsonl"
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows))
+        self.stats.inc_value("export/rejected_items", len(rows))
+        self.spider.log.error(f"{len(rows)} 条 item 和 parquet schema 不匹配, 已写入 {path}: {error}")
+
+    def close_file(self):
+        self.write_row_group()
+        if self.writer is None:
+            # 所有 row group 都被拒绝, 空文件不是有效的 parquet
+            self.stream.close()
+            return False
+        self.writer.close()
+        self.stream.close()
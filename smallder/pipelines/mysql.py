@@ -0,0 +1,135 @@
+import json
+import time
+
+from smallder.core.statscollectors import get_stats_collector
+
+
+def quote_name(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+def to_db_value(value):
+    """
+    dict/list 保存为json字符串,其他类型交给驱动处理
+    """
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def value_size(value):
+    """
+    估算参数在sql语句中占用的字节数
+    """
+    if value is None:
+        return 4
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 2
+    if isinstance(value, (bytes, bytearray)):
+        return len(value) * 2 + 3
+    return len(str(value))
+
+
+def group_rows(items):
+    """
+    按字段分组,字段完全相同的 item 才能放到同一条 INSERT 语句中,字段顺序以第一次出现的为准
+    """
+    groups = {}
+    for item in items:
+        columns = tuple(item.keys())
+        key = frozenset(columns)
+        if key not in groups:
+            groups[key] = (columns, [])
+        groups[key][1].append(tuple(to_db_value(item[column]) for column in groups[key][0]))
+    return list(groups.values())
+
+
+def build_insert(table, columns, rows, update_columns=None):
+    """
+    生成多行 INSERT 语句和参数
+    update_columns 为 None 时主键/唯一键冲突会更新所有字段, 为空列表时使用 INSERT IGNORE
+    """
+    names = ", ".join(quote_name(column) for column in columns)
+    placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    ignore = " IGNORE" if update_columns is not None and not update_columns else ""
+    sql = f"INSERT{ignore} INTO {quote_name(table)} ({names}) VALUES " + ", ".join([placeholder] * len(rows))
+    if update_columns is None:
+        update_columns = columns
+    if update_columns:
+        sql += " ON DUPLICATE KEY UPDATE " + ", ".join(
+            f"{quote_name(column)} = VALUES({quote_name(column)})" for column in update_columns
+        )
+    params = [value for row in rows for value in row]
+    return sql, params
+
+
+def chunk_rows(rows, max_bytes):
+    """
+    按语句大小切分,保证每条语句不超过 max_allowed_packet
+    """
+    chunk = []
+    size = 0
+    for row in rows:
+        row_size = sum(value_size(value) + 2 for value in row) + 4
+        if chunk and size + row_size > max_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+class MySQLBulkPipeline:
+    """
+    使用 spider.mysql_server 批量写入 MySQL, 一批 item 合并成多行 INSERT ... ON DUPLICATE KEY UPDATE 语句
+    配合 pipline_mode = "list" 使用, 在 custom_settings["pipeline_settings"] 中注册后自动处理所有 item
+    "mysql_table": "",  # 写入的表名, 默认为爬虫名
+    "mysql_update_columns": None,  # 冲突时更新的字段, None 为全部字段, [] 为 INSERT IGNORE
+    "mysql_max_packet": 4 * 1024 * 1024,  # 单条语句的最大字节数, 不要超过 MySQL 的 max_allowed_packet
+    "mysql_max_retry": 3,  # 死锁或者锁等待超时时的重试次数
+    """
+    retry_error_codes = (1205, 1213)  # 锁等待超时, 死锁
+
+    def __init__(self, spider, table=None, update_columns=None, max_packet=None, max_retry=None):
+        settings = spider.custom_settings
+        self.spider = spider
+        self.engine = spider.mysql_server
+        if self.engine is None:
+            raise ValueError("MySQLBulkPipeline requires custom_settings['mysql']")
+        self.table = table or settings.get("mysql_table") or spider.name
+        self.update_columns = update_columns if update_columns is not None \
+            else settings.get("mysql_update_columns")
+        self.max_packet = max_packet or settings.get("mysql_max_packet", 4 * 1024 * 1024)
+        self.max_retry = max_retry if max_retry is not None else settings.get("mysql_max_retry", 3)
+        self.stats = get_stats_collector(spider)
+
+    def process_items(self, items):
+        for columns, rows in group_rows(items):
+            for chunk in chunk_rows(rows, self.max_packet):
+                self.execute(*build_insert(self.table, columns, chunk, self.update_columns))
+                self.stats.inc_value("mysql/rows", len(chunk))
+                self.stats.inc_value("mysql/statements")
+
+    def execute(self, sql, params):
+        """
+        每条语句单独提交, 遇到死锁时回滚后重试当前语句
+        """
+        for attempt in range(self.max_retry + 1):
+            connection = self.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute(sql, params)
+                connection.commit()
+                return
+            except Exception as e:
+                connection.rollback()
+                code = e.args[0] if e.args else None
+                if code not in self.retry_error_codes or attempt >= self.max_retry:
+                    raise
+                self.stats.inc_value("mysql/retries")
+                self.spider.log.warning(f"MySQL 写入 {self.table} 出现死锁, 第 {attempt + 1} 次重试: {e}")
+                time.sleep(0.1 * 2 ** attempt)
+            finally:
+                connection.close()
@@ -0,0 +1,110 @@
+import math
+import threading
+
+
+def bloom_size(capacity, error_rate):
+    """
+    根据容量和误判率计算需要的位数和哈希函数个数
+    """
+    if capacity <= 0:
+        raise ValueError("capacity must be greater than 0")
+    if not 0 < error_rate < 1:
+        raise ValueError("error_rate must be between 0 and 1")
+    num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+    return num_bits, num_hashes
+
+
+def bloom_offsets(fp: bytes, num_bits, num_hashes):
+    """
+    使用双重哈希从请求指纹中得到 num_hashes 个位置,指纹本身已经是均匀分布的哈希值,不需要再次哈希
+    """
+    h1 = int.from_bytes(fp[:8], "big")
+    h2 = int.from_bytes(fp[8:16], "big") | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+class BloomFilter:
+    """
+    固定容量的布隆过滤器,位数组保存在 bytearray 中,每条指纹只占用约 -ln(error_rate)/ln(2)^2 位
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits, self.num_hashes = bloom_size(capacity, error_rate)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, fp: bytes):
+        bits = self.bits
+        for offset in bloom_offsets(fp, self.num_bits, self.num_hashes):
+            if not bits[offset >> 3] & (1 << (offset & 7)):
+                return False
+        return True
+
+    def add(self, fp: bytes):
+        """
+        添加指纹,如果指纹已经存在返回True
+        """
+        bits = self.bits
+        exists = True
+        for offset in bloom_offsets(fp, self.num_bits, self.num_hashes):
+            mask = 1 << (offset & 7)
+            if not bits[offset >> 3] & mask:
+                bits[offset >> 3] |= mask
+                exists = False
+        if not exists:
+            self.count += 1
+        return exists
+
+    def __len__(self):
+        return self.count
+
+
+class ScalableBloomFilter:
+    """
+    可扩容的布隆过滤器,当前过滤器写满后新建一个容量翻倍的过滤器,
+    每一级的误判率按 ratio 递减,保证总体误判率不超过 error_rate
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001, growth=2, ratio=0.9):
+        self.initial_capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.ratio = ratio
+        self.filters = []
+        self.lock = threading.Lock()
+        self._grow()
+
+    def _grow(self):
+        index = len(self.filters)
+        capacity = self.initial_capacity * (self.growth ** index)
+        error_rate = self.error_rate * (1 - self.ratio) * (self.ratio ** index)
+        self.filters.append(BloomFilter(capacity, error_rate))
+
+    def __contains__(self, fp: bytes):
+        return any(fp in _filter for _filter in reversed(self.filters))
+
+    def add(self, fp: bytes):
+        """
+        添加指纹,如果指纹已经存在返回True
+        """
+        with self.lock:
+            for _filter in self.filters[:-1]:
+                if fp in _filter:
+                    return True
+            current = self.filters[-1]
+            if current.count < current.capacity:
+                return current.add(fp)
+            if fp in current:
+                return True
+            self._grow()
+            return self.filters[-1].add(fp)
+
+    def __len__(self):
+        return sum(len(_filter) for _filter in self.filters)
+
+    @property
+    def num_bits(self):
+        return sum(_filter.num_bits for _filter in self.filters)
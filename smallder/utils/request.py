@@ -1,12 +1,14 @@
 import functools
 import hashlib
 import json
+import re
 import time
+import types
 from typing import Iterable, Optional, Tuple, Union
-from weakref import WeakKeyDictionary
 from w3lib.url import canonicalize_url
 
 from smallder import Request
+from smallder.core.request import method_registry
 
 
 def to_unicode(
@@ -42,41 +44,81 @@ def to_bytes(
     return text.encode(encoding, errors)
 
 
-_fingerprint_cache = WeakKeyDictionary()
+# 只包含这些字符的查询参数不需要解码和重新编码,排序后就是规范化的结果
+_simple_query = re.compile(r"[A-Za-z0-9._~=&-]*")
 
 
+@functools.lru_cache(maxsize=4096)
+def _canonicalize_base(url: str) -> str:
+    return canonicalize_url(url)
 
 
-def process_data(data):
-    if isinstance(data, dict):
-        return json.dumps(data, sort_keys=True)
-    return data or ""
+@functools.lru_cache(maxsize=4096)
+def _canonicalize_query(query: str) -> str:
+    return canonicalize_url("http://a/?" + query)[len("http://a/"):]
 
-def fingerprint(request, *, include_headers=None, keep_fragments=True):
-    processed_include_headers = tuple(
-        to_bytes(h.lower()) for h in sorted(include_headers)
-    ) if include_headers else None
 
-    cache = _fingerprint_cache.setdefault(request, {})
-    cache_key = (processed_include_headers, keep_fragments)
-
-    if cache_key not in cache:
-        data = process_data(request.data)
-        _json = process_data(request.json)
-        params = process_data(request.params)
-
-        fingerprint_data = {
-            "method": to_unicode(request.method),
-            "url": canonicalize_url(request.url, keep_fragments=keep_fragments),
-            "body": data.encode('utf-8').hex(),
-            "json": _json.encode('utf-8').hex(),
-            "params": params.encode('utf-8').hex(),
-        }
-
-        fingerprint_json = json.dumps(fingerprint_data, sort_keys=True)
-        cache[cache_key] = hashlib.sha1(fingerprint_json.encode()).digest()
-
-    return cache[cache_key]
+def canonicalize(url: str, keep_fragments: bool = True) -> str:
+    """
+    和 w3lib.url.canonicalize_url 结果一致的规范化方法,
+    分别缓存 scheme://host/path 和查询参数的规范化结果,同一站点的url只需要处理一次前缀
+    """
+    if not url.startswith(("http://", "https://")) or "#" in url:
+        return canonicalize_url(url, keep_fragments=keep_fragments)
+    base, sep, query = url.partition("?")
+    if not sep:
+        return _canonicalize_base(url)
+    # w3lib 会去掉整个url末尾的空白, 带上 ? 后 path 末尾的空白和完整url一样会被编码而不是去掉,
+    # 空的查询参数在规范化时会被去掉, 结果中不会有 ?
+    base = _canonicalize_base(base + "?")
+    if _simple_query.fullmatch(query):
+        pairs = []
+        for field in query.split("&"):
+            if not field:
+                continue
+            key, _, value = field.partition("=")
+            if "=" in value:
+                return base + _canonicalize_query(query)
+            pairs.append((key, value))
+        if not pairs:
+            return base
+        pairs.sort()
+        return base + "?" + "&".join(f"{key}={value}" for key, value in pairs)
+    return base + _canonicalize_query(query)
+
+
+def _fingerprint_bytes(data) -> bytes:
+    if data is None:
+        return b""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return json.dumps(data, sort_keys=True).encode("utf-8")
+
+
+def fingerprint(request, *, include_headers=None, keep_fragments=True) -> bytes:
+    """
+    计算请求指纹, 返回16字节的 blake2b 摘要
+    method、规范化后的url、data、json、params 依次带长度前缀写入哈希, include_headers 中的请求头也会参与计算
+    """
+    fp = hashlib.blake2b(digest_size=16)
+    parts = [
+        to_bytes(request.method),
+        to_bytes(canonicalize(request.url, keep_fragments=keep_fragments)),
+        _fingerprint_bytes(request.data),
+        _fingerprint_bytes(request.json),
+        _fingerprint_bytes(request.params),
+    ]
+    if include_headers:
+        headers = {to_bytes(key.lower()): value for key, value in (request.headers or {}).items()}
+        for name in sorted(to_bytes(h.lower()) for h in include_headers):
+            parts.append(name)
+            parts.append(_fingerprint_bytes(headers.get(name)))
+    for part in parts:
+        fp.update(len(part).to_bytes(4, "big"))
+        fp.update(part)
+    return fp.digest()
 
 
 def retry(retry_count=3, delay=1, allowed_exceptions=(Exception,)):
@@ -125,6 +167,10 @@ def request_from_dict(d: dict, spider):
 def _get_method(obj, name):
     """Helper function for request_from_dict"""
     name = str(name)
+    func = method_registry(type(obj)).functions.get(name)
+    # 方法表只在第一次使用时反射, 实例属性或者运行时替换的类方法都要回退到 getattr
+    if func is not None and name not in getattr(obj, "__dict__", ()) and getattr(type(obj), name, None) is func:
+        return types.MethodType(func, obj)
     try:
         return getattr(obj, name)
     except AttributeError:
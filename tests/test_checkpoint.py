@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from smallder import Spider, Request, Response
+from smallder.core.checkpoint import Checkpoint
+from smallder.core.dupfilter import Filter, MemoryFilter
+from smallder.core.scheduler import MemoryScheduler
+from smallder.core.statscollectors import StatsCollector
+
+
+class CheckpointSpider(Spider):
+    name = "checkpoint_test"
+    fastapi = False
+    thread_count = 4
+    parsed = []
+
+    def start_requests(self):
+        yield Request(url="https://checkpoint.example.com/list", fetch=self.fetch)
+
+    def fetch(self, request):
+        return Response(content=request.url.encode(), status_code=200, request=request)
+
+    def parse(self, response):
+        for i in range(5):
+            yield Request(url=f"https://checkpoint.example.com/{i}", fetch=self.fetch, callback=self.detail)
+
+    def detail(self, response):
+        self.parsed.append(response.url)
+
+
+def open_checkpoint(jobdir, resume=False):
+    spider = CheckpointSpider()
+    spider.custom_settings = {"jobdir": str(jobdir)}
+    scheduler = MemoryScheduler(spider, MemoryFilter())
+    stats = StatsCollector(spider)
+    checkpoint = Checkpoint(spider, scheduler, stats)
+    checkpoint.open(resume=resume)
+    return spider, scheduler, stats, checkpoint
+
+
+def test_resume_frontier(tmp_path):
+    """测试快照中保存队列中的和正在下载的请求, 已经完成的请求恢复后被去重"""
+    spider, scheduler, stats, checkpoint = open_checkpoint(tmp_path)
+    for name in ("done", "inflight", "queued"):
+        scheduler.add_job(Request(url=f"https://checkpoint.example.com/{name}", callback=spider.detail))
+    done = scheduler.next_job()
+    checkpoint.done(done)
+    scheduler.next_job()  # 正在下载
+    stats.inc_value("response", 2)
+    checkpoint.save()
+    checkpoint.save()  # 没有变化时不会重复写入
+    assert checkpoint.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] == 2
+    with open(checkpoint.fingerprints_path, "ab") as f:
+        f.write(b"x" * 20)  # 没有提交的指纹
+
+    spider, scheduler, stats, checkpoint = open_checkpoint(tmp_path, resume=True)
+    assert os.path.getsize(checkpoint.fingerprints_path) == 32
+    assert stats.get_value("response") == 2
+    scheduler.add_job(Request(url="https://checkpoint.example.com/done"))
+    urls = []
+    while not scheduler.empty():
+        job = scheduler.next_job()
+        if job is not None:
+            urls.append(job.url)
+            assert job.callback == spider.detail
+    assert sorted(urls) == ["https://checkpoint.example.com/inflight", "https://checkpoint.example.com/queued"]
+
+
+def test_spider_resume(tmp_path):
+    """测试正常结束后 resume 不会重新抓取, 不使用 resume 时清空快照重新抓取"""
+    CheckpointSpider.custom_settings = {"jobdir": str(tmp_path)}
+    try:
+        CheckpointSpider.start()
+        assert len(CheckpointSpider.parsed) == 5
+        CheckpointSpider.start(resume=True)
+        assert len(CheckpointSpider.parsed) == 5
+        CheckpointSpider.start()
+        assert len(CheckpointSpider.parsed) == 10
+    finally:
+        CheckpointSpider.custom_settings = {}
+
+
+def test_resume_requires_jobdir():
+    with pytest.raises(ValueError):
+        CheckpointSpider.start(resume=True)
+
+
+class PlainFilter(Filter):
+    def __init__(self):
+        self.fingerprints = set()
+
+    def request_seen(self, request):
+        if request.url in self.fingerprints:
+            return True
+        self.fingerprints.add(request.url)
+        return False
+
+
+def test_filter_without_journal(tmp_path):
+    """测试不支持保存指纹的过滤器也可以保存和恢复请求"""
+    spider = CheckpointSpider()
+    spider.custom_settings = {"jobdir": str(tmp_path)}
+    scheduler = MemoryScheduler(spider, PlainFilter())
+    checkpoint = Checkpoint(spider, scheduler, StatsCollector(spider))
+    checkpoint.open()
+    scheduler.add_job(Request(url="https://checkpoint.example.com/plain", callback=spider.detail))
+    checkpoint.close()
+
+    scheduler = MemoryScheduler(spider, PlainFilter())
+    checkpoint = Checkpoint(spider, scheduler, StatsCollector(spider))
+    checkpoint.open(resume=True)
+    assert scheduler.next_job().url == "https://checkpoint.example.com/plain"
+    checkpoint.close()
+
+
+def test_request_kept_until_items_written(tmp_path):
+    """测试回调产生的 item 写入之前请求保留在快照中"""
+    from smallder.core.pipeline import PipelineManager
+
+    spider, scheduler, stats, checkpoint = open_checkpoint(tmp_path)
+    spider.pipline = lambda item: None
+    pipeline = PipelineManager(spider)
+    pipeline.checkpoint = checkpoint
+    request = Request(url="https://checkpoint.example.com/items", callback=spider.detail)
+    scheduler.add_job(request)
+    assert scheduler.next_job() is request
+    for i in range(2):
+        pipeline.put({"id": i}, request)  # 回调产生两条 item 后执行完
+    checkpoint.done(request)
+    checkpoint.save()
+    assert checkpoint.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] == 1
+    pipeline.open()
+    pipeline.close()
+    checkpoint.save()
+    assert checkpoint.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] == 0
+    assert pipeline.sources == {} and checkpoint.pending_items == {}
+    checkpoint.close()
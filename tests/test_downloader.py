@@ -123,3 +123,240 @@ def downloader():
 
 
 
+
+
+def test_session_is_shared(downloader):
+    """测试所有请求复用同一个session"""
+    assert downloader.get_session() is Downloader.get_session()
+
+
+def test_session_pool_settings():
+    """测试连接池参数从 custom_settings 读取"""
+
+    class Spider:
+        thread_count = 4
+        custom_settings = {"max_connections_per_host": 2, "keep_alive": False}
+
+    Downloader(spider=Spider())
+    adapter = Downloader.get_session().get_adapter("https://example.com")
+    assert adapter._pool_maxsize == 2
+    assert adapter._pool_block is True
+    assert Downloader.get_session().headers["Connection"] == "close"
+    Downloader.setup_session()
+
+
+def test_request_headers_template():
+    """测试 headers 合并在模板之上, 不发送 Connection: close, 且不修改原始headers"""
+
+    class Spider:
+        custom_settings = {"header_templates": {"desktop": {"User-Agent": "desktop", "Accept": "text/html"}}}
+
+    Downloader(spider=Spider())
+    headers = {"User-Agent": "test-agent"}
+    assert Downloader._request_headers(Request(url="http://example.com", headers=headers)) is headers
+    template = Downloader.header_templates["desktop"]
+    assert Downloader._request_headers(Request(url="http://example.com", header_template="desktop")) is template
+    sent = Downloader._request_headers(Request(url="http://example.com", headers=headers, header_template="desktop"))
+    assert sent == {"User-Agent": "test-agent", "Accept": "text/html"}
+    assert headers == {"User-Agent": "test-agent"} and template["User-Agent"] == "desktop"
+    with pytest.raises(ValueError):
+        Downloader._request_headers(Request(url="http://example.com", header_template="mobile"))
+    Downloader.setup_session()
+
+
+@pytest.fixture(scope="module")
+def server():
+    """本地http服务, /big 返回带 Content-Length 的 200KB 内容, /chunked 返回不带 Content-Length 的内容, /gzip 返回压缩后的内容"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    body = b"x" * 200 * 1024
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("X-Test", "1")
+            self.send_header("X-User-Agent", self.headers.get("User-Agent", ""))
+            self.send_header("X-User-Agent-Count", str(len(self.headers.get_all("User-Agent", []))))
+            self.send_header("X-Connection", self.headers.get("Connection", ""))
+            if self.path == "/gzip":
+                import gzip
+                data = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("X-Accept-Encoding", self.headers.get("Accept-Encoding", ""))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.path == "/chunked":
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass  # 超过大小限制时客户端会提前断开连接
+
+    httpd = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", body
+    httpd.shutdown()
+
+
+def test_fetch_header_template(server):
+    """测试模板中的请求头被发送, 默认复用连接不发送 Connection: close"""
+    url, _ = server
+
+    class Spider:
+        custom_settings = {"header_templates": {"desktop": {"User-Agent": "desktop"}}}
+
+    Downloader(spider=Spider())
+    response = Downloader.fetch(Request(url=url + "/big", header_template="desktop"))
+    assert response.headers["X-User-Agent"] == "desktop"
+    assert response.headers["X-Connection"] != "close"
+    Downloader.setup_session()
+
+
+def test_header_template_case_insensitive(server):
+    """测试请求中不同大小写的请求头覆盖模板, 同步和异步下载器都只发送一个 User-Agent"""
+    pytest.importorskip("aiohttp")
+    import asyncio
+    from smallder.core.downloader import AsyncDownloader
+    url, _ = server
+
+    class Spider:
+        custom_settings = {"header_templates": {"desktop": {"User-Agent": "desktop", "Accept": "text/html"}}}
+
+    Downloader(spider=Spider())
+    request = Request(url=url + "/big", headers={"user-agent": "custom"}, header_template="desktop")
+    sent = Downloader._request_headers(request)
+    assert len(sent) == 2 and sent["User-Agent"] == "custom" and sent["accept"] == "text/html"
+    response = Downloader.fetch(request)
+    assert response.headers["X-User-Agent"] == "custom"
+    assert response.headers["X-User-Agent-Count"] == "1"
+
+    async def run():
+        downloader = AsyncDownloader(Spider())
+        await downloader.open()
+        try:
+            return await downloader.fetch(request)
+        finally:
+            await downloader.close()
+
+    response = asyncio.run(run())
+    assert response.headers["X-User-Agent"] == "custom"
+    assert response.headers["X-User-Agent-Count"] == "1"
+    Downloader.setup_session()
+
+
+def test_fetch_headers(server):
+    """测试响应头被保存并且不区分大小写"""
+    url, body = server
+    response = Downloader.fetch(Request(url=url + "/big"))
+    assert response.headers["x-test"] == "1"
+    assert response.body is None
+    assert response.content == body
+    assert response.encoding == "utf-8"
+
+
+def test_fetch_stream(server):
+    """测试 stream=True 时响应内容写入临时文件, 访问 content 时才读取"""
+    url, body = server
+
+    class Spider:
+        custom_settings = {"download_spool_size": 1024}
+
+    Downloader(spider=Spider())
+    try:
+        response = Downloader.fetch(Request(url=url + "/big", stream=True))
+    finally:
+        Downloader.setup_session()
+    assert response.body._rolled
+    assert response._content is None
+    assert b"".join(response.iter_content(4096)) == body
+    assert response.replace(status_code=201).body is response.body
+    assert response.content == body
+    response.close()
+
+
+@pytest.mark.parametrize("path", ["/big", "/chunked"])
+def test_fetch_maxsize(server, path):
+    """测试超过 download_maxsize 的响应被丢弃"""
+    from smallder import DiscardException
+    url, body = server
+
+    class Spider:
+        custom_settings = {"download_maxsize": 1024}
+
+    Downloader(spider=Spider())
+    try:
+        with pytest.raises(DiscardException):
+            Downloader.fetch(Request(url=url + path, stream=path == "/chunked"))
+    finally:
+        Downloader.setup_session()
+
+
+def test_async_fetch_stream(server):
+    """测试异步下载器的响应头和 stream=True"""
+    pytest.importorskip("aiohttp")
+    import asyncio
+    from smallder.core.downloader import AsyncDownloader
+    url, body = server
+
+    class Spider:
+        custom_settings = {"download_spool_size": 1024, "download_maxsize": 300 * 1024}
+
+    async def run():
+        downloader = AsyncDownloader(Spider())
+        await downloader.open()
+        try:
+            return await downloader.fetch(Request(url=url + "/big", stream=True))
+        finally:
+            await downloader.close()
+
+    response = asyncio.run(run())
+    assert response.headers["X-TEST"] == "1"
+    assert response.body is not None
+    assert response.content == body
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_fetch_bandwidth(server, stream):
+    """测试记录压缩后和解压后的字节数"""
+    url, body = server
+    response = Downloader.fetch(Request(url=url + "/gzip", stream=stream))
+    assert "gzip" in response.headers["X-Accept-Encoding"]
+    assert response.size == len(body)
+    assert response.raw_size == int(response.headers["Content-Length"])
+    assert response.raw_size < response.size
+    assert response.content == body
+
+
+def test_async_fetch_bandwidth(server):
+    """测试异步下载器记录压缩后和解压后的字节数"""
+    pytest.importorskip("aiohttp")
+    import asyncio
+    from smallder.core.downloader import AsyncDownloader
+    url, body = server
+
+    async def run():
+        downloader = AsyncDownloader(None)
+        await downloader.open()
+        try:
+            return await downloader.fetch(Request(url=url + "/gzip"))
+        finally:
+            await downloader.close()
+
+    response = asyncio.run(run())
+    assert response.size == len(body)
+    assert response.raw_size == int(response.headers["Content-Length"])
@@ -0,0 +1,63 @@
+import pytest
+
+from smallder import Request
+from smallder.core.dupfilter import MemoryBloomFilter
+from smallder.utils.bloomfilter import BloomFilter, ScalableBloomFilter, bloom_size
+from smallder.utils.request import fingerprint
+
+
+def test_bloom_size():
+    """测试容量和误判率对应的位数和哈希函数个数"""
+    num_bits, num_hashes = bloom_size(1000000, 0.001)
+    assert 14000000 < num_bits < 14500000
+    assert num_hashes == 10
+
+
+def test_bloom_filter_add():
+    """测试添加过的指纹能被识别"""
+    bloom = BloomFilter(capacity=1000, error_rate=0.0001)
+    fps = [fingerprint(Request(url=f"https://example.com/{i}")) for i in range(1000)]
+    assert not any(bloom.add(fp) for fp in fps)
+    assert all(fp in bloom for fp in fps)
+    assert all(bloom.add(fp) for fp in fps)
+    assert len(bloom) == 1000
+
+
+def test_scalable_bloom_filter_grows():
+    """测试超过容量后自动扩容并且误判率保持在范围内"""
+    bloom = ScalableBloomFilter(capacity=100, error_rate=0.01)
+    fps = [fingerprint(Request(url=f"https://example.com/page/{i}")) for i in range(1000)]
+    for fp in fps:
+        bloom.add(fp)
+    assert len(bloom.filters) > 1
+    assert all(fp in bloom for fp in fps)
+    others = [fingerprint(Request(url=f"https://example.com/other/{i}")) for i in range(1000)]
+    assert sum(fp in bloom for fp in others) < 30
+
+
+def test_memory_bloom_filter_request_seen():
+    """测试 MemoryBloomFilter 的去重结果"""
+    dup_filter = MemoryBloomFilter(capacity=100, error_rate=0.001)
+    assert not dup_filter.request_seen(Request(url="https://example.com/a"))
+    assert dup_filter.request_seen(Request(url="https://example.com/a"))
+    assert not dup_filter.request_seen(Request(url="https://example.com/a", method="post", data={"a": 1}))
+
+
+def test_redis_filter_key_version():
+    """测试默认的redis去重使用新的key,不会和旧版本的sha1指纹混在一起"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from smallder import Spider
+    from smallder.core.dupfilter import FilterFactory, RedisFilter
+
+    spider = Spider()
+    spider.name = "dupfilter_test"
+    spider.server = fakeredis.FakeStrictRedis()
+    spider.server.sadd("dupfilter_test:dupfilter", b"\x00" * 20)
+    dup_filter = FilterFactory.create_filter(spider)
+    assert isinstance(dup_filter, RedisFilter)
+    assert dup_filter.key == "dupfilter_test:dupfilter:v2"
+    request = Request(url="https://example.com/a")
+    assert not dup_filter.request_seen(request)
+    assert dup_filter.request_seen(request)
+    assert spider.server.smembers("dupfilter_test:dupfilter:v2") == {fingerprint(request)}
+    assert spider.server.scard("dupfilter_test:dupfilter") == 1
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+from smallder import Spider, Request, Response
+from smallder.core.dupfilter import MemoryFilter
+from smallder.core.engine import Engine
+from smallder.core.scheduler import Scheduler
+
+
+def fetch(request):
+    return Response(content=request.url.encode(), status_code=200, request=request)
+
+
+class SyncSpider(Spider):
+    name = "sync_engine_test"
+    fastapi = False
+    thread_count = 4
+    items = []
+
+    def start_requests(self):
+        yield Request(url="https://sync.example.com/list", fetch=fetch)
+
+    def parse(self, response):
+        for i in range(5):
+            yield Request(url=f"https://sync.example.com/{i}", fetch=fetch, callback=self.detail)
+
+    def detail(self, response):
+        yield {"url": response.text}
+
+    def pipline(self, item):
+        self.items.append(item)
+
+
+class AsyncSpider(SyncSpider):
+    name = "async_engine_test"
+    items = []
+
+    def start_requests(self):
+        yield Request(url="https://async.example.com/list", fetch=fetch)
+
+    async def parse(self, response):
+        for i in range(5):
+            yield Request(url=f"https://async.example.com/{i}", fetch=fetch, callback=self.detail)
+
+    async def pipline(self, item):
+        self.items.append(item)
+
+
+def test_thread_engine():
+    """测试线程池模式下请求,回调和pipline的完整流程"""
+    SyncSpider.start()
+    assert sorted(item["url"] for item in SyncSpider.items) == [f"https://sync.example.com/{i}" for i in range(5)]
+
+
+def test_async_engine():
+    """测试async模式下同时支持 async def 回调和普通回调"""
+    AsyncSpider.start(mode="async")
+    assert sorted(item["url"] for item in AsyncSpider.items) == [f"https://async.example.com/{i}" for i in range(5)]
+
+
+class ItemCountSpider(SyncSpider):
+    name = "item_count_engine_test"
+    custom_settings = {"stats_collector_class": "smallder.core.statscollectors.StatsCollector"}
+    items = []
+    stats_values = {}
+
+    def start_requests(self):
+        yield {"url": "start"}  # 经过调度器交给 pipline 的 item
+        yield Request(url="https://items.example.com/list", fetch=fetch)
+
+    def parse(self, response):
+        for i in range(3):
+            yield Request(url=f"https://items.example.com/{i}", fetch=fetch, callback=self.detail)
+
+    def on_stop(self):
+        self.stats_values.update(self.stats.get_stats())
+
+
+def test_item_stats_counted_once():
+    """测试经过调度器和回调产生的 item 都只在 pipline 写入后计数一次"""
+    ItemCountSpider.start()
+    assert len(ItemCountSpider.items) == 4
+    assert ItemCountSpider.stats_values["dict"] == 4
+    assert ItemCountSpider.stats_values["pipeline/items"] == 4
+    assert ItemCountSpider.stats_values["request"] == 4
+
+
+class StuckScheduler(Scheduler):
+    """模拟 redis 不可用: 缓存中有任务写不进 redis, 一直取不到任务"""
+
+    def __init__(self, spider, seconds):
+        super().__init__(spider, MemoryFilter())
+        self.deadline = time.time() + seconds
+        self.calls = 0
+
+    def next_job(self, block=False):
+        self.calls += 1
+        return None
+
+    def empty(self):
+        return time.time() > self.deadline
+
+    def size(self):
+        return 0 if self.empty() else 1
+
+
+def test_thread_engine_no_spin():
+    """测试调度器不为空但是取不到任务时调度循环不会空转"""
+    with Engine(SyncSpider) as engine:
+        engine.start_requests = None
+        engine.scheduler = StuckScheduler(engine.spider, 0.3)
+        engine.engine()
+    # 连续 spin_limit 次之后每次等待 10ms, 空转时会调用几十万次
+    assert engine.scheduler.calls < engine.spin_limit + 100
+
+
+def test_async_engine_no_spin():
+    """测试async模式下取不到任务时也会让出事件循环, redis 调度器的调用放到线程池中执行"""
+    ticks = []
+
+    async def run():
+        async def ticker():
+            while True:
+                ticks.append(time.time())
+                await asyncio.sleep(0.01)
+
+        task = asyncio.get_running_loop().create_task(ticker())
+        try:
+            await engine._async_engine()
+        finally:
+            task.cancel()
+
+    with Engine(AsyncSpider) as engine:
+        engine.start_requests = None
+        engine.scheduler = StuckScheduler(engine.spider, 0.3)
+        asyncio.run(run())
+    assert engine.scheduler.calls < engine.spin_limit + 100
+    assert len([t for t in ticks if t < engine.scheduler.deadline]) > 5  # 其他协程可以正常执行
+
+
+class ParseLimitSpider(SyncSpider):
+    name = "parse_limit_engine_test"
+    custom_settings = {"parse_limit": 60}
+    limits = []
+
+    def detail(self, response):
+        self.limits.append(response.parse_limit)
+
+
+def test_parse_limit_per_engine():
+    """测试 parse_limit 只设置到当前爬虫的响应上, 不影响其他爬虫"""
+    ParseLimitSpider.start()
+    assert ParseLimitSpider.limits == [60] * 5
+    assert Response(content=b"", request=Request(url="https://example.com")).parse_limit == 0
@@ -0,0 +1,135 @@
+import csv
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from smallder import Spider
+from smallder.core.statscollectors import StatsCollector
+from smallder.pipelines import JsonLinesExporter, CsvExporter, ParquetExporter
+
+
+def make_spider(tmp_path, **settings):
+    class ExportSpider(Spider):
+        name = "export_test"
+        custom_settings = {"export_dir": str(tmp_path), **settings}
+
+    return ExportSpider()
+
+
+def read_jsonl(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_jsonl_exporter(tmp_path):
+    """测试写入jsonl,结束前以 .part 后缀写入"""
+    exporter = JsonLinesExporter(make_spider(tmp_path))
+    exporter.process_items([{"id": 1, "name": "中文"}, {"id": 2, "tags": ["a"]}])
+    assert [name.endswith(".jsonl.part") for name in os.listdir(tmp_path)] == [True]
+    exporter.close()
+    assert len(exporter.files) == 1
+    assert read_jsonl(exporter.files[0]) == [{"id": 1, "name": "中文"}, {"id": 2, "tags": ["a"]}]
+
+
+def test_jsonl_gzip_rotate_size(tmp_path):
+    """测试gzip压缩并按大小轮转,所有文件合起来包含全部数据"""
+    exporter = JsonLinesExporter(make_spider(tmp_path, export_compression="gzip", export_rotate_size=1,
+                                             export_buffer_size=0))
+    for i in range(3):
+        exporter.process_items([{"id": i}])
+    exporter.close()
+    assert len(exporter.files) == 3
+    assert all(path.endswith(".jsonl.gz") for path in exporter.files)
+    assert [item for path in exporter.files for item in read_jsonl(path)] == [{"id": 0}, {"id": 1}, {"id": 2}]
+
+
+def test_jsonl_rotate_interval(tmp_path):
+    """测试按时间轮转"""
+    exporter = JsonLinesExporter(make_spider(tmp_path, export_rotate_interval=0.05))
+    exporter.process_items([{"id": 0}])
+    time.sleep(0.05)
+    exporter.process_items([{"id": 1}])
+    exporter.close()
+    assert [read_jsonl(path) for path in exporter.files] == [[{"id": 0}], [{"id": 1}]]
+
+
+def test_csv_exporter(tmp_path):
+    """测试csv每个文件都有表头,忽略多余字段, dict/list 保存为json"""
+    exporter = CsvExporter(make_spider(tmp_path, export_rotate_interval=0.05))
+    exporter.process_items([{"id": 1, "name": "a"}, {"id": 2, "name": "b", "extra": 1}])
+    time.sleep(0.05)
+    exporter.process_items([{"id": 3, "name": {"k": "v"}}])
+    exporter.close()
+    rows = []
+    for path in exporter.files:
+        with open(path, encoding="utf-8", newline="") as f:
+            rows.append(list(csv.reader(f)))
+    assert rows == [
+        [["id", "name"], ["1", "a"], ["2", "b"]],
+        [["id", "name"], ["3", '{"k": "v"}']],
+    ]
+
+
+def test_invalid_compression(tmp_path):
+    with pytest.raises(ValueError):
+        JsonLinesExporter(make_spider(tmp_path, export_compression="bz2"))
+
+
+def test_parquet_exporter(tmp_path):
+    """测试parquet按 row group 写入,缺少的字段为null"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    exporter = ParquetExporter(make_spider(tmp_path, export_row_group_size=2))
+    exporter.process_items([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+    exporter.process_items([{"id": 3}])
+    exporter.close()
+    table = pq.read_table(exporter.files[0])
+    assert table.to_pylist() == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}, {"id": 3, "name": None}]
+    assert pq.ParquetFile(exporter.files[0]).num_row_groups == 2
+
+
+def test_parquet_schema_mismatch(tmp_path):
+    """测试第一批全为null的字段使用string类型,类型不匹配的 row group 写入 .rejected.jsonl 后继续导出"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    spider = make_spider(tmp_path, export_row_group_size=2)
+    spider.stats = StatsCollector(spider)
+    exporter = ParquetExporter(spider)
+    exporter.process_items([{"a": 1, "b": None}, {"a": None, "b": None}])
+    exporter.process_items([{"a": "x", "b": 2}, {"a": "y", "b": "z"}])
+    exporter.process_items([{"a": 3, "b": "w"}, {"a": 4}])
+    assert exporter.rows == []
+    exporter.close()
+    table = pq.read_table(exporter.files[0])
+    assert str(table.schema.field("b").type) == "string"
+    assert table.to_pylist() == [
+        {"a": 1, "b": None}, {"a": None, "b": None}, {"a": 3, "b": "w"}, {"a": 4, "b": None},
+    ]
+    assert read_jsonl(exporter.files[0] + ".rejected.jsonl") == [{"a": "x", "b": 2}, {"a": "y", "b": "z"}]
+    assert exporter.stats.get_value("export/rejected_items") == 2
+
+
+def test_parquet_all_rejected(tmp_path):
+    """测试文件中所有 row group 都被拒绝时不生成无法读取的空 parquet 文件"""
+    pytest.importorskip("pyarrow.parquet")
+    spider = make_spider(tmp_path, export_row_group_size=1)
+    spider.stats = StatsCollector(spider)
+    exporter = ParquetExporter(spider)
+    exporter.schema = exporter.infer_schema([{"a": 1}])  # 上一个文件确定的 schema
+    exporter.process_items([{"a": "x"}])
+    exporter.close()
+    assert exporter.files == []
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(exporter.path) + ".rejected.jsonl"]
+    assert exporter.stats.get_value("export/rejected_items") == 1
+
+
+def test_parquet_export_fields(tmp_path):
+    """测试 export_fields 中第一批缺少的字段,其他类型的值转为字符串"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    exporter = ParquetExporter(make_spider(tmp_path, export_row_group_size=1, export_fields=["id", "name"]))
+    exporter.process_items([{"id": 1}])
+    exporter.process_items([{"id": 2, "name": 5, "extra": True}])
+    exporter.close()
+    assert pq.read_table(exporter.files[0]).to_pylist() == [{"id": 1, "name": None}, {"id": 2, "name": "5"}]
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+import pytest
+
+from smallder import Request, Response
+from smallder.api.metrics import render_metrics
+from smallder.core.statscollectors import StatsCollector
+
+
+class Spider:
+    name = "metrics_spider"
+    futures = []
+
+
+def make_stats():
+    stats = StatsCollector(spider=Spider())
+    stats.inc_value("request", 3)
+    stats.inc_value("dupfilter/checked", 4)
+    stats.inc_value("dupfilter/filtered", 1)
+    stats.inc_value("mysql/rows", 10)
+    for elapsed in (0.02, 0.2, 3):
+        url = "https://a.com/"
+        stats.record_response(Response(url=url, request=Request(url=url), content=b"",
+                                       elapsed=timedelta(seconds=elapsed), raw_size=10, size=30))
+    stats.add_value("pipeline/flush_latency", 0.5)
+    return stats
+
+
+def test_render_metrics():
+    """测试输出 Prometheus text format"""
+    text = render_metrics(make_stats(), Spider())
+    lines = text.splitlines()
+    assert '# TYPE smallder_requests_total counter' in lines
+    assert 'smallder_requests_total{spider="metrics_spider"} 3.0' in lines
+    assert 'smallder_response_status_total{spider="metrics_spider",status="200"} 3.0' in lines
+    assert 'smallder_dupfilter_hit_ratio{spider="metrics_spider"} 0.25' in lines
+    assert 'smallder_stat{spider="metrics_spider",key="mysql/rows"} 10.0' in lines
+    assert 'smallder_domain_received_raw_bytes_total{spider="metrics_spider",domain="a.com"} 30.0' in lines
+    assert '# TYPE smallder_download_latency_seconds histogram' in lines
+    assert 'smallder_download_latency_seconds_bucket{spider="metrics_spider",le="0.05"} 1.0' in lines
+    assert 'smallder_download_latency_seconds_bucket{spider="metrics_spider",le="1.0"} 2.0' in lines
+    assert 'smallder_download_latency_seconds_bucket{spider="metrics_spider",le="+Inf"} 3.0' in lines
+    assert 'smallder_download_latency_seconds_count{spider="metrics_spider"} 3.0' in lines
+    assert 'smallder_pipeline_flush_seconds_count{spider="metrics_spider"} 1.0' in lines
+    # 每个指标只有一组 HELP/TYPE
+    types = [line for line in lines if line.startswith("# TYPE")]
+    assert len(types) == len(set(types))
+
+
+def test_render_metrics_parse():
+    """测试输出可以被 prometheus_client 解析"""
+    parser = pytest.importorskip("prometheus_client.parser")
+    families = {family.name: family for family in parser.text_string_to_metric_families(
+        render_metrics(make_stats(), Spider()))}
+    assert families["smallder_download_latency_seconds"].type == "histogram"
+    assert families["smallder_requests"].type == "counter"
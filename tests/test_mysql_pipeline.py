@@ -0,0 +1,102 @@
+import pytest
+
+from smallder import Spider
+from smallder.pipelines.mysql import MySQLBulkPipeline, build_insert, chunk_rows, group_rows
+
+
+def test_build_insert():
+    """测试生成多行 INSERT ... ON DUPLICATE KEY UPDATE 语句"""
+    sql, params = build_insert("item", ("id", "name"), [(1, "a"), (2, "b")])
+    assert sql == (
+        "INSERT INTO `item` (`id`, `name`) VALUES (%s, %s), (%s, %s) "
+        "ON DUPLICATE KEY UPDATE `id` = VALUES(`id`), `name` = VALUES(`name`)"
+    )
+    assert params == [1, "a", 2, "b"]
+
+
+def test_build_insert_update_columns():
+    """测试指定冲突时更新的字段,空列表使用 INSERT IGNORE"""
+    sql, _ = build_insert("item", ("id", "name"), [(1, "a")], update_columns=["name"])
+    assert sql.endswith("ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)")
+    sql, _ = build_insert("it`em", ("id",), [(1,)], update_columns=[])
+    assert sql == "INSERT IGNORE INTO `it``em` (`id`) VALUES (%s)"
+
+
+def test_group_rows():
+    """测试按字段分组,字段顺序不同也能合并, dict/list 转为json"""
+    groups = group_rows([
+        {"id": 1, "name": "a"},
+        {"name": "b", "id": 2},
+        {"id": 3, "tags": ["x"]},
+    ])
+    assert groups == [(("id", "name"), [(1, "a"), (2, "b")]), (("id", "tags"), [(3, '["x"]')])]
+
+
+def test_chunk_rows():
+    """测试按语句大小切分"""
+    rows = [(i, "x" * 100) for i in range(10)]
+    chunks = list(chunk_rows(rows, max_bytes=500))
+    assert [row for chunk in chunks for row in chunk] == rows
+    assert len(chunks) == 3
+    assert list(chunk_rows([(1, "x" * 1000)], max_bytes=10)) == [[(1, "x" * 1000)]]
+
+
+class FakeCursor:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def execute(self, sql, params):
+        if self.engine.failures:
+            self.engine.failures -= 1
+            raise Exception(1213, "Deadlock found when trying to get lock")
+        self.engine.executed.append((sql, params))
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def cursor(self):
+        return FakeCursor(self.engine)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.engine.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.executed = []
+        self.rollbacks = 0
+
+    def raw_connection(self):
+        return FakeConnection(self)
+
+
+class MySQLSpider(Spider):
+    name = "mysql_pipeline_test"
+    custom_settings = {"mysql_table": "item", "mysql_max_retry": 2}
+
+
+def test_retry_on_deadlock():
+    """测试死锁时回滚后重试,超过重试次数抛出异常"""
+    spider = MySQLSpider()
+    spider.mysql_server = FakeEngine(failures=2)
+    pipeline = MySQLBulkPipeline(spider)
+    pipeline.process_items([{"id": 1}, {"id": 2}])
+    assert spider.mysql_server.rollbacks == 2
+    assert spider.mysql_server.executed == [
+        ("INSERT INTO `item` (`id`) VALUES (%s), (%s) ON DUPLICATE KEY UPDATE `id` = VALUES(`id`)", [1, 2])
+    ]
+
+    spider.mysql_server = FakeEngine(failures=3)
+    pipeline = MySQLBulkPipeline(spider)
+    with pytest.raises(Exception):
+        pipeline.process_items([{"id": 1}])
+    assert not spider.mysql_server.executed
@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from smallder import Spider
+from smallder.core.pipeline import PipelineManager
+
+
+class BatchSpider(Spider):
+    name = "pipeline_test"
+    pipline_mode = "list"
+    pipline_batch = 100
+    pipline_flush_interval = 0.1
+
+    def __init__(self):
+        self.batches = []
+
+    def pipline(self, items):
+        self.batches.append(items)
+
+
+def test_flush_on_interval():
+    """测试不满 pipline_batch 的 item 超过 pipline_flush_interval 后写入"""
+    spider = BatchSpider()
+    pipeline = PipelineManager(spider)
+    pipeline.open()
+    for i in range(3):
+        pipeline.put({"id": i})
+    time.sleep(0.5)
+    assert spider.batches == [[{"id": 0}, {"id": 1}, {"id": 2}]]
+    pipeline.close()
+
+
+def test_flush_on_batch_size():
+    """测试攒够 pipline_batch 条时立即写入,结束时写入剩余的 item"""
+    spider = BatchSpider()
+    spider.pipline_batch = 10
+    spider.pipline_flush_interval = 60
+    pipeline = PipelineManager(spider)
+    pipeline.open()
+    for i in range(25):
+        pipeline.put({"id": i})
+    time.sleep(0.3)
+    assert [len(items) for items in spider.batches] == [10, 10]
+    pipeline.close()
+    assert [len(items) for items in spider.batches] == [10, 10, 5]
+
+
+def test_backpressure():
+    """测试队列满时放入 item 会等待 pipline 处理"""
+
+    class SlowSpider(BatchSpider):
+        pipline_mode = "single"
+        custom_settings = {"pipline_queue_size": 2, "pipline_workers": 1}
+        release = threading.Event()
+
+        def pipline(self, item):
+            self.release.wait()
+            self.batches.append(item)
+
+    spider = SlowSpider()
+    pipeline = PipelineManager(spider)
+    pipeline.open()
+    for i in range(3):  # 第一条正在处理,后两条在队列中
+        pipeline.put({"id": i})
+    time.sleep(0.05)
+    assert pipeline.size() == 2
+    with pytest.raises(queue.Full):
+        pipeline.queue.put({"id": 3}, timeout=0.1)
+    spider.release.set()
+    pipeline.close()
+    assert len(spider.batches) == 3
+
+
+def test_single_mode_workers():
+    """测试 single 模式默认使用 thread_count 个线程并发入库, list 模式默认一个线程"""
+
+    class SingleSpider(BatchSpider):
+        pipline_mode = "single"
+        thread_count = 4
+        barrier = threading.Barrier(4, timeout=5)
+
+        def pipline(self, item):
+            self.barrier.wait()  # 4条 item 同时在处理时才会通过
+            self.batches.append(item)
+
+    spider = SingleSpider()
+    pipeline = PipelineManager(spider)
+    assert pipeline.worker_count == 4
+    pipeline.open()
+    for i in range(4):
+        pipeline.put({"id": i})
+    pipeline.close()
+    assert len(spider.batches) == 4
+    assert PipelineManager(BatchSpider()).worker_count == 1
+
+
+def test_async_pipeline():
+    """测试 async pipline 在事件循环中批量处理"""
+
+    class AsyncBatchSpider(BatchSpider):
+        async def pipline(self, items):
+            await asyncio.sleep(0)
+            self.batches.append(items)
+
+    spider = AsyncBatchSpider()
+    spider.pipline_batch = 2
+    pipeline = PipelineManager(spider)
+    assert pipeline.is_async
+
+    async def run():
+        task = asyncio.create_task(pipeline.async_run())
+        for i in range(5):
+            await pipeline.async_put({"id": i})
+        await asyncio.sleep(0.3)
+        pipeline.stopped.set()
+        await task
+
+    asyncio.run(run())
+    assert [len(items) for items in spider.batches] == [2, 2, 1]
+
+
+class RecordPipeline:
+    def __init__(self, spider):
+        self.batches = []
+        self.closed = False
+
+    def process_items(self, items):
+        self.batches.append(items)
+
+    def close(self):
+        self.closed = True
+
+
+def test_pipeline_settings():
+    """测试加载 pipeline_settings 中的 pipeline,结束时调用 close"""
+
+    class SettingsSpider(BatchSpider):
+        custom_settings = {"pipeline_settings": {"tests.test_pipeline.RecordPipeline": 100, "not.exists.Pipeline": 200}}
+
+    spider = SettingsSpider()
+    pipeline = PipelineManager(spider)
+    assert len(pipeline.pipelines) == 1
+    pipeline.open()
+    pipeline.put({"id": 1})
+    pipeline.close()
+    record = pipeline.pipelines[0]
+    assert record.batches == spider.batches == [[{"id": 1}]]
+    assert record.closed
@@ -0,0 +1,161 @@
+import queue
+
+import pytest
+
+from smallder import Spider, Request
+from smallder.core.dupfilter import MemoryBloomFilter
+from smallder.core.queues import PriorityQueue, DiskPriorityQueue
+from smallder.core.scheduler import MemoryScheduler
+
+
+def test_priority_order():
+    """测试 priority 越大越先出队"""
+    q = PriorityQueue()
+    for priority in (0, 10, -5, 3):
+        q.put(priority, priority=priority)
+    assert [q.get() for _ in range(4)] == [10, 3, 0, -5]
+
+
+def test_bfs_is_fifo_within_priority():
+    """测试 bfs 模式同一优先级先进先出"""
+    q = PriorityQueue(order="bfs")
+    for i in range(5):
+        q.put(i)
+    assert [q.get() for _ in range(5)] == [0, 1, 2, 3, 4]
+
+
+def test_dfs_is_lifo_within_priority():
+    """测试 dfs 模式同一优先级后进先出"""
+    q = PriorityQueue(order="dfs")
+    for i in range(5):
+        q.put(i)
+    q.put("high", priority=1)
+    assert [q.get() for _ in range(6)] == ["high", 4, 3, 2, 1, 0]
+
+
+def test_get_empty():
+    """测试空队列的行为和 queue.Queue 一致"""
+    q = PriorityQueue()
+    assert q.empty()
+    with pytest.raises(queue.Empty):
+        q.get(block=False)
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+
+def test_invalid_order():
+    with pytest.raises(ValueError):
+        PriorityQueue(order="random")
+
+
+def _disk_queue(path, **kwargs):
+    return DiskPriorityQueue(
+        str(path),
+        serialize=lambda item: str(item).encode() if isinstance(item, int) else None,
+        deserialize=lambda data: int(data.decode()),
+        **kwargs,
+    )
+
+
+def test_disk_queue_keeps_order(tmp_path):
+    """测试溢出到磁盘后出队顺序和内存队列一致"""
+    q = _disk_queue(tmp_path / "queue.sqlite3", memory_limit=10, batch_size=7)
+    expected = PriorityQueue()
+    for i in range(200):
+        priority = i % 5
+        q.put(i, priority=priority)
+        expected.put(i, priority=priority)
+    assert len(q._heap) == 10
+    assert q.qsize() == 200
+    assert [q.get() for _ in range(200)] == [expected.get() for _ in range(200)]
+    assert q.empty()
+    q.close()
+
+
+def test_disk_queue_batch_transaction(tmp_path):
+    """测试一批溢出和读回的任务各自在一个事务中提交"""
+    q = _disk_queue(tmp_path / "queue.sqlite3", memory_limit=1, batch_size=5)
+    statements = []
+    q.db.set_trace_callback(statements.append)
+    for i in range(6):
+        q.put(i)
+    assert statements.count("BEGIN") == statements.count("COMMIT") == 1
+    assert sum(sql.startswith("INSERT") for sql in statements) == 5
+    statements.clear()
+    assert [q.get() for _ in range(6)] == list(range(6))
+    assert statements.count("BEGIN") == statements.count("COMMIT") == 1
+    assert sum(sql.startswith("DELETE") for sql in statements) == 5
+    q.close()
+
+
+def test_disk_queue_unserializable_stays_in_memory(tmp_path):
+    """测试无法序列化的任务保留在内存中"""
+    q = _disk_queue(tmp_path / "queue.sqlite3", memory_limit=1)
+    q.put(1)
+    q.put("response")
+    assert q._heap[-1][-1] == "response"
+    assert [q.get(), q.get()] == [1, "response"]
+    q.close()
+
+
+def test_disk_queue_resume(tmp_path):
+    """测试关闭后重新打开同一个文件继续之前的队列"""
+    path = tmp_path / "queue.sqlite3"
+    q = _disk_queue(path, memory_limit=5)
+    for i in range(20):
+        q.put(i)
+    assert [q.get() for _ in range(3)] == [0, 1, 2]
+    q.close()
+
+    q = _disk_queue(path, memory_limit=5)
+    assert q.qsize() == 17
+    q.put(100)
+    assert [q.get() for _ in range(18)] == list(range(3, 20)) + [100]
+    q.close()
+
+
+def test_memory_scheduler_spills_requests(tmp_path):
+    """测试内存调度器把超出限制的请求写入磁盘,重启后继续执行"""
+
+    class DiskSpider(Spider):
+        name = "disk_queue_test"
+        custom_settings = {"memory_queue_dir": str(tmp_path), "memory_queue_limit": 2, "memory_queue_resume": True}
+
+        def detail(self, response):
+            pass
+
+    spider = DiskSpider()
+    scheduler = MemoryScheduler(spider, MemoryBloomFilter())
+    for i in range(5):
+        scheduler.add_job(Request(url=f"https://example.com/{i}", callback=spider.detail, priority=i))
+    assert scheduler.size() == 5
+    assert scheduler.next_job().url == "https://example.com/4"
+    scheduler.close()
+
+    scheduler = MemoryScheduler(spider, MemoryBloomFilter())
+    jobs = [scheduler.next_job() for _ in range(4)]
+    assert [job.url for job in jobs] == [f"https://example.com/{i}" for i in (3, 2, 1, 0)]
+    assert jobs[0].callback == spider.detail
+    assert scheduler.empty()
+    scheduler.close()
+
+
+def test_memory_scheduler_resume_opt_in(tmp_path):
+    """测试没有开启 memory_queue_resume 时启动会清空上次保存的请求"""
+
+    class DiskSpider(Spider):
+        name = "disk_queue_fresh_test"
+        custom_settings = {"memory_queue_dir": str(tmp_path), "memory_queue_limit": 1}
+
+        def detail(self, response):
+            pass
+
+    spider = DiskSpider()
+    scheduler = MemoryScheduler(spider, MemoryBloomFilter())
+    for i in range(3):
+        scheduler.add_job(Request(url=f"https://example.com/{i}", callback=spider.detail))
+    scheduler.close()
+
+    scheduler = MemoryScheduler(spider, MemoryBloomFilter())
+    assert scheduler.empty()
+    scheduler.close()
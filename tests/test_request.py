@@ -25,9 +25,10 @@ def test_replace():
     assert req.url == "http://example.com"
 
 def test_headers_setter():
-    """测试 headers setter 方法"""
-    req = Request(method="get", url="http://example.com", headers={"User-Agent": "test-agent"})
-    assert req.headers["Connection"] == "close"  # 确保 Connection 被添加
+    """测试 headers setter 方法, 不会修改传入的 headers"""
+    headers = {"User-Agent": "test-agent"}
+    req = Request(method="get", url="http://example.com", headers=headers)
+    assert "Connection" not in req.headers and headers == {"User-Agent": "test-agent"}
     assert req.headers["User-Agent"] == "test-agent"
 
 def test_headers_invalid():
@@ -72,3 +73,88 @@ def test_referer_property():
     assert req.referer == "http://referer.com"
 
 
+
+
+def test_method_registry():
+    """测试回调名称查表和 request_from_dict 还原回调, 运行时添加的方法回退到反射"""
+    from smallder.core.request import method_registry
+    from smallder.utils.request import request_from_dict
+
+    class Spider:
+        def parse_item(self, response):
+            pass
+
+        alias = parse_item
+
+        @staticmethod
+        def helper():
+            pass
+
+    spider = Spider()
+    registry = method_registry(Spider)
+    assert registry is method_registry(Spider)
+    assert "helper" not in registry.functions
+    req = Request(url="http://example.com", callback=spider.parse_item, errback=spider.alias)
+    req_dict = req.to_dict(spider)
+    assert req_dict["callback"] == "alias" and req_dict["errback"] == "alias"
+    assert request_from_dict(req_dict, spider).callback == spider.parse_item
+
+    def parse_late(self, response):
+        pass
+
+    Spider.parse_late = parse_late
+    assert Request(url="http://example.com", callback=spider.parse_late).to_dict(spider)["callback"] == "parse_late"
+    spider.alias = lambda response: None  # 实例属性优先于类方法
+    assert request_from_dict(req_dict, spider).callback is spider.alias
+    with pytest.raises(ValueError):
+        Request(url="http://example.com", callback=Request(url="http://example.com").replace).to_dict(spider)
+
+
+def test_method_registry_reassigned():
+    """测试运行时替换类方法后还原的是当前的方法, 不是方法表中缓存的旧方法"""
+    from smallder.core.request import method_registry
+    from smallder.utils.request import request_from_dict
+
+    class Spider:
+        def parse(self, response):
+            return "old"
+
+    spider = Spider()
+    req_dict = Request(url="http://example.com", callback=spider.parse).to_dict(spider)
+    assert "parse" in method_registry(Spider).functions
+
+    def new_parse(self, response):
+        return "new"
+
+    Spider.parse = new_parse
+    assert request_from_dict(req_dict, spider).callback(None) == "new"
+
+
+def test_headers_copy_on_write():
+    """测试多个请求共用 headers, 修改时才复制, 不会影响其他请求"""
+    headers = {"User-Agent": "smallder"}
+    first = Request(url="http://example.com/1", headers=headers)
+    second = Request(url="http://example.com/2", headers=headers)
+    assert first._headers is second._headers
+    first.headers["X-Token"] = "1"
+    assert "X-Token" not in second.headers and "X-Token" not in headers
+    copied = first.copy()
+    copied.headers["X-Token"] = "2"
+    assert first.headers["X-Token"] == "1"
+
+
+def test_replace_fast_path():
+    """测试 replace/copy 直接复制属性, meta 复制一份, 结果和重新创建请求一致"""
+    def callback(response):
+        pass
+
+    req = Request(url="http://example.com", callback=callback, meta={"page": 1}, referer="http://referer.com",
+                  priority=3, retry=2)
+    assert not hasattr(req, "__dict__")
+    copied = req.replace(url="http://example.com/2", meta={"page": 2})
+    assert copied.url == "http://example.com/2" and copied.meta == {"page": 2}
+    assert (copied.callback, copied.referer, copied.priority, copied.retry) == (callback, "http://referer.com", 3, 2)
+    copied = req.copy()
+    copied.meta["page"] = 3
+    assert req.meta == {"page": 1}
+    assert req.replace(data={"a": 1}).method == "POST"
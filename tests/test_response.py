@@ -0,0 +1,68 @@
+import pytest
+
+from smallder import Request, Response
+
+
+def make_response(content, **kwargs):
+    return Response(content=content, request=Request(url="https://example.com"), **kwargs)
+
+
+def test_text_cached():
+    """测试 text 只解码一次,修改 content 后重新解码"""
+    response = make_response("你好".encode("utf-8"))
+    assert response.text == "你好"
+    assert response.text is response.text
+    assert response.encoding == "utf-8"
+    response.content = b"hello"
+    assert response.text == "hello"
+
+
+@pytest.mark.parametrize("kwargs, content, expected", [
+    ({"encoding": "gbk"}, "中文".encode("gbk"), "gbk"),
+    ({"headers": {"content-type": "text/html; charset=GBK"}}, "中文".encode("gbk"), "gb18030"),
+    ({}, b'<html><head><meta charset="big5"></head>' + "中文".encode("big5"), "big5"),
+    ({}, b'<meta http-equiv="Content-Type" content="text/html; charset=shift_jis">' + "日本".encode("shift_jis"),
+     "shift_jis"),
+    ({}, b'<?xml version="1.0" encoding="ISO-8859-1"?><a>\xe9</a>', "iso8859-1"),
+    ({}, "﻿中文".encode("utf-8"), "utf-8-sig"),
+    ({"headers": {"Content-Type": "text/html; charset=unknown-charset"}}, "中文".encode("utf-8"), "utf-8"),
+])
+def test_declared_encoding(kwargs, content, expected):
+    """测试按 指定编码/BOM/Content-Type/meta 的顺序获取编码"""
+    response = make_response(content, **kwargs)
+    assert response.encoding == expected
+    assert "﻿" not in response.text
+
+
+def test_detect_encoding():
+    """测试没有声明编码并且不是utf-8时使用chardet检测"""
+    content = ("这是一段用来检测编码的中文内容," * 20).encode("gb18030")
+    response = make_response(content)
+    assert response.text == content.decode("gb18030")
+    assert response.encoding == "gb18030"
+
+
+def test_root_cached():
+    """测试 root 只解析一次"""
+    response = make_response(b"<html><body><a href='/a'>a</a></body></html>")
+    assert response.root is response.root
+    assert response.root.xpath("//a/@href") == ["/a"]
+    response.content = b"<html><body><a href='/b'>b</a></body></html>"
+    assert response.root.xpath("//a/@href") == ["/b"]
+
+
+def test_json_cached():
+    """测试 json 解析结果缓存,非utf编码时根据 text 解析"""
+    response = make_response(b'{"a": [1, 2]}')
+    assert response.json() == {"a": [1, 2]}
+    assert response.json() is response.json()
+    assert response.json(parse_int=str) == {"a": ["1", "2"]}
+    response = make_response('{"a": "中文"}'.encode("gbk"), headers={"Content-Type": "application/json; charset=gbk"})
+    assert response.json() == {"a": "中文"}
+
+
+def test_replace_keeps_explicit_encoding():
+    """测试 replace 只复制指定的编码"""
+    response = make_response("中文".encode("gbk"), encoding="gbk")
+    assert response.replace(content="中文".encode("gbk")).text == "中文"
+    assert make_response(b"abc").replace()._encoding is None
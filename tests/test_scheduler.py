@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from smallder import Spider, Request
+from smallder.core.dupfilter import MemoryFilter
+from smallder.core.scheduler import RedisScheduler, RedisPriorityScheduler
+from smallder.core.statscollectors import StatsCollector
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis 执行 lua 脚本需要 lupa
+
+
+class SchedulerSpider(Spider):
+    name = "scheduler_test"
+    batch_size = 3
+
+
+def make_spider(server=None, **settings):
+    spider = SchedulerSpider()
+    spider.server = server or fakeredis.FakeStrictRedis()
+    spider.custom_settings = settings
+    spider.stats = StatsCollector(spider)
+    return spider
+
+
+def drain(scheduler):
+    urls = []
+    while not scheduler.empty():
+        job = scheduler.next_job()
+        if job is not None:
+            urls.append(job.url)
+    return urls
+
+
+def test_priority_order():
+    """测试优先级高的先出队,同一优先级按加入的顺序出队,多次写入之间也保持先进先出"""
+    scheduler = RedisPriorityScheduler(make_spider(redis_push_batch=100, redis_push_interval=60), MemoryFilter())
+    for name, priority in (("a", 0), ("b", 5), ("c", -1), ("d", 5), ("e", 0)):
+        scheduler.add_job(Request(url=f"https://example.com/{name}", priority=priority))
+    scheduler.flush()
+    scheduler.add_job(Request(url="https://example.com/f", priority=5))
+    scheduler.add_job(Request(url="https://example.com/g", priority=0))
+    scheduler.flush()
+    assert [url[-1] for url in drain(scheduler)] == ["b", "d", "f", "a", "e", "g", "c"]
+
+
+def test_priority_consumers_no_duplicates():
+    """测试两个节点同时批量出队,任务不会重复也不会丢失"""
+    server = fakeredis.FakeStrictRedis()
+    producer = RedisPriorityScheduler(make_spider(server, redis_push_batch=50), MemoryFilter())
+    urls = [f"https://example.com/{i}" for i in range(200)]
+    for i, url in enumerate(urls):
+        producer.add_job(Request(url=url, priority=i % 3))
+    producer.flush()
+    consumers = [RedisPriorityScheduler(make_spider(server), MemoryFilter()) for _ in range(2)]
+    results = [[] for _ in consumers]
+    threads = [threading.Thread(target=lambda c=c, r=r: r.extend(drain(c))) for c, r in zip(consumers, results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    popped = results[0] + results[1]
+    assert len(popped) == len(set(popped)) == 200
+    assert set(popped) == set(urls)
+
+
+def test_priority_size_and_empty():
+    """测试 size/empty 包含本地缓存、redis 和本地队列中的任务"""
+    scheduler = RedisPriorityScheduler(make_spider(redis_push_batch=100, redis_push_interval=60), MemoryFilter())
+    assert scheduler.empty() and scheduler.size() == 0
+    for i in range(5):
+        scheduler.add_job(Request(url=f"https://example.com/{i}"))
+    assert not scheduler.empty() and scheduler.size() == 5
+    scheduler.flush()
+    assert scheduler.server.zcard(scheduler.request_key) == 5
+    assert scheduler.size() == 5
+    assert scheduler.next_job() is not None  # 取出3个到本地队列,返回其中一个
+    assert scheduler.size() == 2 and not scheduler.empty()
+    drain(scheduler)
+    assert scheduler.empty() and scheduler.size() == 0
+
+
+def test_push_batch_flush():
+    """测试缓存达到 redis_push_batch 条时一次写入redis,并记录写入统计"""
+    spider = make_spider(redis_push_batch=3, redis_push_interval=60)
+    scheduler = RedisScheduler(spider, MemoryFilter())
+    for i in range(2):
+        scheduler.add_job(Request(url=f"https://example.com/{i}"))
+    assert scheduler.server.llen(scheduler.request_key) == 0
+    scheduler.add_job(Request(url="https://example.com/2"))
+    assert scheduler.server.llen(scheduler.request_key) == 3
+    assert scheduler.push_buffer == []
+    assert spider.stats.get_value("redis_push/flush_count") == 1
+    assert spider.stats.get_value("redis_push/flush_items") == 3
+    assert spider.stats.get_value("redis_push/flush_max_size") == 3
+
+
+def test_push_interval_flush():
+    """测试距离上次写入超过 redis_push_interval 后,新任务和取任务都会触发写入"""
+    scheduler = RedisScheduler(make_spider(redis_push_batch=100, redis_push_interval=0.05), MemoryFilter())
+    scheduler.add_job(Request(url="https://example.com/0"))
+    assert scheduler.server.llen(scheduler.request_key) == 0
+    time.sleep(0.06)
+    scheduler.add_job(Request(url="https://example.com/1"))
+    assert scheduler.server.llen(scheduler.request_key) == 2
+    scheduler.add_job(Request(url="https://example.com/2"))
+    scheduler.queue.put(Request(url="https://example.com/local"))  # 本地队列不为空时也要按时间写入
+    time.sleep(0.06)
+    scheduler.next_job()
+    assert scheduler.server.llen(scheduler.request_key) == 3
+
+
+def test_push_failure_requeue():
+    """测试 RPUSH 失败时任务放回缓存,下次按原来的顺序写入"""
+    spider = make_spider(redis_push_batch=100, redis_push_interval=60)
+    scheduler = RedisScheduler(spider, MemoryFilter())
+    rpush = scheduler.server.rpush
+
+    def broken_rpush(*args):
+        raise ConnectionError("redis is down")
+
+    scheduler.server.rpush = broken_rpush
+    for i in range(2):
+        scheduler.add_job(Request(url=f"https://example.com/{i}"))
+    scheduler.flush()
+    assert len(scheduler.push_buffer) == 2
+    assert spider.stats.get_value("redis_push/flush_count") is None
+    scheduler.add_job(Request(url="https://example.com/2"))
+    scheduler.server.rpush = rpush
+    scheduler.flush()
+    assert scheduler.push_buffer == []
+    assert drain(scheduler) == [f"https://example.com/{i}" for i in range(3)]
+
+
+def test_close_flushes_buffer():
+    """测试爬虫结束时写入缓存中的任务,其他节点可以继续执行"""
+    server = fakeredis.FakeStrictRedis()
+    scheduler = RedisScheduler(make_spider(server, redis_push_batch=100, redis_push_interval=60), MemoryFilter())
+    scheduler.add_job(Request(url="https://example.com/0"))
+    scheduler.close()
+    assert scheduler.push_buffer == []
+    other = RedisScheduler(make_spider(server), MemoryFilter())
+    assert drain(other) == ["https://example.com/0"]
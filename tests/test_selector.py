@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from smallder import Request, Response, Selector
+from smallder.core import selector as selector_module
+
+HTML = """
+<html><body>
+  <div class="item" id="first"><a href="/1">one</a><span>1.5</span></div>
+  <div class="item"><a href="/2">two</a></div>
+  <p>中文</p>
+</body></html>
+"""
+
+
+def make_response(content, **kwargs):
+    return Response(content=content, request=Request(url="https://example.com"), **kwargs)
+
+
+def test_xpath():
+    """测试 xpath 和 get/getall/attrib"""
+    response = make_response(HTML.encode("utf-8"))
+    assert response.xpath("//a/@href").getall() == ["/1", "/2"]
+    assert response.xpath("//a/text()").get() == "one"
+    assert response.xpath("//div[@id='missing']/text()").get() is None
+    assert response.xpath("//div[@id='missing']/text()").get(default="") == ""
+    assert response.xpath("//div").attrib == {"class": "item", "id": "first"}
+    assert response.xpath("//p/text()").get() == "中文"
+    assert response.xpath("//div/a").get() == '<a href="/1">one</a>'
+    assert response.xpath("count(//a)").get() == "2.0"
+    assert response.xpath("//a[@href=$href]/text()", href="/2").get() == "two"
+    assert response.xpath("//a[re:test(@href, '2$')]/text()").getall() == ["two"]
+
+
+def test_nested_selector():
+    """测试在选择结果上继续选择"""
+    response = make_response(HTML.encode("utf-8"))
+    items = response.xpath("//div[@class='item']")
+    assert [item.xpath("./a/text()").get() for item in items] == ["one", "two"]
+    assert items.xpath("./span/text()").getall() == ["1.5"]
+    assert response.xpath("//a/@href")[0].xpath("./text()").getall() == []
+    assert response.selector is response.selector
+
+
+def test_css():
+    """测试 css 选择器和 ::text ::attr() 伪元素"""
+    pytest.importorskip("cssselect")
+    selector = Selector(HTML)
+    assert selector.css("div.item > a::attr(href)").getall() == ["/1", "/2"]
+    assert selector.css("#first a::text").get() == "one"
+    assert selector.css("div.item").css("span::text").getall() == ["1.5"]
+
+
+def test_xpath_compiled_per_thread():
+    """测试编译后的xpath按线程缓存"""
+    compiled = selector_module.compile_xpath("//a")
+    assert selector_module.compile_xpath("//a") is compiled
+    other = []
+    thread = threading.Thread(target=lambda: other.append(selector_module.compile_xpath("//a")))
+    thread.start()
+    thread.join()
+    assert other[0] is not compiled
+
+
+def test_parse_limit():
+    """测试只解析前 parse_limit 字节, text 不受影响"""
+    content = ("<html><body><p>中文一</p>" + "<p>后面的内容</p>" * 100 + "</body></html>").encode("utf-8")
+    response = make_response(content, parse_limit=60)
+    paragraphs = response.xpath("//p/text()").getall()
+    assert paragraphs[0] == "中文一"
+    assert len(paragraphs) < 10
+    assert response.text == content.decode("utf-8")
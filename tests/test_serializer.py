@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from smallder import Request, Spider
+from smallder.core.serializer import RequestSerializer
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0", "Accept": "text/html"}
+
+
+class SerializeSpider(Spider):
+    name = "serialize"
+
+    def parse_detail(self, response):
+        pass
+
+    def on_error(self, failure):
+        pass
+
+
+def make_request(i=0):
+    spider = SerializeSpider()
+    return Request(url=f"https://example.com/item/{i}", headers=dict(HEADERS), callback=spider.parse_detail,
+                   errback=spider.on_error, meta={"page": i, 1: "int key"}, priority=3, data={"q": "test"},
+                   header_template="desktop")
+
+
+def assert_same(request, restored):
+    for attr in Request.attributes:
+        if attr in ("callback", "errback", "fetch"):
+            continue
+        assert getattr(restored, attr) == getattr(request, attr), attr
+    assert restored.callback.__name__ == "parse_detail"
+    assert restored.errback.__name__ == "on_error"
+
+
+@pytest.mark.parametrize("serializer_format", ["msgpack", "json"])
+def test_roundtrip(serializer_format):
+    """测试序列化后可以还原, 并且比完整json小"""
+    if serializer_format == "msgpack":
+        pytest.importorskip("msgpack")
+    spider = SerializeSpider()
+    spider.custom_settings = {"request_serializer": serializer_format}
+    serializer = RequestSerializer(spider)
+    request = make_request()
+    data = serializer.dumps(request)
+    restored = serializer.loads(data)
+    if serializer_format == "json":
+        # json 的 key 只能是字符串
+        request.meta["1"] = request.meta.pop(1)
+    assert_same(request, restored)
+    assert len(data) < len(json.dumps(request.to_dict(spider)))
+
+
+def test_defaults_omitted():
+    """测试和默认值相同的字段不会写入"""
+    spider = SerializeSpider()
+    spider.custom_settings = {"request_serializer": "json"}
+    data = RequestSerializer(spider).dumps(Request(url="https://example.com"))
+    assert data == b'\x02{"u":"https://example.com"}'
+
+
+def test_legacy_json():
+    """测试可以读取升级前写入的完整json"""
+    spider = SerializeSpider()
+    request = make_request()
+    request.meta.pop(1)
+    restored = RequestSerializer(spider).loads(json.dumps(request.to_dict(spider)).encode())
+    assert_same(request, restored)
+
+
+def test_header_profiles():
+    """测试相同的 headers 只在redis中保存一次, 其他节点可以还原"""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeStrictRedis()
+    spider = SerializeSpider()
+    writer = RequestSerializer(spider, server=server, headers_key="serialize:headers")
+    datas = [writer.dumps(make_request(i)) for i in range(100)]
+    assert server.hlen("serialize:headers") == 1
+    assert b"Mozilla" not in datas[0]
+    reader = RequestSerializer(spider, server=server, headers_key="serialize:headers")
+    restored = reader.loads(datas[5])
+    assert_same(make_request(5), restored)
+    restored.headers["Cookie"] = "a=1"
+    assert "Cookie" not in reader.loads(datas[6]).headers
+
+    spider.custom_settings = {"header_profiles_limit": 1}
+    limited = RequestSerializer(spider, server=server, headers_key="serialize:headers")
+    limited.dumps(make_request())
+    request = make_request()
+    request.headers = {"User-Agent": "other"}
+    assert b"other" in limited.dumps(request)
+
+
+def test_header_profiles_key_order():
+    """测试 key 顺序不同的相同 headers 共用一个 profile, 无法排序的 headers 完整保存"""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeStrictRedis()
+    spider = SerializeSpider()
+    spider.custom_settings = {"header_profiles_limit": 1}
+    writer = RequestSerializer(spider, server=server, headers_key="serialize:headers")
+    first = writer.intern_headers({"User-Agent": "Mozilla", "Accept": "*/*"})
+    assert first is not None
+    assert writer.intern_headers({"Accept": "*/*", "User-Agent": "Mozilla"}) == first
+    assert server.hlen("serialize:headers") == 1
+    spider.custom_settings = {}
+    other = RequestSerializer(spider, server=server, headers_key="serialize:headers")
+    assert other.intern_headers({"Accept": "*/*", 1: "x"}) is None
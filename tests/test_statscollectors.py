@@ -0,0 +1,110 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from smallder import Request, Response
+from smallder.core.statscollectors import Histogram, StatsCollector
+
+
+def make_response(url, status_code=200, elapsed=0.1, raw_size=None, size=None):
+    return Response(url=url, status_code=status_code, request=Request(url=url), content=b"",
+                    elapsed=timedelta(seconds=elapsed), raw_size=raw_size, size=size)
+
+
+def test_inc_value_threads():
+    """测试多线程计数汇总后不丢失"""
+    stats = StatsCollector(spider=None)
+
+    def work():
+        for _ in range(10000):
+            stats.inc_value("request")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.get_value("request") == 80000
+    assert stats.get_stats()["request"] == 80000
+    stats.inc_value("retry", start=10)
+    stats.inc_value("retry", start=10)
+    assert stats.get_value("retry") == 12
+    assert stats.get_value("missing", 0) == 0
+
+
+def test_histogram():
+    """测试分位数的误差在一个桶以内"""
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.add(i / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["max"] == 1.0
+    for percent, expected in ((50, 0.5), (95, 0.95), (99, 0.99)):
+        assert expected <= summary[f"p{percent}"] <= expected * Histogram.growth
+
+
+def test_record_response():
+    """测试记录状态码、响应耗时和按域名统计的流量"""
+    stats = StatsCollector(spider=None)
+    stats.record_response(make_response("https://a.com/1", raw_size=100, size=400))
+    stats.record_response(make_response("https://a.com/2", status_code=404, elapsed=0.3, raw_size=100, size=400))
+    stats.record_response(make_response("https://b.com/1", raw_size=50, size=50))
+    stats.record_response(make_response("https://c.com/1", elapsed=0))
+    result = stats.get_stats()
+    assert result["response/status/200"] == 3
+    assert result["response/status/404"] == 1
+    assert result["response/latency"]["count"] == 3
+    assert result["bandwidth/raw_bytes"] == 250
+    assert result["bandwidth/bytes"] == 850
+    assert {domain: value["requests"] for domain, value in result["domains"].items()} == {"a.com": 2, "b.com": 1}
+    assert result["domains"]["a.com"]["bytes"] == 800
+    stats.on_spider_stopped(None)
+    assert stats.get_value("bandwidth/compression_ratio") == 3.4
+    stats.clear_stats()
+    assert stats.get_stats() == {}
+
+
+def test_stats_collector_factory():
+    """测试根据 stats_collector_class 创建统计收集器"""
+    from smallder.core.statscollectors import StatsCollectorFactory
+
+    class Spider:
+        custom_settings = {"stats_collector_class": "smallder.core.statscollectors.StatsCollector"}
+
+    assert type(StatsCollectorFactory.create_stats_collector(Spider())) is StatsCollector
+
+
+def test_redis_stats_collector():
+    """测试多个节点的计数增量写入redis后汇总"""
+    fakeredis = pytest.importorskip("fakeredis")
+    from smallder.core.statscollectors import RedisStatsCollector
+
+    server = fakeredis.FakeStrictRedis()
+
+    class Spider:
+        name = "cluster"
+        custom_settings = {"stats_flush_interval": 60}
+        futures = []
+
+    Spider.server = server
+    nodes = [RedisStatsCollector(Spider()) for _ in range(2)]
+    for i, node in enumerate(nodes):
+        node.node = f"node-{i}"
+        node.inc_value("request", 10)
+        node.record_response(make_response("https://a.com/", elapsed=0.2, raw_size=10, size=20))
+        node.flush()
+    nodes[0].inc_value("request", 5)
+    nodes[0].flush()
+    nodes[0].flush()
+    stats = nodes[1].get_cluster_stats()
+    assert stats["request"] == 25
+    assert stats["response/status/200"] == 2
+    assert stats["bandwidth/raw_bytes"] == 20
+    assert stats["domains"] == {"a.com": {"requests": 2, "raw_bytes": 20, "bytes": 40}}
+    assert stats["response/latency"]["count"] == 2
+    assert 0.2 <= stats["response/latency"]["p50"] <= 0.2 * 1.05
+    assert stats["nodes"] == 2
+    # 本地的统计只包含当前节点
+    assert nodes[1].get_value("request") == 10
@@ -0,0 +1,183 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from smallder import Spider, Request, Response
+from smallder.core import engine as engine_module
+from smallder.core.error import RetryException
+from smallder.core.throttle import DomainThrottle
+
+
+class ThrottleSettings:
+    def __init__(self, **settings):
+        self.custom_settings = settings
+
+
+def test_throttle_disabled_by_default():
+    """测试没有配置限流时不启用"""
+    assert not DomainThrottle(ThrottleSettings()).enabled
+    with pytest.raises(ValueError):
+        DomainThrottle(ThrottleSettings(throttle_key="host"))
+
+
+def test_domain_concurrency():
+    """测试同一个域名的并发数限制,不同域名互不影响"""
+    throttle = DomainThrottle(ThrottleSettings(domain_concurrency=1))
+    first = Request(url="https://a.example.com/1")
+    second = Request(url="https://a.example.com/2")
+    other = Request(url="https://b.example.com/1")
+    assert throttle.acquire(first)
+    assert not throttle.acquire(second)
+    throttle.defer(second)
+    assert throttle.acquire(other)
+    assert throttle.pop_ready() is None
+    throttle.release(first)
+    assert throttle.pop_ready() is second
+    assert throttle.deferred == 0
+
+
+def test_download_delay():
+    """测试同一个域名两次请求之间的最小间隔"""
+    throttle = DomainThrottle(ThrottleSettings(download_delay=0.2))
+    assert throttle.acquire(Request(url="https://a.example.com/1"))
+    throttle.release(Request(url="https://a.example.com/1"))
+    request = Request(url="https://a.example.com/2")
+    assert not throttle.acquire(request)
+    throttle.defer(request)
+    assert throttle.pop_ready() is None
+    assert 0 < throttle.wait_time() <= 0.2
+    time.sleep(throttle.wait_time())
+    assert throttle.pop_ready() is request
+
+
+def test_autothrottle_adjust_delay():
+    """测试自动限流根据响应耗时调整下载间隔,错误响应不会减小间隔"""
+    throttle = DomainThrottle(ThrottleSettings(autothrottle=True, autothrottle_start_delay=1))
+    request = Request(url="https://a.example.com/1")
+
+    def respond(status_code, seconds):
+        assert throttle.acquire(request)
+        slot = throttle.slots["a.example.com"]
+        slot.last_start = 0  # 忽略下载间隔,直接进行下一次请求
+        response = Response(status_code=status_code, request=request, elapsed=timedelta(seconds=seconds))
+        throttle.release(request, response)
+        return slot.delay
+
+    assert respond(200, 3) == 3
+    assert respond(500, 0.2) == 3
+    assert respond(200, 0.2) == pytest.approx(1.6)
+
+
+class ThrottleSpider(Spider):
+    name = "throttle_engine_test"
+    fastapi = False
+    thread_count = 8
+    custom_settings = {"domain_concurrency": 2}
+    active = {}
+    max_active = {}
+    items = []
+    lock = threading.Lock()
+
+    @classmethod
+    def fetch(cls, request):
+        host = request.url.split("/")[2]
+        with cls.lock:
+            cls.active[host] = cls.active.get(host, 0) + 1
+            cls.max_active[host] = max(cls.max_active.get(host, 0), cls.active[host])
+        time.sleep(0.02)
+        with cls.lock:
+            cls.active[host] -= 1
+        return Response(content=request.url.encode(), status_code=200, request=request)
+
+    def start_requests(self):
+        for i in range(10):
+            for host in ("a.example.com", "b.example.com"):
+                yield Request(url=f"https://{host}/{i}", fetch=self.fetch, callback=self.detail)
+
+    def detail(self, response):
+        yield {"url": response.text}
+
+    def pipline(self, item):
+        self.items.append(item)
+
+
+def test_engine_domain_concurrency():
+    """测试引擎按域名限制并发数并且所有请求都能执行完"""
+    ThrottleSpider.start()
+    assert len(ThrottleSpider.items) == 20
+    assert ThrottleSpider.max_active == {"a.example.com": 2, "b.example.com": 2}
+
+
+class RetryThrottleSpider(Spider):
+    name = "throttle_retry_test"
+    fastapi = False
+    thread_count = 8
+    max_retry = 5
+    custom_settings = {"domain_concurrency": 1}
+    attempts = {}
+    items = []
+
+    @classmethod
+    def fetch(cls, request):
+        cls.attempts[request.url] = cls.attempts.get(request.url, 0) + 1
+        if cls.attempts[request.url] < 3:
+            raise RetryException("retry")
+        return Response(content=request.url.encode(), status_code=200, request=request)
+
+    def start_requests(self):
+        for i in range(5):
+            for host in ("a.example.com", "b.example.com"):
+                yield Request(url=f"https://{host}/{i}", fetch=self.fetch, callback=self.detail)
+
+    def detail(self, response):
+        yield {"url": response.text}
+
+    def pipline(self, item):
+        self.items.append(item)
+
+
+def test_engine_retry_releases_slot(monkeypatch):
+    """测试重试的请求在重新放入调度器之前释放限流名额,不会泄漏"""
+    throttles = []
+
+    reacquired = []
+
+    class RecordThrottle(DomainThrottle):
+        def __init__(self, spider):
+            super().__init__(spider)
+            throttles.append(self)
+
+        def acquire(self, request):
+            # 上一次下载还没有释放名额时同一个请求又被取出
+            reacquired.append(id(request) in self.active_keys)
+            return super().acquire(request)
+
+        def release(self, request, response=None):
+            time.sleep(0.02)  # 放大释放之前的时间窗口
+            super().release(request, response)
+
+    monkeypatch.setattr(engine_module, "DomainThrottle", RecordThrottle)
+    RetryThrottleSpider.start()
+    assert len(RetryThrottleSpider.items) == 10
+    assert [slot.active for slot in throttles[0].slots.values()] == [0, 0]
+    assert throttles[0].active_keys == {}
+    assert not any(reacquired)
+
+
+def test_ip_key_resolved_outside_lock(monkeypatch):
+    """测试 ip 模式下解析域名时不持有锁,其他线程可以释放名额"""
+    throttle = DomainThrottle(ThrottleSettings(domain_concurrency=1, throttle_key="ip"))
+    locked = []
+
+    def resolve(host):
+        locked.append(throttle.lock.locked())
+        return "127.0.0.1"
+
+    monkeypatch.setattr("smallder.core.throttle.resolve_host", resolve)
+    request = Request(url="https://a.example.com/1")
+    assert throttle.acquire(request)
+    throttle.defer(Request(url="https://b.example.com/1"))
+    assert locked == [False, False]
+    assert throttle.deferred == 1